@@ -1,159 +1,300 @@
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
-from database import execute_query, execute_non_query
+from datetime import datetime
+from database import execute_query, transaction, merge_rows
+from coins import registry, BASE_INTERVAL
+from watermarks import touch_watermarks
+
+HISTORY_BARS = 100          # hər coin üçün baxılan son bar sayı
+MIN_BARS = 10
+MIN_CHANGES = 5
+THRESHOLD_MULTIPLIER = 3    # threshold = max(orta |dəyişiklik| × 3, 5%)
+MIN_THRESHOLD_PERCENT = 5.0
+ALERT_TYPE = "Böyük dəyişiklik"
+ALERT_COLUMNS = ["CoinID", "CurrentPrice", "ReferencePrice", "ChangePercent", "AlertType", "AlertDate"]
+STATE_COLUMNS = ["CoinID", "Interval", "LastOpenTime", "LastClose", "Bars", "Changes", "Position", "SumAbs", "UpdatedDate"]
+
+# Bütün coin-lərin son N close-u və hər coin-in son alert-i bir sorğu ilə gətirilir;
+# alert sütunları yalnız ən son bar-ın (rn = 1) sətrində doludur
+HISTORY_QUERY = """
+    WITH closes AS (
+        SELECT ph.CoinID, ph.CloseTime, ph.ClosePrice,
+               ROW_NUMBER() OVER (PARTITION BY ph.CoinID ORDER BY ph.OpenTime DESC) AS rn
+        FROM dbo.PriceHistory ph
+        WHERE ph.Interval = ?
+    ), last_alerts AS (
+        SELECT a.CoinID, a.CurrentPrice, a.ReferencePrice, a.ChangePercent, a.AlertType, a.AlertDate,
+               ROW_NUMBER() OVER (PARTITION BY a.CoinID ORDER BY a.AlertDate DESC) AS rn
+        FROM dbo.AnomalyAlerts a
+    )
+    SELECT c.CoinID, c.rn, c.CloseTime, c.ClosePrice,
+           a.CurrentPrice, a.ReferencePrice, a.ChangePercent, a.AlertType, a.AlertDate
+    FROM closes c
+    LEFT JOIN last_alerts a ON a.CoinID = c.CoinID AND a.rn = 1 AND c.rn = 1
+    WHERE c.rn <= ?
+"""
+
 
 def get_all_coins():
-    query = "SELECT CoinID, Symbol FROM dbo.Coins ORDER BY Symbol"
-    df = execute_query(query)
-    if df is not None and not df.empty:
-        return df.to_dict('records')
-    return []
-
-
-def get_price_history(coin_id, days=100):
-    query = """
-        SELECT TOP (?) CloseTime, ClosePrice
-        FROM dbo.PriceHistory
-        WHERE CoinID = ?
-        ORDER BY CloseTime DESC
-    """
-    df = execute_query(query, params=(days, coin_id))
-    if df is not None and not df.empty:
-        df = df.sort_values('CloseTime').reset_index(drop=True)
-        return df
-    return None
-
-
-def get_last_processed_date(coin_id):
-    query = """
-        SELECT TOP 1 AlertDate
-        FROM dbo.AnomalyAlerts
-        WHERE CoinID = ?
-        ORDER BY AlertDate DESC
-    """
-    df = execute_query(query, params=(coin_id,))
-    if df is not None and not df.empty:
-        return pd.to_datetime(df['AlertDate'].iloc[0]).date()
-    return None
-
-
-def get_last_data_date(coin_id):
-    query = """
-        SELECT MAX(CloseTime) AS LastDataDate
-        FROM dbo.PriceHistory
-        WHERE CoinID = ?
-    """
-    df = execute_query(query, params=(coin_id,))
-    if df is not None and not df.empty and df['LastDataDate'].iloc[0] is not None:
-        return pd.to_datetime(df['LastDataDate'].iloc[0]).date()
-    return None
-
-
-def check_alerts_for_coin(coin):
-    coin_id = coin['CoinID']
-    symbol = coin['Symbol']
-    df = get_price_history(coin_id, days=100)
-    if df is None or len(df) < 10:
-        return None
-
-    last_data_date = get_last_data_date(coin_id)
-    df['ChangePercent'] = df['ClosePrice'].pct_change() * 100
-    valid_changes = df['ChangePercent'].dropna()
-    alert = None
-    if len(valid_changes) >= 5:
-        mean_change = valid_changes.abs().mean()
-        last_change = df['ChangePercent'].iloc[-1]
-
-        if not pd.isna(last_change):
-            threshold = max(mean_change * 3, 5.0)
-
-            if abs(last_change) >= threshold:
-                alert_date = pd.to_datetime(df['CloseTime'].iloc[-1]).date()
-                alert = {
-                    'CoinID': coin_id,
-                    'CoinSymbol': symbol,
-                    'CurrentPrice': float(df['ClosePrice'].iloc[-1]),
-                    'ReferencePrice': float(df['ClosePrice'].iloc[-2]),
-                    'ChangePercent': float(last_change),
-                    'AlertType': 'Böyük dəyişiklik',
-                    'AlertDate': alert_date,
-                    'IsStale': False}
-                save_alert(alert)
-
-    if alert is None:
-        query = """
-            SELECT TOP 1 CoinID, CurrentPrice, ReferencePrice,
-                   ChangePercent, AlertType, AlertDate
-            FROM dbo.AnomalyAlerts
-            WHERE CoinID = ?
-            ORDER BY AlertDate DESC
-        """
-        df_last = execute_query(query, params=(coin_id,))
-        if df_last is not None and not df_last.empty:
-            row = df_last.iloc[0]
-            alert_date = pd.to_datetime(row['AlertDate']).date()
-            alert = {
-                'CoinID': row['CoinID'],
-                'CoinSymbol': symbol,
-                'CurrentPrice': float(row['CurrentPrice']),
-                'ReferencePrice': float(row['ReferencePrice']),
-                'ChangePercent': float(row['ChangePercent']),
-                'AlertType': row['AlertType'],
-                'AlertDate': alert_date,
-                'IsStale': last_data_date and alert_date < last_data_date}
-    return alert
-
-
-def save_alert(alert):
-    query_check = """
-        SELECT 1 
-        FROM dbo.AnomalyAlerts
-        WHERE CoinID = ? AND AlertDate = ?
-    """
-    exists = execute_query(query_check, params=(alert['CoinID'], alert['AlertDate']))
-    if exists is not None and not exists.empty:
-        return
-    
-    query_insert = """
-        INSERT INTO dbo.AnomalyAlerts
-        (CoinID, CurrentPrice, ReferencePrice, ChangePercent, AlertType, AlertDate)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """
-    params = (alert['CoinID'], alert['CurrentPrice'], alert['ReferencePrice'], alert['ChangePercent'], alert['AlertType'], alert['AlertDate'])
-    execute_non_query(query_insert, params)
+    return registry.coins()
+
+
+def load_history(bars=HISTORY_BARS):
+    return execute_query(HISTORY_QUERY, params=(BASE_INTERVAL, bars))
+
+
+def close_matrix(df, coin_ids, bars=HISTORY_BARS):
+    """(coin, bar) ölçülü close massivi, köhnədən yeniyə; tarixçəsi qısa olan coin-lər solda NaN ilə doldurulur"""
+    rows = pd.Index(coin_ids).get_indexer(df["CoinID"])
+    known = rows >= 0
+    closes = np.full((len(coin_ids), bars), np.nan)
+    closes[rows[known], bars - df["rn"].to_numpy(dtype=np.int64)[known]] = df["ClosePrice"].to_numpy(dtype=np.float64)[known]
+    return closes
+
+
+def detect(closes):
+    """Bütün coin-lər üçün bir dəfəyə: son bar-ın faiz dəyişikliyi və alert şərti (|dəyişiklik| >= threshold)"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        changes = np.diff(closes, axis=1) / closes[:, :-1] * 100
+        counts = np.count_nonzero(~np.isnan(changes), axis=1)
+        mean_change = np.nansum(np.abs(changes), axis=1) / counts
+    last_change = changes[:, -1]
+    threshold = np.maximum(mean_change * THRESHOLD_MULTIPLIER, MIN_THRESHOLD_PERCENT)
+    enough = (np.count_nonzero(~np.isnan(closes), axis=1) >= MIN_BARS) & (counts >= MIN_CHANGES)
+    with np.errstate(invalid="ignore"):
+        fired = enough & (np.abs(last_change) >= threshold)
+    return last_change, fired
+
+
+def save_alerts(alerts):
+    """Yeni alert-ləri UQ_AnomalyAlerts_CoinID_AlertDate üzrə bir MERGE ilə yazır (mövcud olanlara toxunmur)"""
+    rows = [tuple(alert[c] for c in ALERT_COLUMNS) for alert in alerts]
+    try:
+        with transaction() as conn:
+            merge_rows(conn, "dbo.AnomalyAlerts", ALERT_COLUMNS, ["CoinID", "AlertDate"], rows)
+            touch_watermarks(conn, {row[0] for row in rows}, BASE_INTERVAL)  # /alert keşi yenilənsin
+    except Exception as e:
+        print(f"❌ Alert yazma xətası: {e}")
+
+
+class AnomalyState:
+    """Bir coin-in son HISTORY_BARS close-u üzrə rolling vəziyyəti: |dəyişiklik|-lərin ring buffer-i və onların cəmi.
+    Hər yeni bar O(1) işdir, qayda detect() ilə eynidir"""
+    size = HISTORY_BARS - 1
+
+    def __init__(self, last_open_time=None, last_close=None, bars=0, changes=None, position=0, sum_abs=0.0):
+        self.last_open_time = last_open_time
+        self.last_close = last_close
+        self.bars = bars
+        self.changes = np.zeros(self.size) if changes is None else changes
+        self.position = position
+        self.sum_abs = sum_abs
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(pd.Timestamp(row["LastOpenTime"]), float(row["LastClose"]), int(row["Bars"]),
+                   np.frombuffer(bytes(row["Changes"]), dtype=np.float64).copy(), int(row["Position"]), float(row["SumAbs"]))
+
+    def to_row(self, coin_id, interval):
+        return (coin_id, interval, self.last_open_time.to_pydatetime(), self.last_close, self.bars,
+                self.changes.tobytes(), self.position, self.sum_abs, datetime.now())
+
+    def push(self, open_time, close):
+        """Yeni bar-ı pəncərəyə əlavə edir; alert şərti ödənirsə faiz dəyişikliyini, əks halda None qaytarır"""
+        change = None
+        if self.bars:
+            change = (close - self.last_close) / self.last_close * 100
+            if self.bars == HISTORY_BARS:
+                self.sum_abs -= self.changes[self.position]  # ən köhnə dəyişiklik pəncərədən çıxır
+            self.changes[self.position] = abs(change)
+            self.sum_abs += abs(change)
+            self.position = (self.position + 1) % self.size
+            if self.position == 0:
+                self.sum_abs = float(self.changes.sum())  # float xətası yığılmasın deyə hər dövrədə bir dəfə
+        self.bars = min(self.bars + 1, HISTORY_BARS)
+        self.last_open_time = pd.Timestamp(open_time)
+        self.last_close = close
+
+        count = self.bars - 1
+        if change is None or self.bars < MIN_BARS or count < MIN_CHANGES:
+            return None
+        threshold = max(self.sum_abs / count * THRESHOLD_MULTIPLIER, MIN_THRESHOLD_PERCENT)
+        return change if abs(change) >= threshold else None
+
+
+def load_state(conn, coin_id, interval, before):
+    """Saxlanmış vəziyyət; yoxdursa before-dan əvvəlki son HISTORY_BARS close-dan bir dəfəlik qurulur.
+    SQL Server-də sətir commit-ə qədər kilidlənir: paralel transaction (stream flush və gap backfill) eyni
+    vəziyyəti oxuyub bir-birinin bar-larını itirməsin. SQLite-da PriceHistory merge-i artıq yazma kilidini
+    tutur; proses daxilində yazılar pipeline.write_lock ilə ardıcıllaşdırılır"""
+    df = execute_query(f"SELECT {', '.join(STATE_COLUMNS)} FROM dbo.AnomalyState WITH (UPDLOCK, HOLDLOCK) WHERE CoinID = ? AND Interval = ?",
+                       (coin_id, interval), conn=conn)
+    if not df.empty:
+        return AnomalyState.from_row(df.iloc[0])
+    return history_state(conn, coin_id, interval, before)
+
+
+def history_state(conn, coin_id, interval, before):
+    """before-dan əvvəlki son HISTORY_BARS close-dan qurulan vəziyyət"""
+    history = execute_query("""
+        SELECT TOP (?) ph.OpenTime, ph.ClosePrice FROM dbo.PriceHistory ph
+        WHERE ph.CoinID = ? AND ph.Interval = ? AND ph.OpenTime < ?
+        ORDER BY ph.OpenTime DESC
+    """, (HISTORY_BARS, coin_id, interval, before), conn=conn)
+    state = AnomalyState()
+    for open_time, close in zip(history["OpenTime"][::-1], history["ClosePrice"][::-1]):
+        state.push(open_time, float(close))
+    return state
+
+
+def update_state(conn, coin_id, interval, df):
+    """Pipeline insert batch-i ilə eyni transaction-da (merge-dən sonra) çağırır: yeni bar-lar vəziyyətə əlavə olunur,
+    şərti ödəyən bar-lar üçün alert yazılır. Yazılan alert sayını qaytarır"""
+    open_times = pd.DatetimeIndex(df["open_time"])
+    close_times = pd.DatetimeIndex(df["close_time"])
+    closes = df["close"].to_numpy(dtype=np.float64)
+    start = open_times.min().to_pydatetime()
+    state = load_state(conn, coin_id, interval, start)
+
+    replay = state.last_open_time is not None and open_times.min() < state.last_open_time
+    if replay:
+        # Batch vəziyyətdəki son bar-dan köhnə bar-lar gətirir (gap backfill yeni stream bar-ından sonra commit olunub).
+        # Vəziyyət həmin bar-lardan əvvəlki tarixçədən yenidən qurulur və batch daxil sonrakı bütün bar-lar DB-dən keçilir
+        state = history_state(conn, coin_id, interval, start)
+        bars = execute_query("""
+            SELECT ph.OpenTime, ph.CloseTime, ph.ClosePrice FROM dbo.PriceHistory ph
+            WHERE ph.CoinID = ? AND ph.Interval = ? AND ph.OpenTime >= ?
+            ORDER BY ph.OpenTime ASC
+        """, (coin_id, interval, start), conn=conn)
+        open_times = pd.DatetimeIndex(bars["OpenTime"])
+        close_times = pd.DatetimeIndex(bars["CloseTime"])
+        closes = bars["ClosePrice"].to_numpy(dtype=np.float64)
+
+    alerts = []
+    for open_time, close_time, close in zip(open_times, close_times, closes):
+        if state.last_open_time is not None and open_time <= state.last_open_time:
+            continue  # artıq hesablanmış bar (təkrar yükləmə)
+        reference = state.last_close
+        change = state.push(open_time, float(close))
+        if change is not None:
+            alerts.append((coin_id, float(close), reference, change, ALERT_TYPE, close_time.date()))
+
+    if state.last_open_time is None:
+        return 0
+    # yenidən qurulan vəziyyətin LastOpenTime-ı saxlanmışla eynidir, ona görə şərtsiz yazılır
+    merge_rows(conn, "dbo.AnomalyState", STATE_COLUMNS, ["CoinID", "Interval"], [state.to_row(coin_id, interval)],
+               update_columns=STATE_COLUMNS[2:], only_if_greater=None if replay else "LastOpenTime")
+    merge_rows(conn, "dbo.AnomalyAlerts", ALERT_COLUMNS, ["CoinID", "AlertDate"], alerts)
+    return len(alerts)
+
+
+# Hər coin-in son alert-i və son yüklənmiş bar-ın tarixi (IsStale üçün)
+CURRENT_QUERY = """
+    WITH last_alerts AS (
+        SELECT a.CoinID, a.CurrentPrice, a.ReferencePrice, a.ChangePercent, a.AlertType, a.AlertDate,
+               ROW_NUMBER() OVER (PARTITION BY a.CoinID ORDER BY a.AlertDate DESC) AS rn
+        FROM dbo.AnomalyAlerts a
+    )
+    SELECT a.CoinID, c.Symbol, a.CurrentPrice, a.ReferencePrice, a.ChangePercent, a.AlertType, a.AlertDate, w.LastCloseTime
+    FROM last_alerts a
+    JOIN dbo.Coins c ON c.CoinID = a.CoinID
+    LEFT JOIN dbo.IngestionWatermarks w ON w.CoinID = a.CoinID AND w.Interval = ?
+    WHERE a.rn = 1
+    ORDER BY c.Symbol
+"""
+
+
+def alert_rows(df):
+    """CURRENT_QUERY nəticəsini (hər coin-in son alert-i) dict-lərə çevirir. Alert-lər ingestion zamanı yazılır;
+    API sorğunu öz async executor-unda, timeout ilə icra edir"""
+    alerts = []
+    for row in df.itertuples(index=False):
+        alert_date = pd.to_datetime(row.AlertDate).date()
+        last_data_date = pd.to_datetime(row.LastCloseTime).date() if not pd.isna(row.LastCloseTime) else None
+        alerts.append({
+            'CoinID': int(row.CoinID),
+            'CoinSymbol': row.Symbol,
+            'CurrentPrice': float(row.CurrentPrice),
+            'ReferencePrice': float(row.ReferencePrice),
+            'ChangePercent': float(row.ChangePercent),
+            'AlertType': row.AlertType,
+            'AlertDate': alert_date,
+            'IsStale': bool(last_data_date and alert_date < last_data_date)})
+    return alerts
 
 
 def check_all_coins():
+    """Bütün coin-lərin son bar-ını bir dəfəyə yenidən yoxlayır (tam yoxlama: py alert.py).
+    Adi iş rejimində alert-lər pipeline-da, update_state ilə yazılır"""
     print("\n" + "="*60)
     print(" - ALERT SİSTEMİ BAŞLADI")
     print("="*60)
-    
+
     coins = get_all_coins()
     if not coins:
         print(" - Coin tapılmadı")
         return []
-    
+
     print(f" - Yoxlanılacaq coinlər: {len(coins)}")
     print("-"*60)
-    
-    alerts = []
-    for coin in coins:
-        alert = check_alerts_for_coin(coin)
-        if alert:
-            alerts.append(alert)
-            emoji = "📈" if alert['ChangePercent'] > 0 else "📉"
-            print(f"{emoji} ALERT: {alert['CoinSymbol']:6s} | "
-                  f"Dəyişiklik: {alert['ChangePercent']:+7.2f}% | "
-                  f"Qiymət: ${alert['CurrentPrice']:.6f}")
-    
+
+    df = load_history()
+    if df is None:
+        return []
+
+    closes = close_matrix(df, [coin["CoinID"] for coin in coins])
+    last_change, fired = detect(closes)
+    history = np.count_nonzero(~np.isnan(closes), axis=1)
+    latest = df[df["rn"] == 1].set_index("CoinID")
+
+    alerts, new_alerts = [], []
+    for i, coin in enumerate(coins):
+        if history[i] < MIN_BARS:
+            continue
+        row = latest.loc[coin["CoinID"]]
+        last_data_date = pd.to_datetime(row["CloseTime"]).date()
+
+        if fired[i]:
+            alert = {
+                'CoinID': coin["CoinID"],
+                'CoinSymbol': coin["Symbol"],
+                'CurrentPrice': float(closes[i, -1]),
+                'ReferencePrice': float(closes[i, -2]),
+                'ChangePercent': float(last_change[i]),
+                'AlertType': ALERT_TYPE,
+                'AlertDate': last_data_date,
+                'IsStale': False}
+            new_alerts.append(alert)
+        elif not pd.isna(row["AlertDate"]):
+            alert_date = pd.to_datetime(row["AlertDate"]).date()
+            alert = {
+                'CoinID': coin["CoinID"],
+                'CoinSymbol': coin["Symbol"],
+                'CurrentPrice': float(row['CurrentPrice']),
+                'ReferencePrice': float(row['ReferencePrice']),
+                'ChangePercent': float(row['ChangePercent']),
+                'AlertType': row['AlertType'],
+                'AlertDate': alert_date,
+                'IsStale': alert_date < last_data_date}
+        else:
+            continue
+
+        alerts.append(alert)
+        emoji = "📈" if alert['ChangePercent'] > 0 else "📉"
+        print(f"{emoji} ALERT: {alert['CoinSymbol']:6s} | "
+              f"Dəyişiklik: {alert['ChangePercent']:+7.2f}% | "
+              f"Qiymət: ${alert['CurrentPrice']:.6f}")
+
+    if new_alerts:
+        save_alerts(new_alerts)
+
     print("-"*60)
     if alerts:
         print(f" - Alert verilən coinlər: {len(alerts)}")
     else:
         print(" - Anomaly tapılmadı")
     print("="*60 + "\n")
-    
+
     return alerts
 
 
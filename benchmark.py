@@ -0,0 +1,271 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import httpx
+from datetime import datetime, timedelta
+import numpy as np
+import database
+from database import transaction, merge_rows, fetch_frame
+from pipeline import PRICE_COLUMNS, RETURN_COLUMNS, return_columns
+from model import window_view, WindowSequence, LOOKBACK, HORIZON
+
+# Lokal benchmark-lar: py benchmark.py [sqlite|duckdb|mssql] [fetch|dataset|load|api ...]
+# sqlite/duckdb üçün müvəqqəti baza yaradılır və süni data yazılır; mssql mövcud PriceHistory-dən oxuyur.
+
+SIZES = [5_000, 500_000]
+REPEAT = 3
+
+FETCH_QUERY = """
+    SELECT TOP (?) OpenTime, CloseTime, OpenPrice, HighPrice, LowPrice, ClosePrice, Volume, NumberOfTrades
+    FROM dbo.PriceHistory
+    ORDER BY CoinID, Interval, OpenTime
+"""
+FETCH_DTYPES = {"OpenTime": "datetime64[ns]", "CloseTime": "datetime64[ns]", "OpenPrice": "float64", "HighPrice": "float64",
+                "LowPrice": "float64", "ClosePrice": "float64", "Volume": "float64", "NumberOfTrades": "int64"}
+
+
+def seed(rows, coins=10):
+    """Hər coin üçün ardıcıl 1m bar-lar yazır"""
+    with transaction() as conn:
+        merge_rows(conn, "dbo.Coins", ["Symbol", "PairSymbol"], ["PairSymbol"], [(f"C{i}", f"C{i}USDT") for i in range(coins)])
+    ids = database.execute_query("SELECT CoinID FROM dbo.Coins")["CoinID"].tolist()
+
+    rng = np.random.default_rng(0)
+    per_coin = rows // len(ids)
+    start = datetime(2020, 1, 1)
+    for coin_id in ids:
+        close = 100 + rng.standard_normal(per_coin).cumsum()
+        prev_close, return_pct = return_columns(close)
+        batch = [(coin_id, "1m", start + timedelta(minutes=i), start + timedelta(minutes=i, seconds=59), float(c), float(c) + 1, float(c) - 1, float(c),
+                  10.0, 1000.0, 5, 5.0, 500.0, prev_close[i], return_pct[i]) for i, c in enumerate(close)]
+        with transaction() as conn:
+            merge_rows(conn, "dbo.PriceHistory", PRICE_COLUMNS + RETURN_COLUMNS, ["CoinID", "Interval", "OpenTime"], batch)
+
+
+def timed(func, *args, **kwargs):
+    best = None
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def read_sql(limit):
+    query, params = database.backend.translate(FETCH_QUERY, (limit,))
+    with database.connection() as conn:
+        df = database.backend.read_frame(conn, query, params)
+    # pd.read_sql nəticəsi sonrakı hesablamalar üçün yenə də çevrilməlidir
+    return df.astype(FETCH_DTYPES)
+
+
+def bench_fetch():
+    print(f"{'rows':>9} {'pd.read_sql':>12} {'fetch_frame':>12} {'speedup':>8}")
+    for size in SIZES:
+        slow, df_slow = timed(read_sql, size)
+        fast, df_fast = timed(fetch_frame, FETCH_QUERY, FETCH_DTYPES, params=(size,))
+        assert len(df_slow) == len(df_fast)
+        print(f"{len(df_fast):>9} {slow:>11.3f}s {fast:>11.3f}s {slow / fast:>7.1f}x")
+
+
+# main.py endpoint-lərinin sorğuları (interval parametri ilə)
+API_QUERIES = {
+    "/prices": ("SELECT TOP (?) ph.OpenTime, ph.ClosePrice, ph.Volume FROM PriceHistory ph "
+                "WHERE ph.CoinID = ? AND ph.Interval = ? ORDER BY ph.OpenTime DESC",
+                lambda coin_id, start: (100, coin_id, "1m")),
+    "/prices/range": ("SELECT ph.OpenTime, ph.OpenPrice, ph.HighPrice, ph.LowPrice, ph.ClosePrice, ph.Volume FROM PriceHistory ph "
+                      "WHERE ph.CoinID = ? AND ph.Interval = ? AND ph.OpenTime >= ? AND ph.OpenTime <= ? ORDER BY ph.OpenTime ASC",
+                      lambda coin_id, start: (coin_id, "1m", start, start + timedelta(days=1))),
+    "/latest": ("SELECT TOP 1 ph.OpenTime, ph.OpenPrice, ph.HighPrice, ph.LowPrice, ph.ClosePrice, ph.Volume, ph.NumberOfTrades "
+                "FROM PriceHistory ph WHERE ph.CoinID = ? AND ph.Interval = ? ORDER BY ph.OpenTime DESC",
+                lambda coin_id, start: (coin_id, "1m")),
+    "/stats": ("SELECT COUNT(*) as total_records, MIN(ph.ClosePrice) as min_price, MAX(ph.ClosePrice) as max_price, "
+               "AVG(ph.ClosePrice) as avg_price, MIN(ph.OpenTime) as first_date, MAX(ph.OpenTime) as last_date "
+               "FROM PriceHistory ph WHERE ph.CoinID = ? AND ph.Interval = ?",
+               lambda coin_id, start: (coin_id, "1m")),
+    "/prices/daily": ("SELECT TOP (?) ph.OpenTime, ph.ClosePrice, ph.PrevClose, ph.ReturnPct FROM dbo.PriceHistory ph "
+                      "WHERE ph.CoinID = ? AND ph.Interval = ? AND ph.OpenTime > ? ORDER BY ph.OpenTime",
+                      lambda coin_id, start: (1000, coin_id, "1m", start)),
+}
+API_CALLS = 30
+
+
+def api_latency():
+    ids = database.execute_query("SELECT CoinID FROM dbo.Coins")["CoinID"].tolist()
+    rng = np.random.default_rng(1)
+    result = {}
+    for name, (query, params) in API_QUERIES.items():
+        samples = []
+        for _ in range(API_CALLS):
+            coin_id = int(rng.choice(ids))
+            start = datetime(2020, 1, 1) + timedelta(minutes=int(rng.integers(0, 40_000)))
+            started = time.perf_counter()
+            database.execute_query(query, params=params(coin_id, start))
+            samples.append(time.perf_counter() - started)
+        result[name] = np.percentile(samples, [50, 95]) * 1000
+    return result
+
+
+def legacy_layout():
+    """PriceHistory-ni ilkin layout-a qaytarır: sətirlər zaman üzrə qarışıq, yalnız tək sütunlu indekslər"""
+    with transaction() as conn:
+        for statement in ("CREATE TABLE PriceHistory_legacy AS SELECT * FROM PriceHistory ORDER BY OpenTime, CoinID",
+                          "DROP TABLE PriceHistory",
+                          "ALTER TABLE PriceHistory_legacy RENAME TO PriceHistory",
+                          "CREATE INDEX IX_PriceHistory_CoinID ON PriceHistory (CoinID)",
+                          "CREATE INDEX IX_PriceHistory_OpenTime ON PriceHistory (OpenTime)"):
+            conn.execute(statement)
+
+
+def bench_api():
+    after = api_latency()
+    if database.backend.name == "mssql":
+        # SQL Server-də: əvvəl köhnə bazada, sonra py migrations.py-dan sonra işə salın
+        before = None
+    else:
+        legacy_layout()
+        before = api_latency()
+
+    print(f"{'endpoint':<15} {'before p50/p95 (ms)':>20} {'after p50/p95 (ms)':>20}")
+    for name, (p50, p95) in after.items():
+        old = f"{before[name][0]:.2f}/{before[name][1]:.2f}" if before else "-"
+        print(f"{name:<15} {old:>20} {f'{p50:.2f}/{p95:.2f}':>20}")
+
+
+LOAD_SECONDS = float(os.getenv("LOAD_SECONDS", "10"))
+LOAD_CONCURRENCY = int(os.getenv("LOAD_CONCURRENCY", "64"))
+LOAD_PORT = 8765
+LOAD_PATHS = ["/prices/{symbol}?limit=100&interval=1m", "/latest/{symbol}?interval=1m", "/stats/{symbol}?interval=1m"]
+# Müqayisə üçün köhnə versiyanın qovluğu, məs: git worktree add ../baseline <commit>
+LOAD_BASELINE_DIR = os.getenv("LOAD_BASELINE_DIR")
+
+
+def serve(app_dir, port):
+    """main:app-ı ayrıca prosesdə işə salır; nəticə keşi söndürülür ki, hər sorğu bazaya getsin"""
+    env = dict(os.environ, API_CACHE_MAX_BYTES="0")
+    if database.backend.name != "mssql":
+        env.update(DB_BACKEND=database.backend.name, DB_PATH=database.backend.path)
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--app-dir", app_dir, "--port", str(port), "--log-level", "warning"], env=env)
+    for _ in range(600):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return server
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("API server başlamadı")
+
+
+async def load_test(base_url, symbols):
+    """LOAD_CONCURRENCY paralel client LOAD_SECONDS ərzində endpoint-ləri çağırır"""
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + LOAD_SECONDS
+
+    async def client(worker):
+        nonlocal errors
+        rng = np.random.default_rng(worker)
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as http:
+            while time.perf_counter() < deadline:
+                path = LOAD_PATHS[rng.integers(len(LOAD_PATHS))].format(symbol=symbols[rng.integers(len(symbols))])
+                started = time.perf_counter()
+                try:
+                    response = await http.get(path)
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(LOAD_CONCURRENCY)))
+    elapsed = time.perf_counter() - started
+    return len(latencies) / elapsed, np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000, errors
+
+
+def bench_load():
+    symbols = database.execute_query("SELECT Symbol FROM dbo.Coins")["Symbol"].tolist()
+    database.pool.close_all()
+    if database.backend.name == "duckdb":
+        # DuckDB faylını eyni anda yalnız bir proses aça bilər
+        database.backend.database.close()
+        database.backend.database = None
+
+    targets = [("current", os.path.dirname(os.path.abspath(__file__)))]
+    if LOAD_BASELINE_DIR:
+        targets.insert(0, ("baseline", LOAD_BASELINE_DIR))
+
+    print(f"{LOAD_CONCURRENCY} clients, {LOAD_SECONDS:.0f}s")
+    print(f"{'app':<10} {'req/s':>8} {'p50 (ms)':>9} {'p99 (ms)':>9} {'errors':>7}")
+    for name, app_dir in targets:
+        server = serve(app_dir, LOAD_PORT)
+        try:
+            rps, p50, p99, errors = asyncio.run(load_test(f"http://127.0.0.1:{LOAD_PORT}", symbols))
+        finally:
+            server.terminate()
+            server.wait()
+        print(f"{name:<10} {rps:>8.1f} {p50:>9.1f} {p99:>9.1f} {errors:>7}")
+
+
+DATASET_ROWS = [5_000, 50_000]   # məs. 50k saatlıq bar ≈ 5.7 il
+DATASET_FEATURES = 8
+
+
+def legacy_sequences(data, lookback, horizon):
+    """Köhnə create_sequences: hər pəncərə ayrıca kopyalanır"""
+    X, y = [], []
+    for i in range(lookback, len(data) - horizon + 1):
+        X.append(data[i - lookback:i])
+        y.append(data[i:i + horizon, 0])
+    return np.array(X), np.array(y)
+
+
+def windowed_epoch(data, lookback, horizon):
+    """Yeni yol: strided view və bir epoch boyunca bütün batch-lər"""
+    X, y = window_view(data, lookback, horizon)
+    for batch in WindowSequence(X, y, np.arange(len(X)), shuffle=True):
+        pass
+    return X, y
+
+
+def peak_memory(func, *args):
+    tracemalloc.start()
+    started = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak, elapsed
+
+
+def bench_dataset():
+    print(f"{'rows':>9} {'data (MB)':>10} {'create_sequences':>22} {'window view + epoch':>22}")
+    for rows in DATASET_ROWS:
+        data = np.random.default_rng(0).random((rows, DATASET_FEATURES))
+        old_peak, old_time = peak_memory(legacy_sequences, data, LOOKBACK, HORIZON)
+        new_peak, new_time = peak_memory(windowed_epoch, data, LOOKBACK, HORIZON)
+        print(f"{rows:>9} {data.nbytes / 2**20:>10.1f} {f'{old_peak / 2**20:.1f} MB / {old_time:.2f}s':>22} "
+              f"{f'{new_peak / 2**20:.1f} MB / {new_time:.2f}s':>22}")
+
+
+# api sonda işləyir, çünki lokal bazanı köhnə layout-a çevirir
+BENCHMARKS = {"fetch": bench_fetch, "dataset": bench_dataset, "load": bench_load, "api": bench_api}
+
+
+if __name__ == "__main__":
+    backend = sys.argv[1] if len(sys.argv) > 1 else "sqlite"
+    names = sys.argv[2:] or list(BENCHMARKS)
+
+    with tempfile.TemporaryDirectory() as folder:
+        if backend != "mssql":
+            database.configure(backend, os.path.join(folder, f"benchmark.{backend}"))
+            print(f"Seeding {max(SIZES)} rows into temporary {backend} database...")
+            seed(max(SIZES))
+        for name in names:
+            print(f"\n== {name} ({backend}) ==")
+            BENCHMARKS[name]()
+        database.pool.close_all()
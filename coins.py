@@ -1,3 +1,7 @@
+import os
+import threading
+from database import execute_query, transaction, merge_rows
+
 COINS = [
     "BTCUSDT", "ETHUSDT", "BNBUSDT", "XRPUSDT", "ADAUSDT",
     "SOLUSDT", "DOGEUSDT", "MATICUSDT", "DOTUSDT", "AVAXUSDT",
@@ -7,3 +11,80 @@ COINS = [
     "OPUSDT", "ARBUSDT", "SHIBUSDT", "APTUSDT", "SANDUSDT",
     "MANAUSDT", "EGLDUSDT"
 ]
+
+BASE_INTERVAL = "1d"  # API, alert və model bu interval üzərində işləyir
+INTERVALS = [i.strip() for i in os.getenv("INTERVALS", BASE_INTERVAL).split(",") if i.strip()]
+
+
+def base_symbol(pair_symbol: str) -> str:
+    return pair_symbol.replace("USDT", "")
+
+
+class CoinRegistry:
+    """dbo.Coins cədvəlinin yaddaşdakı kopyası (Symbol/PairSymbol → CoinID)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rows = []
+        self.by_pair = {}
+        self.by_symbol = {}
+        self.loaded = False
+
+    def load(self):
+        """Coins cədvəlini bir sorğu ilə yaddaşa yükləyir"""
+        df = execute_query("SELECT CoinID, Symbol, PairSymbol, Name FROM dbo.Coins ORDER BY Symbol")
+        if df is None:
+            return False
+
+        rows = [{"CoinID": int(r.CoinID), "Symbol": r.Symbol, "PairSymbol": r.PairSymbol, "Name": r.Name} for r in df.itertuples(index=False)]
+        with self.lock:
+            self.rows = rows
+            self.by_pair = {r["PairSymbol"]: r["CoinID"] for r in rows}
+            self.by_symbol = {r["Symbol"]: r["CoinID"] for r in rows}
+            self.loaded = True
+        return True
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def ensure(self, pair_symbols):
+        """Olmayan coinləri bir upsert ilə yaradır və {PairSymbol: CoinID} qaytarır"""
+        self.ensure_loaded()
+        missing = [p for p in dict.fromkeys(pair_symbols) if p not in self.by_pair]
+        if missing:
+            with transaction() as conn:
+                merge_rows(conn, "dbo.Coins", ["Symbol", "PairSymbol"], ["PairSymbol"], [(base_symbol(p), p) for p in missing])
+            self.load()
+        return {p: self.by_pair[p] for p in pair_symbols if p in self.by_pair}
+
+    def coin_id(self, pair_symbol: str):
+        self.ensure_loaded()
+        coin_id = self.by_pair.get(pair_symbol)
+        if coin_id is None:
+            coin_id = self.ensure([pair_symbol]).get(pair_symbol)
+        return coin_id
+
+    def id_for_symbol(self, symbol: str):
+        """Symbol-u CoinID-yə çevirir; tapılmasa bir dəfə yenidən yükləyir"""
+        self.ensure_loaded()
+        coin_id = self.by_symbol.get(symbol)
+        if coin_id is None and self.load():
+            coin_id = self.by_symbol.get(symbol)
+        return coin_id
+
+    def coins(self):
+        self.ensure_loaded()
+        return [{"CoinID": r["CoinID"], "Symbol": r["Symbol"]} for r in self.rows]
+
+    def symbols(self):
+        self.ensure_loaded()
+        return [r["Symbol"] for r in self.rows]
+
+    def details(self):
+        self.ensure_loaded()
+        rows = [{"Symbol": r["Symbol"], "Name": r["Name"]} for r in self.rows]
+        return sorted(rows, key=lambda r: (r["Name"] is not None, r["Name"] or ""))
+
+
+registry = CoinRegistry()
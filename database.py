@@ -1,18 +1,50 @@
-import pyodbc
+import asyncio
 import pandas as pd
+import numpy as np
 import os
+import re
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import warnings
+import migrations
 warnings.filterwarnings("ignore", category=UserWarning)
 
+try:
+    import pyodbc
+except ImportError:  # SQLite/DuckDB backend-ləri üçün ODBC driver lazım deyil
+    pyodbc = None
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
 load_dotenv()
 
+DB_BACKEND = os.getenv("DB_BACKEND", "mssql").lower()   # mssql | sqlite | duckdb
+DB_PATH = os.getenv("DB_PATH")                          # sqlite/duckdb fayl yolu
+
 DB_SERVER = os.getenv("DB_SERVER")
 DB_NAME = os.getenv("DB_NAME")
 DB_TRUSTED_CONNECTION = os.getenv("DB_TRUSTED_CONNECTION", "true").lower() == "true"
 DB_USERNAME = os.getenv("DB_USERNAME")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))      # əlaqə gözləmə müddəti (saniyə)
+DB_POOL_RECYCLE = float(os.getenv("DB_POOL_RECYCLE", "1800"))    # bu yaşdan köhnə əlaqələr bağlanır
+DB_POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", "30"))  # bu qədər boş qalan əlaqə yoxlanılır
+
+MSSQL_MAX_PARAMS = 2000
+FETCH_BATCH = int(os.getenv("DB_FETCH_BATCH", "10000"))  # fetchmany ölçüsü
+DB_QUERY_TIMEOUT = float(os.getenv("DB_QUERY_TIMEOUT", "30"))  # async sorğular üçün limit (saniyə)
+
 
 def get_connection():
     """SQL Server ilə əlaqə yaradır (həm local, həm də server üçün)"""
@@ -40,66 +72,579 @@ def get_connection():
         return None
 
 
-def execute_query(query, params=None):
-    """SQL sorğusu icra edir və DataFrame qaytarır"""
-    conn = get_connection()
-    if conn is None:
+def fetch_rows(cursor, dtypes, batch_size=FETCH_BATCH):
+    """fetchmany batch-lərini əvvəlcədən ayrılmış massivlərə yazır (lazım olduqda ölçü iki dəfə artırılır)"""
+    names = list(dtypes)
+    capacity = batch_size
+    columns = {name: np.empty(capacity, dtype=dtypes[name]) for name in names}
+    size = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        count = len(rows)
+        if size + count > capacity:
+            capacity = max(capacity * 2, size + count)
+            for name in names:
+                grown = np.empty(capacity, dtype=dtypes[name])
+                grown[:size] = columns[name][:size]
+                columns[name] = grown
+        for name, values in zip(names, zip(*rows)):
+            target = columns[name]
+            if target.dtype.kind == "M":
+                # datetime obyektlərini numpy ilə tək-tək çevirmək yavaşdır, pandas vektorlaşdırılmış parser istifadə edir
+                values = pd.to_datetime(values).values
+            target[size:size + count] = values
+        size += count
+    return {name: columns[name][:size] for name in names}
+
+
+_TOP = re.compile(r"\bSELECT\s+TOP\s*(\(\s*\?\s*\)|\(\s*\d+\s*\)|\d+)\s+", re.IGNORECASE)
+_TABLE_HINT = re.compile(r"\s+WITH\s*\(\s*(?:UPDLOCK|HOLDLOCK|ROWLOCK|NOLOCK)(?:\s*,\s*(?:UPDLOCK|HOLDLOCK|ROWLOCK|NOLOCK))*\s*\)", re.IGNORECASE)
+
+
+def translate_tsql(query, params=None):
+    """T-SQL sorğusunu portable SQL-ə çevirir: dbo. və table hint-ləri silinir, TOP → LIMIT (parametr sırası da düzəlir)"""
+    query = query.replace("dbo.", "")
+    query = _TABLE_HINT.sub("", query)
+    query = re.sub(r"\bSYSDATETIME\(\)", "CURRENT_TIMESTAMP", query, flags=re.IGNORECASE)
+    match = _TOP.search(query)
+    if match is None:
+        return query, params
+
+    limit = match.group(1).strip("() ")
+    head = query[:match.start()]
+    query = head + "SELECT " + query[match.end():].rstrip().rstrip(";") + f"\nLIMIT {limit}"
+    if limit == "?" and params:
+        params = list(params)
+        params.append(params.pop(head.count("?")))
+        params = tuple(params)
+    return query, params
+
+
+class SqlServerBackend:
+    """Mövcud SQL Server (ODBC Driver 18) backend-i; sorğular olduğu kimi T-SQL-dir"""
+    name = "mssql"
+
+    def connect(self):
+        return get_connection()
+
+    def translate(self, query, params=None):
+        return query, params
+
+    def begin(self, conn):
+        pass
+
+    def reset(self, conn):
+        conn.rollback()
+
+    def cursor(self, conn):
+        return conn.cursor()
+
+    def close_cursor(self, cursor):
+        cursor.close()
+
+    def set_timeout(self, conn, seconds):
+        conn.timeout = int(seconds)  # ODBC query timeout, server tərəfdə də sorğu dayandırılır
+
+    def interrupt(self, conn, cursor):
+        if cursor is not None:
+            cursor.cancel()
+
+    def read_frame(self, conn, query, params=None):
+        return pd.read_sql(query, conn, params=params)
+
+    def read_cursor(self, cursor, query, params=None):
+        """read_frame kimi, amma ləğv edilə bilən açıq cursor üzərində"""
+        cursor.execute(query, params or ())
+        columns = [d[0] for d in cursor.description]
+        return pd.DataFrame.from_records([tuple(row) for row in cursor.fetchall()], columns=columns)
+
+    def fetch_columns(self, conn, query, params, dtypes, batch_size):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, params or ())
+            return fetch_rows(cursor, dtypes, batch_size)
+        finally:
+            cursor.close()
+
+    def executemany(self, cursor, query, rows):
+        cursor.fast_executemany = True
+        cursor.executemany(query, rows)
+        return cursor.rowcount
+
+    def rowcount(self, cursor):
+        return cursor.rowcount
+
+    def merge_rows(self, conn, table, columns, key_columns, rows, update_columns=(), only_if_greater=None):
+        column_list = ", ".join(columns)
+        placeholders = ", ".join("?" * len(columns))
+        on = " AND ".join(f"t.{k} = s.{k}" for k in key_columns)
+        matched = ""
+        if update_columns:
+            condition = f" AND s.{only_if_greater} > t.{only_if_greater}" if only_if_greater else ""
+            matched = f"WHEN MATCHED{condition} THEN UPDATE SET " + ", ".join(f"{c} = s.{c}" for c in update_columns)
+        merge = f"""
+            MERGE {table} WITH (HOLDLOCK) AS t
+            USING {{source}} ON {on}
+            {matched}
+            WHEN NOT MATCHED BY TARGET THEN
+                INSERT ({column_list}) VALUES ({", ".join("s." + c for c in columns)});
+        """
+
+        cursor = conn.cursor()
+        try:
+            if len(rows) * len(columns) <= MSSQL_MAX_PARAMS:
+                values = ", ".join([f"({placeholders})"] * len(rows))
+                cursor.execute(merge.format(source=f"(VALUES {values}) AS s ({column_list})"), [v for row in rows for v in row])
+                return cursor.rowcount
+
+            stage = "#stage_" + table.split(".")[-1]
+            cursor.execute(f"IF OBJECT_ID('tempdb..{stage}') IS NOT NULL DROP TABLE {stage}")
+            cursor.execute(f"SELECT TOP 0 {column_list} INTO {stage} FROM {table}")
+            cursor.fast_executemany = True
+            cursor.executemany(f"INSERT INTO {stage} ({column_list}) VALUES ({placeholders})", rows)
+            cursor.execute(merge.format(source=f"{stage} AS s"))
+            affected = cursor.rowcount
+            cursor.execute(f"DROP TABLE {stage}")
+            return affected
+        finally:
+            cursor.close()
+
+
+class SqliteBackend:
+    """Fayl əsaslı SQLite backend-i (laptop və CI üçün)"""
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.initialized = False
+        sqlite3.register_adapter(pd.Timestamp, lambda t: t.isoformat(" "))
+        sqlite3.register_adapter(np.int64, int)
+        sqlite3.register_adapter(np.float64, float)
+        # standart TIMESTAMP converter-i Python-da yazılıb, fromisoformat C-dədir
+        sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=DB_POOL_TIMEOUT, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        with self.lock:
+            if not self.initialized:
+                create_schema(conn, self.name)
+                self.initialized = True
+        return conn
+
+    def translate(self, query, params=None):
+        return translate_tsql(query, params)
+
+    def begin(self, conn):
+        pass
+
+    def reset(self, conn):
+        conn.rollback()
+
+    def cursor(self, conn):
+        return conn.cursor()
+
+    def close_cursor(self, cursor):
+        cursor.close()
+
+    def set_timeout(self, conn, seconds):
+        pass
+
+    def interrupt(self, conn, cursor):
+        conn.interrupt()
+
+    def read_frame(self, conn, query, params=None):
+        return pd.read_sql(query, conn, params=params)
+
+    def read_cursor(self, cursor, query, params=None):
+        """read_frame kimi, amma ləğv edilə bilən açıq cursor üzərində"""
+        cursor.execute(query, params or ())
+        columns = [d[0] for d in cursor.description]
+        return pd.DataFrame.from_records([tuple(row) for row in cursor.fetchall()], columns=columns)
+
+    def fetch_columns(self, conn, query, params, dtypes, batch_size):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, params or ())
+            return fetch_rows(cursor, dtypes, batch_size)
+        finally:
+            cursor.close()
+
+    def executemany(self, cursor, query, rows):
+        cursor.executemany(query, rows)
+        return cursor.rowcount
+
+    def rowcount(self, cursor):
+        return cursor.rowcount
+
+    def upsert_sql(self, table, columns, key_columns, update_columns=(), only_if_greater=None):
+        table = table.replace("dbo.", "")
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) {{source}} ON CONFLICT ({', '.join(key_columns)}) DO "
+        if not update_columns:
+            return sql + "NOTHING"
+        sql += "UPDATE SET " + ", ".join(f"{c} = excluded.{c}" for c in update_columns)
+        if only_if_greater:
+            sql += f" WHERE excluded.{only_if_greater} > {table}.{only_if_greater}"
+        return sql
+
+    def merge_rows(self, conn, table, columns, key_columns, rows, update_columns=(), only_if_greater=None):
+        sql = self.upsert_sql(table, columns, key_columns, update_columns, only_if_greater)
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(sql.format(source=f"VALUES ({', '.join('?' * len(columns))})"), rows)
+            return cursor.rowcount
+        finally:
+            cursor.close()
+
+
+class DuckDbBackend(SqliteBackend):
+    """Embedded DuckDB backend-i: lokal analitika üçün sütunlu, sürətli oxuma"""
+    name = "duckdb"
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.database = None
+
+    def connect(self):
+        # DuckDB faylını bir proses yalnız bir dəfə açır; hovuzdakı əlaqələr onun cursor-larıdır
+        with self.lock:
+            if self.database is None:
+                self.database = duckdb.connect(self.path)
+                create_schema(self.database, self.name)
+        return self.database.cursor()
+
+    def begin(self, conn):
+        conn.begin()
+
+    def reset(self, conn):
+        try:
+            conn.rollback()
+        except duckdb.TransactionException:
+            pass  # aktiv transaction yoxdur
+
+    def cursor(self, conn):
+        return conn
+
+    def close_cursor(self, cursor):
+        pass
+
+    def read_frame(self, conn, query, params=None):
+        return conn.execute(query, list(params or [])).df()
+
+    def read_cursor(self, cursor, query, params=None):
+        return self.read_frame(cursor, query, params)
+
+    def fetch_columns(self, conn, query, params, dtypes, batch_size):
+        # DuckDB nəticəni Arrow batch-ləri kimi verir, Python obyektləri yaradılmır
+        reader = conn.execute(query, list(params or [])).fetch_record_batch(batch_size)
+        chunks = {name: [] for name in dtypes}
+        for batch in reader:
+            for name, column in zip(dtypes, batch.columns):
+                chunks[name].append(column.to_numpy(zero_copy_only=False).astype(dtypes[name], copy=False))
+        return {name: np.concatenate(parts) if parts else np.empty(0, dtype=dtypes[name]) for name, parts in chunks.items()}
+
+    def executemany(self, cursor, query, rows):
+        cursor.executemany(query, rows)
+        return len(rows)
+
+    def rowcount(self, cursor):
+        try:
+            row = cursor.fetchone()
+            return int(row[0]) if row else -1
+        except Exception:
+            return -1
+
+    def merge_rows(self, conn, table, columns, key_columns, rows, update_columns=(), only_if_greater=None):
+        sql = self.upsert_sql(table, columns, key_columns, update_columns, only_if_greater)
+        stage = "stage_" + table.split(".")[-1]
+        conn.register(stage, pd.DataFrame(rows, columns=columns))
+        try:
+            conn.execute(sql.format(source=f"SELECT {', '.join(columns)} FROM {stage}"))
+            return self.rowcount(conn)
+        finally:
+            conn.unregister(stage)
+
+
+def create_schema(conn, dialect):
+    """Embedded backend-lər üçün sxemi yaradır və ya miqrasiyalarla son versiyaya çatdırır"""
+    migrations.upgrade(conn, dialect)
+
+
+def make_backend(name=DB_BACKEND, path=DB_PATH):
+    if name == "mssql":
+        return SqlServerBackend()
+    if name == "sqlite":
+        return SqliteBackend(path or "binance.db")
+    if name == "duckdb":
+        return DuckDbBackend(path or "binance.duckdb")
+    raise ValueError(f"Naməlum DB_BACKEND: {name}")
+
+
+class ConnectionPool:
+    """Thread-safe əlaqə hovuzu: yoxlama, köhnə əlaqələrin yenilənməsi və ölçü limiti ilə"""
+
+    def __init__(self, backend, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, recycle=DB_POOL_RECYCLE, ping_after=DB_POOL_PING_AFTER):
+        self.backend = backend
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.created = {}
+
+    def acquire(self):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise TimeoutError("Database hovuzunda boş əlaqə yoxdur")
+        try:
+            while True:
+                try:
+                    conn, released_at = self.idle.get_nowait()
+                except queue.Empty:
+                    break
+                now = time.monotonic()
+                if now - self.created.get(id(conn), now) > self.recycle:
+                    self._discard(conn)
+                elif now - released_at > self.ping_after and not self._is_alive(conn):
+                    self._discard(conn)
+                else:
+                    return conn
+
+            conn = self.backend.connect()
+            if conn is None:
+                raise ConnectionError("Database qoşulma xətası")
+            self.created[id(conn)] = time.monotonic()
+            return conn
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, conn):
+        try:
+            self.backend.reset(conn)
+            self.idle.put((conn, time.monotonic()))
+        except Exception:
+            self._discard(conn)
+        finally:
+            self.slots.release()
+
+    def close_all(self):
+        while True:
+            try:
+                conn, _ = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
+    def _is_alive(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchall()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        self.created.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+backend = make_backend()
+pool = ConnectionPool(backend)
+
+
+def configure(name, path=None):
+    """Backend-i işləmə zamanı dəyişir (benchmark və lokal testlər üçün)"""
+    global backend, pool
+    pool.close_all()
+    backend = make_backend(name, path)
+    pool = ConnectionPool(backend)
+    return backend
+
+
+@contextmanager
+def connection():
+    """Hovuzdan əlaqə götürür və iş bitəndə geri qaytarır"""
+    current = pool
+    conn = current.acquire()
+    try:
+        yield conn
+    finally:
+        current.release(conn)
+
+
+@contextmanager
+def transaction():
+    """Bir neçə sorğunu bir əlaqədə icra edir və sonda bir dəfə commit edir"""
+    with connection() as conn:
+        backend.begin(conn)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+@contextmanager
+def _cursor(conn):
+    cursor = backend.cursor(conn)
+    try:
+        yield cursor
+    finally:
+        backend.close_cursor(cursor)
+
+
+def _execute(cursor, query, params):
+    if isinstance(params, list) and len(params) > 0 and isinstance(params[0], tuple):
+        query, _ = backend.translate(query)
+        return backend.executemany(cursor, query, params)
+    query, params = backend.translate(query, params)
+    cursor.execute(query, params or ())
+    return backend.rowcount(cursor)
+
+
+def merge_rows(conn, table, columns, key_columns, rows, update_columns=(), only_if_greater=None):
+    """Açar üzrə set-based upsert: yeni açarlar əlavə olunur, update_columns verilərsə mövcud sətirlər
+    yenilənir (only_if_greater: yalnız həmin sütunun yeni dəyəri böyükdürsə)"""
+    if not rows:
+        return 0
+    return backend.merge_rows(conn, table, columns, key_columns, rows, update_columns, only_if_greater)
+
+
+def execute_query(query, params=None, conn=None):
+    """SQL sorğusu icra edir və DataFrame qaytarır (conn verilərsə xəta yuxarı ötürülür)"""
+    query, params = backend.translate(query, params)
+    if conn is not None:
+        return backend.read_frame(conn, query, params)
+
+    try:
+        with connection() as conn:
+            return backend.read_frame(conn, query, params)
+    except Exception as e:
+        print(f"❌ Sorğu icra xətası: {e}")
         return None
-    
+
+
+def fetch_columns(query, dtypes, params=None, conn=None, batch_size=FETCH_BATCH):
+    """Nəticəni tipli NumPy massivləri kimi qaytarır ({ad: massiv}).
+    dtypes SELECT-dəki sütun sırası ilə {ad: dtype} olmalıdır; DECIMAL → float64, DATETIME2 → datetime64[ns]"""
+    if conn is None:
+        with connection() as conn:
+            return fetch_columns(query, dtypes, params, conn, batch_size)
+
+    query, params = backend.translate(query, params)
+    return backend.fetch_columns(conn, query, params, dtypes, batch_size)
+
+
+def fetch_frame(query, dtypes, params=None, conn=None, index=None):
+    """fetch_columns nəticəsini DataFrame kimi qaytarır (conn verilməzsə xəta çap olunur və None qaytarılır)"""
+    if conn is not None:
+        df = pd.DataFrame(fetch_columns(query, dtypes, params, conn), copy=False)
+        return df.set_index(index) if index else df
+
     try:
-        df = pd.read_sql(query, conn, params=params)
-        return df
+        df = pd.DataFrame(fetch_columns(query, dtypes, params), copy=False)
+        return df.set_index(index) if index else df
     except Exception as e:
         print(f"❌ Sorğu icra xətası: {e}")
         return None
+
+
+db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+
+def _run_cancellable(state, func, args):
+    if state["cancelled"]:
+        raise asyncio.CancelledError()
+    with connection() as conn:
+        state["conn"] = conn
+        backend.set_timeout(conn, state["timeout"])
+        try:
+            return func(conn, state, *args)
+        finally:
+            state["conn"] = state["cursor"] = None
+
+
+async def run_async(func, *args, timeout=DB_QUERY_TIMEOUT):
+    """func(conn, state, *args)-ı hovuz ölçüsündə ayrıca executor-da icra edir (event loop bloklanmır).
+    Timeout və ya sorğu ləğvi (client bağlantını kəsəndə) zamanı icra olunan sorğu driver səviyyəsində dayandırılır"""
+    state = {"cancelled": False, "conn": None, "cursor": None, "timeout": timeout}
+    future = asyncio.get_running_loop().run_in_executor(db_executor, _run_cancellable, state, func, args)
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        state["cancelled"] = True
+        conn, cursor = state["conn"], state["cursor"]
+        if conn is not None:
+            try:
+                backend.interrupt(conn, cursor)
+            except Exception:
+                pass
+        raise
+
+
+def _query_frame(conn, state, query, params):
+    cursor = backend.cursor(conn)
+    state["cursor"] = cursor
+    try:
+        return backend.read_cursor(cursor, query, params)
     finally:
-        conn.close()
+        backend.close_cursor(cursor)
 
 
-def insert_data(query, params=None):
-    """Verilənləri bazaya əlavə edir"""
-    conn = get_connection()
-    if conn is None:
-        return False
-    
-    cursor = None
+def _fetch_frame(conn, state, query, dtypes, params, index):
+    df = pd.DataFrame(backend.fetch_columns(conn, query, params, dtypes, FETCH_BATCH), copy=False)
+    return df.set_index(index) if index else df
+
+
+async def execute_query_async(query, params=None, timeout=DB_QUERY_TIMEOUT):
+    """execute_query-nin async variantı; xətalar (asyncio.TimeoutError daxil) yuxarı ötürülür"""
+    query, params = backend.translate(query, params)
+    return await run_async(_query_frame, query, params, timeout=timeout)
+
+
+async def fetch_frame_async(query, dtypes, params=None, index=None, timeout=DB_QUERY_TIMEOUT):
+    """fetch_frame-in async variantı"""
+    query, params = backend.translate(query, params)
+    return await run_async(_fetch_frame, query, dtypes, params, index, timeout=timeout)
+
+
+def insert_data(query, params=None, conn=None):
+    """Verilənləri bazaya əlavə edir (conn verilərsə commit transaction-a aiddir)"""
+    query, params = backend.translate(query, params)
+    if conn is not None:
+        with _cursor(conn) as cursor:
+            cursor.execute(query, params or ())
+        return True
+
     try:
-        cursor = conn.cursor()
-        cursor.execute(query, params or ())
-        conn.commit()
+        with transaction() as conn:
+            with _cursor(conn) as cursor:
+                cursor.execute(query, params or ())
         return True
     except Exception as e:
         print(f"❌ Data əlavə xətası: {e}")
-        conn.rollback()
         return False
-    finally:
-        if cursor:
-            cursor.close()
-        conn.close()
 
 
-def execute_non_query(query, params=None):
+def execute_non_query(query, params=None, conn=None):
     """INSERT, UPDATE, DELETE sorğuları üçün (affected rows qaytarır)"""
-    conn = get_connection()
-    if conn is None:
-        return 0
-    
-    cursor = None
+    if conn is not None:
+        with _cursor(conn) as cursor:
+            return _execute(cursor, query, params)
+
     try:
-        cursor = conn.cursor()
-        
-        if isinstance(params, list) and len(params) > 0 and isinstance(params[0], tuple):
-            cursor.executemany(query, params)
-        else:
-            cursor.execute(query, params or ())
-        
-        conn.commit()
-        return cursor.rowcount
+        with transaction() as conn:
+            with _cursor(conn) as cursor:
+                return _execute(cursor, query, params)
     except Exception as e:
         print(f"❌ Sorğu icra xətası: {e}")
-        conn.rollback()
         return 0
-    finally:
-        if cursor:
-            cursor.close()
-        conn.close()
\ No newline at end of file
@@ -4,6 +4,17 @@ GO
 USE BinanceDB;
 GO
 
+CREATE PARTITION FUNCTION PF_SnapshotMonth (DATETIME2) AS RANGE RIGHT FOR VALUES ();
+CREATE PARTITION SCHEME PS_SnapshotMonth AS PARTITION PF_SnapshotMonth ALL TO ([PRIMARY]);
+GO
+
+CREATE TABLE dbo.SchemaVersions (
+    Version INT NOT NULL PRIMARY KEY,
+    Description NVARCHAR(200) NOT NULL,
+    AppliedDate DATETIME2 NOT NULL DEFAULT SYSDATETIME()
+);
+GO
+
 CREATE TABLE dbo.Coins (
     CoinID INT IDENTITY(1,1) PRIMARY KEY,
     Symbol NVARCHAR(10) NOT NULL UNIQUE,
@@ -14,8 +25,9 @@ CREATE TABLE dbo.Coins (
 GO
 
 CREATE TABLE dbo.PriceHistory (
-    PriceID BIGINT IDENTITY(1,1) PRIMARY KEY,
+    PriceID BIGINT IDENTITY(1,1) NOT NULL,
     CoinID INT NOT NULL,
+    Interval VARCHAR(4) NOT NULL DEFAULT '1d',  -- 1m, 15m, 1h, 1d ...
     OpenTime DATETIME2 NOT NULL,
     CloseTime DATETIME2 NOT NULL,
     OpenPrice DECIMAL(18,8) NOT NULL,
@@ -28,15 +40,29 @@ CREATE TABLE dbo.PriceHistory (
     TakerBuyBaseVolume DECIMAL(30,8) NOT NULL,
     TakerBuyQuoteVolume DECIMAL(30,8) NOT NULL,
     InsertedDate DATETIME2 DEFAULT SYSDATETIME(),
+    PrevClose DECIMAL(18,8) NULL,  -- əvvəlki bar-ın ClosePrice-ı, ingestion zamanı yazılır
+    ReturnPct FLOAT NULL,  -- (ClosePrice - PrevClose) / PrevClose * 100
+    CONSTRAINT PK_PriceHistory PRIMARY KEY NONCLUSTERED (PriceID),
     CONSTRAINT FK_PriceHistory_Coins FOREIGN KEY (CoinID) REFERENCES dbo.Coins(CoinID),
-    CONSTRAINT UQ_Coin_OpenTime UNIQUE (CoinID, OpenTime)
+    CONSTRAINT UQ_Coin_Interval_OpenTime UNIQUE CLUSTERED (CoinID, Interval, OpenTime)
+);
+GO
+
+CREATE TABLE dbo.IngestionWatermarks (
+    CoinID INT NOT NULL,
+    Interval VARCHAR(4) NOT NULL,
+    LastOpenTime DATETIME2 NOT NULL,
+    LastCloseTime DATETIME2 NOT NULL,
+    UpdatedDate DATETIME2 NOT NULL DEFAULT SYSDATETIME(),
+    CONSTRAINT PK_IngestionWatermarks PRIMARY KEY (CoinID, Interval),
+    CONSTRAINT FK_IngestionWatermarks_Coins FOREIGN KEY (CoinID) REFERENCES dbo.Coins(CoinID)
 );
 GO
 
 CREATE TABLE dbo.Ticker24hStats (
-    StatID BIGINT IDENTITY(1,1) PRIMARY KEY,
+    StatID BIGINT IDENTITY(1,1) NOT NULL,
     CoinID INT NOT NULL,
-    SnapshotTime DATETIME2 NOT NULL,           -- snapshot zamanı
+    SnapshotTime DATETIME2 NOT NULL,  -- snapshot zamanı
     OpenPrice DECIMAL(18,8) NOT NULL,
     HighPrice DECIMAL(18,8) NOT NULL,
     LowPrice DECIMAL(18,8) NOT NULL,
@@ -47,12 +73,13 @@ CREATE TABLE dbo.Ticker24hStats (
     PriceChangePercent DECIMAL(8,2) NULL,
     NumberOfTrades INT NULL,
     InsertedDate DATETIME2 DEFAULT SYSDATETIME(),
+    CONSTRAINT PK_Ticker24hStats PRIMARY KEY NONCLUSTERED (StatID, SnapshotTime) ON PS_SnapshotMonth(SnapshotTime),
     CONSTRAINT FK_Ticker24hStats_Coins FOREIGN KEY (CoinID) REFERENCES dbo.Coins(CoinID)
 );
 GO
 
 CREATE TABLE dbo.OrderBookSnapshot (
-    SnapshotID BIGINT IDENTITY(1,1) PRIMARY KEY,
+    SnapshotID BIGINT IDENTITY(1,1) NOT NULL,
     CoinID INT NOT NULL,
     SnapshotTime DATETIME2 NOT NULL,
     BidPrice DECIMAL(18,8) NOT NULL,
@@ -60,10 +87,42 @@ CREATE TABLE dbo.OrderBookSnapshot (
     AskPrice DECIMAL(18,8) NOT NULL,
     AskQty DECIMAL(30,8) NOT NULL,
     InsertedDate DATETIME2 DEFAULT SYSDATETIME(),
+    CONSTRAINT PK_OrderBookSnapshot PRIMARY KEY NONCLUSTERED (SnapshotID, SnapshotTime) ON PS_SnapshotMonth(SnapshotTime),
     CONSTRAINT FK_OrderBook_Coins FOREIGN KEY (CoinID) REFERENCES dbo.Coins(CoinID)
 );
 GO
 
+CREATE TABLE dbo.Ticker24hStatsRollup (
+    CoinID INT NOT NULL,
+    Granularity VARCHAR(4) NOT NULL,  -- 1h, 1d
+    BucketTime DATETIME2 NOT NULL,
+    OpenPrice DECIMAL(18,8) NOT NULL,  -- bucket-dakı ilk son qiymət
+    HighPrice DECIMAL(18,8) NOT NULL,
+    LowPrice DECIMAL(18,8) NOT NULL,
+    ClosePrice DECIMAL(18,8) NOT NULL,
+    Volume DECIMAL(30,8) NOT NULL,  -- bucket sonundakı 24 saatlıq həcm
+    QuoteAssetVolume DECIMAL(30,8) NOT NULL,
+    Samples INT NOT NULL,
+    CONSTRAINT PK_Ticker24hStatsRollup PRIMARY KEY (CoinID, Granularity, BucketTime),
+    CONSTRAINT FK_Ticker24hStatsRollup_Coins FOREIGN KEY (CoinID) REFERENCES dbo.Coins(CoinID)
+);
+GO
+
+CREATE TABLE dbo.OrderBookRollup (
+    CoinID INT NOT NULL,
+    Granularity VARCHAR(4) NOT NULL,
+    BucketTime DATETIME2 NOT NULL,
+    BidPrice DECIMAL(18,8) NOT NULL,  -- orta
+    BidQty DECIMAL(30,8) NOT NULL,
+    AskPrice DECIMAL(18,8) NOT NULL,
+    AskQty DECIMAL(30,8) NOT NULL,
+    MaxSpread DECIMAL(18,8) NOT NULL,
+    Samples INT NOT NULL,
+    CONSTRAINT PK_OrderBookRollup PRIMARY KEY (CoinID, Granularity, BucketTime),
+    CONSTRAINT FK_OrderBookRollup_Coins FOREIGN KEY (CoinID) REFERENCES dbo.Coins(CoinID)
+);
+GO
+
 CREATE TABLE dbo.AnomalyAlerts (
     AlertID INT IDENTITY(1,1) PRIMARY KEY,
     CoinID INT NOT NULL,
@@ -77,11 +136,42 @@ CREATE TABLE dbo.AnomalyAlerts (
 );
 GO
 
-CREATE INDEX IX_PriceHistory_CoinID ON dbo.PriceHistory (CoinID);
-CREATE INDEX IX_PriceHistory_OpenTime ON dbo.PriceHistory (OpenTime);
-CREATE INDEX IX_Ticker24hStats_CoinID ON dbo.Ticker24hStats (CoinID);
-CREATE INDEX IX_Ticker24hStats_SnapshotTime ON dbo.Ticker24hStats (SnapshotTime);
-CREATE INDEX IX_OrderBookSnapshot_CoinID ON dbo.OrderBookSnapshot (CoinID);
-CREATE INDEX IX_OrderBookSnapshot_SnapshotTime ON dbo.OrderBookSnapshot (SnapshotTime);
+CREATE TABLE dbo.AnomalyState (
+    CoinID INT NOT NULL,
+    Interval VARCHAR(4) NOT NULL,
+    LastOpenTime DATETIME2 NOT NULL,
+    LastClose FLOAT NOT NULL,
+    Bars INT NOT NULL,  -- pəncərədəki close sayı (≤ 100)
+    Changes VARBINARY(800) NOT NULL,  -- son |dəyişiklik| %-lərinin ring buffer-i (float64)
+    Position INT NOT NULL,  -- ring buffer-də növbəti yazılacaq yer
+    SumAbs FLOAT NOT NULL,  -- ring buffer-in cəmi
+    UpdatedDate DATETIME2 NOT NULL DEFAULT SYSDATETIME(),
+    CONSTRAINT PK_AnomalyState PRIMARY KEY (CoinID, Interval),
+    CONSTRAINT FK_AnomalyState_Coins FOREIGN KEY (CoinID) REFERENCES dbo.Coins(CoinID)
+);
+GO
+
+CREATE TABLE dbo.Predictions (
+    CoinID INT NOT NULL,
+    BaseTime DATETIME2 NOT NULL,  -- proqnozun əsaslandığı son bar (BASE_INTERVAL watermark-ı)
+    CurrentPrice DECIMAL(18,8) NOT NULL,
+    Day1 DECIMAL(18,8) NOT NULL,
+    Day2 DECIMAL(18,8) NOT NULL,
+    Day3 DECIMAL(18,8) NOT NULL,
+    ModelVersion BIGINT NOT NULL,  -- model faylının mtime-ı (ns)
+    CreatedDate DATETIME2 NOT NULL DEFAULT SYSDATETIME(),
+    CONSTRAINT PK_Predictions PRIMARY KEY (CoinID, BaseTime),
+    CONSTRAINT FK_Predictions_Coins FOREIGN KEY (CoinID) REFERENCES dbo.Coins(CoinID)
+);
+GO
+
+CREATE NONCLUSTERED COLUMNSTORE INDEX NCCI_PriceHistory ON dbo.PriceHistory (CoinID, Interval, OpenTime, OpenPrice, HighPrice, LowPrice, ClosePrice, Volume, NumberOfTrades);
+CREATE CLUSTERED INDEX CX_Ticker24hStats_CoinID_SnapshotTime ON dbo.Ticker24hStats (CoinID, SnapshotTime) ON PS_SnapshotMonth(SnapshotTime);
+CREATE INDEX IX_Ticker24hStats_SnapshotTime ON dbo.Ticker24hStats (SnapshotTime) ON PS_SnapshotMonth(SnapshotTime);
+CREATE CLUSTERED INDEX CX_OrderBookSnapshot_CoinID_SnapshotTime ON dbo.OrderBookSnapshot (CoinID, SnapshotTime) ON PS_SnapshotMonth(SnapshotTime);
+CREATE INDEX IX_OrderBookSnapshot_SnapshotTime ON dbo.OrderBookSnapshot (SnapshotTime) ON PS_SnapshotMonth(SnapshotTime);
 CREATE UNIQUE INDEX UQ_AnomalyAlerts_CoinID_AlertDate ON dbo.AnomalyAlerts (CoinID, AlertDate);
+GO
+
+INSERT INTO dbo.SchemaVersions (Version, Description) VALUES (8, 'database.sql');
 GO
\ No newline at end of file
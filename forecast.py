@@ -0,0 +1,113 @@
+import os
+import time
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from database import execute_query, fetch_frame, transaction, merge_rows
+from coins import registry, BASE_INTERVAL
+from watermarks import load_watermarks
+from model import PRICE_COLUMNS, PRICE_DTYPES, predict_next_3_days
+import price_cache
+from model_registry import ModelRegistry, artifact_version
+
+# Pipeline dövründən sonra bütün öyrədilmiş coin-lər üçün 3 günlük proqnozu hesablayıb dbo.Predictions-a yazır.
+# Proqnoz yalnız coin-in watermark-ı və ya modeli dəyişəndə yenidən hesablanır.
+
+FORECAST_WORKERS = int(os.getenv("FORECAST_WORKERS", "4"))
+PREDICTION_COLUMNS = ["CoinID", "BaseTime", "CurrentPrice", "Day1", "Day2", "Day3", "ModelVersion"]
+FORECAST_BARS = 1000  # proqnoz üçün son bar sayı (LOOKBACK + indikatorların isinməsi üçün kifayətdir)
+
+# API-dən ayrı: job bütün modelləri yaddaşda saxlayır ki, hər dövrdə yenidən yüklənməsin
+models = ModelRegistry(size=int(os.getenv("FORECAST_MODEL_CACHE_SIZE", "64")))
+
+LATEST_QUERY = """
+    WITH latest AS (
+        SELECT p.CoinID, p.BaseTime, p.ModelVersion,
+               ROW_NUMBER() OVER (PARTITION BY p.CoinID ORDER BY p.BaseTime DESC) AS rn
+        FROM dbo.Predictions p
+    )
+    SELECT CoinID, BaseTime, ModelVersion FROM latest WHERE rn = 1
+"""
+
+
+def pending(watermarks):
+    """(symbol, coin_id, watermark, model versiyası) — son proqnozdan sonra data və ya model dəyişmiş coin-lər"""
+    df = execute_query(LATEST_QUERY)
+    done = {} if df is None else {int(r.CoinID): (pd.Timestamp(r.BaseTime), int(r.ModelVersion)) for r in df.itertuples(index=False)}
+    result = []
+    for coin in registry.coins():
+        version = artifact_version(coin["Symbol"])
+        watermark = watermarks.get((coin["CoinID"], BASE_INTERVAL))
+        if version is None or watermark is None:
+            continue
+        last = done.get(coin["CoinID"])
+        if last is None or last[0] < watermark[0] or last[1] != version:
+            result.append((coin["Symbol"], coin["CoinID"], watermark[0], version))
+    return result
+
+
+# DESC ilə oxunur (son bar-lar), çağıran sıranı çevirir
+RECENT_QUERY = """
+    SELECT TOP (?) ph.OpenTime, ph.HighPrice, ph.LowPrice, ph.Volume, ph.ClosePrice, ph.OpenPrice
+    FROM dbo.PriceHistory ph
+    WHERE ph.CoinID = ? AND ph.Interval = ? AND ph.OpenTime <= ?
+    ORDER BY ph.OpenTime DESC
+"""
+
+
+def recent_prices(symbol, coin_id, watermark):
+    """Watermark-a qədər son FORECAST_BARS bar (köhnədən yeniyə); keş watermark-a çatmırsa DB-dən oxunur"""
+    df = price_cache.load(symbol, BASE_INTERVAL, columns=PRICE_COLUMNS)
+    if df is not None and not df.empty and df.index[-1] >= watermark:
+        return df.loc[:watermark].tail(FORECAST_BARS)
+    df = fetch_frame(RECENT_QUERY, PRICE_DTYPES, params=(FORECAST_BARS, coin_id, BASE_INTERVAL, watermark.to_pydatetime()), index="OpenTime")
+    return None if df is None else df.iloc[::-1]
+
+
+def forecast(symbol, coin_id, watermark, version):
+    """Bir coin üçün data oxuma, feature qurma və inference (worker thread-də icra olunur).
+    Proqnoz watermark bar-ı ilə damğalanır; data ona çatmırsa coin keçilir"""
+    pair = models.get(symbol)
+    if pair is None:
+        return None
+    df = recent_prices(symbol, coin_id, watermark)
+    if df is None or df.empty or df.index[-1] != watermark:
+        print(f" {symbol}: data watermark-a ({watermark}) çatmır, proqnoz keçilir")
+        return None
+    preds = predict_next_3_days(*pair, df)
+    if preds is None:
+        return None
+    return (coin_id, watermark.to_pydatetime(), float(df["ClosePrice"].iloc[-1]), *map(float, preds), version)
+
+
+def run():
+    """Yazılan proqnozların sayını qaytarır"""
+    watermarks = load_watermarks()
+    if watermarks is None:
+        return 0
+    tasks = pending(watermarks)
+    if not tasks:
+        return 0
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=FORECAST_WORKERS) as executor:
+        futures = {executor.submit(forecast, symbol, coin_id, watermark, version): symbol for symbol, coin_id, watermark, version in tasks}
+        rows = []
+        for future, symbol in futures.items():
+            try:
+                row = future.result()
+            except Exception as e:
+                print(f" X {symbol}: Forecast Error: {e}")
+                continue
+            if row is not None:
+                rows.append(row)
+
+    with transaction() as conn:
+        merge_rows(conn, "dbo.Predictions", PREDICTION_COLUMNS, ["CoinID", "BaseTime"], rows,
+                   update_columns=PREDICTION_COLUMNS[2:])
+    print(f" Forecasts: {len(rows)}/{len(tasks)} coins ({time.perf_counter() - started:.1f}s)")
+    return len(rows)
+
+
+if __name__ == "__main__":
+    registry.load()
+    run()
@@ -1,13 +1,27 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
-from datetime import datetime
-from database import execute_query
-from alert import check_all_coins
-from model import predict_next_3_days
-from tensorflow.keras.models import load_model
-import pickle, os
+from datetime import datetime, timedelta
+from database import execute_query_async, fetch_frame_async
+from coins import registry, BASE_INTERVAL
+from alert import CURRENT_QUERY, alert_rows
+import retention
+from model import predict_next_3_days, load_price_data
+from model_registry import models
+import os
+import json
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
 import pandas as pd 
+import orjson
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+API_CACHE_MAX_BYTES = int(os.getenv("API_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+API_CACHE_CHECK_SECONDS = float(os.getenv("API_CACHE_CHECK_SECONDS", "5"))  # watermark-ın yoxlanma tezliyi
 
 
 app = FastAPI(title="Crypto API", version="1.0")
@@ -15,22 +29,193 @@ app = FastAPI(title="Crypto API", version="1.0")
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
 
 
+@app.on_event("startup")
+def load_registry():
+    registry.load()
+
+
+@app.on_event("startup")
+async def preload_models():
+    # populyar modellər arxa fonda yüklənir, server gözləmədən işə düşür
+    asyncio.get_running_loop().run_in_executor(None, models.preload)
+
+
+async def resolve_coin(symbol: str) -> int:
+    coin_id = registry.by_symbol.get(symbol) if registry.loaded else None
+    if coin_id is None:
+        # tapılmasa registry DB-dən yenidən yüklənir, event loop bloklanmasın deyə thread-də
+        coin_id = await asyncio.to_thread(registry.id_for_symbol, symbol)
+    if coin_id is None:
+        raise HTTPException(status_code=404, detail=f"{symbol} üçün data tapılmadı")
+    return coin_id
+
+
+async def db_query(query, params=None):
+    """Async sorğu: timeout → 504, digər DB xətaları çap olunur və None qaytarılır"""
+    try:
+        return await execute_query_async(query, params)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Sorğu vaxtı bitdi")
+    except Exception as e:
+        print(f"❌ Sorğu icra xətası: {e}")
+        return None
+
+
+async def db_frame(query, dtypes, params=None):
+    """db_query kimi, amma tipli sütunlarla (float64 qiymətlər, datetime64 zamanlar)"""
+    try:
+        return await fetch_frame_async(query, dtypes, params)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Sorğu vaxtı bitdi")
+    except Exception as e:
+        print(f"❌ Sorğu icra xətası: {e}")
+        return None
+
+
+FORMATS = ("json", "columnar", "arrow")
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+def check_format(fmt):
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format {FORMATS} arasında olmalıdır")
+
+
+def frame_response(df, fmt, **meta):
+    """DataFrame-i birbaşa NumPy sütunlarından serializasiya edir, sətir-sətir dict yaradılmır.
+    json: {"data": [{...}, ...]} (köhnə forma), columnar: {"columns": {ad: [...]}}, arrow: Arrow IPC stream"""
+    if fmt == "arrow":
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({key: str(value) for key, value in meta.items() if value is not None})
+        sink = pa.BufferOutputStream()
+        with ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return Response(sink.getvalue().to_pybytes(), media_type=ARROW_MEDIA_TYPE)
+
+    head = orjson.dumps({**meta, "count": len(df)})[:-1]
+    if fmt == "columnar":
+        columns = {name: df[name].to_numpy() if df[name].dtype != object else df[name].tolist() for name in df.columns}
+        body = head + b',"columns":' + orjson.dumps(columns, option=orjson.OPT_SERIALIZE_NUMPY) + b"}"
+    else:
+        body = head + b',"data":' + df.to_json(orient="records", date_format="iso", date_unit="s").encode() + b"}"
+    return Response(body, media_type="application/json")
+
+
+class ResultCache:
+    """Endpoint nəticələri üçün yaddaş limitli LRU keş. Pipeline hər commit-də IngestionWatermarks.UpdatedDate-i
+    yenilədiyi üçün MAX(UpdatedDate) ingestion generation kimi istifadə olunur; o dəyişəndə keş təmizlənir"""
+
+    def __init__(self, max_bytes=API_CACHE_MAX_BYTES, check_seconds=API_CACHE_CHECK_SECONDS):
+        self.max_bytes = max_bytes
+        self.check_seconds = check_seconds
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # key -> (nəticə, ölçü)
+        self.size = 0
+        self.generation = None
+        self.checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    async def current_generation(self):
+        """Watermark-ı ən çox check_seconds-da bir dəfə oxuyur; DB əlçatmazdırsa None"""
+        now = time.monotonic()
+        with self.lock:
+            if now - self.checked_at < self.check_seconds:
+                return self.generation
+            self.checked_at = now
+
+        try:
+            df = await execute_query_async("SELECT MAX(UpdatedDate) AS Generation, COUNT(*) AS Streams FROM dbo.IngestionWatermarks")
+            generation = tuple(str(v) for v in df.iloc[0])
+        except Exception:
+            generation = None
+        with self.lock:
+            changed = generation != self.generation
+            if changed:
+                self.entries.clear()
+                self.size = 0
+                reload = generation is not None and self.generation is not None
+                self.generation = generation
+        if changed and reload:
+            # yeni coin-lər də pipeline commit-i ilə gəlir
+            await asyncio.to_thread(registry.load)
+        return generation
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, generation):
+        size = len(value.body) if isinstance(value, Response) else len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if generation != self.generation:
+                return  # hesablanarkən data dəyişib
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.size, "maxBytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "generation": self.generation}
+
+
+result_cache = ResultCache()
+
+
+def cached(func):
+    """Endpoint nəticəsini (ad, parametrlər) açarı ilə keşləyir; HTTPException-lar keşlənmir"""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        generation = await result_cache.current_generation()
+        if generation is None:
+            return await func(*args, **kwargs)
+        key = (func.__name__, args, tuple(sorted(kwargs.items())))
+        result = result_cache.get(key)
+        if result is None:
+            result = await func(*args, **kwargs)
+            result_cache.put(key, result, generation)
+        return result
+    return wrapper
+
+
 @app.get("/")
-def root():
+async def root():
     return {"status": "OK", "message": "Crypto API işləyir"}
 
+PRICES_DTYPES = {"OpenTime": "datetime64[ns]", "ClosePrice": "float64", "Volume": "float64"}
+RANGE_DTYPES = {"OpenTime": "datetime64[ns]", "OpenPrice": "float64", "HighPrice": "float64", "LowPrice": "float64", "ClosePrice": "float64", "Volume": "float64"}
+DAILY_DTYPES = {"OpenTime": "datetime64[ns]", "ClosePrice": "float64", "PrevClose": "float64", "DailyReturnPct": "float64"}
+
+
 @app.get("/prices/{symbol}")
-def get_prices(symbol: str, limit: int = 50):
+@cached
+async def get_prices(symbol: str, limit: int = 50, interval: str = BASE_INTERVAL, fmt: str = Query("json", alias="format")):
     if limit < 1 or limit > 1000:
         raise HTTPException(status_code=400, detail="Limit 1-1000 arasında olmalıdır")
+    check_format(fmt)
     
+    coin_id = await resolve_coin(symbol)
     query = """
-        SELECT TOP (?) ph.OpenTime, ph.ClosePrice, ph.Volume FROM PriceHistory ph JOIN Coins c ON ph.CoinID = c.CoinID
-        WHERE c.Symbol = ?
+        SELECT TOP (?) ph.OpenTime, ph.ClosePrice, ph.Volume FROM PriceHistory ph
+        WHERE ph.CoinID = ? AND ph.Interval = ?
         ORDER BY ph.OpenTime DESC
     """
     
-    df = execute_query(query, params=(limit, symbol))
+    df = await db_frame(query, PRICES_DTYPES, params=(limit, coin_id, interval))
     
     if df is None:
         raise HTTPException(status_code=500, detail="Database xətası")
@@ -38,49 +223,50 @@ def get_prices(symbol: str, limit: int = 50):
     if df.empty:
         raise HTTPException(status_code=404, detail=f"{symbol} üçün data tapılmadı")
     
-    return {"symbol": symbol, "count": len(df), "data": df.to_dict(orient="records")}
+    return frame_response(df, fmt, symbol=symbol)
 
 
 @app.get("/coins")
-def get_coins():
-    query = "SELECT Symbol FROM Coins ORDER BY Symbol"
-    df = execute_query(query)
+@cached
+async def get_coins():
+    symbols = registry.symbols()
     
-    if df is None:
+    if not registry.loaded:
         raise HTTPException(status_code=500, detail="Database xətası")
     
-    if df.empty:
+    if not symbols:
         raise HTTPException(status_code=404, detail="Heç bir coin tapılmadı")
     
-    return {"count": len(df), "coins": df['Symbol'].tolist()}
+    return {"count": len(symbols), "coins": symbols}
 
 
 #==========================================
 @app.get("/coins/detail")
-def coins_detail():
-    query = "select Symbol, Name from dbo.Coins order by Name"
-    df = execute_query(query)
+@cached
+async def coins_detail():
+    coins = registry.details()
     
-    if df is None:
+    if not registry.loaded:
         raise HTTPException(status_code=500, detail="Database xətası")
     
-    if df.empty:
+    if not coins:
         raise HTTPException(status_code=404, detail="Heç bir coin tapılmadı")
 
-    return {"count": len(df), "coins": df.to_dict(orient="records")}
+    return {"count": len(coins), "coins": coins}
 #============================================
 
 
 @app.get("/stats/{symbol}")
-def get_stats(symbol: str):
+@cached
+async def get_stats(symbol: str, interval: str = BASE_INTERVAL):
+    coin_id = await resolve_coin(symbol)
     query = """
         SELECT COUNT(*) as total_records, MIN(ph.ClosePrice) as min_price, MAX(ph.ClosePrice) as max_price, AVG(ph.ClosePrice) as avg_price, MIN(ph.OpenTime) as first_date, MAX(ph.OpenTime) as last_date
         FROM PriceHistory ph
-        JOIN Coins c ON ph.CoinID = c.CoinID
-        WHERE c.Symbol = ?
+        WHERE ph.CoinID = ? AND ph.Interval = ?
     """
     
-    df = execute_query(query, params=(symbol,))
+    df = await db_query(query, params=(coin_id, interval))
     
     if df is None or df.empty:
         raise HTTPException(status_code=404, detail=f"{symbol} üçün data tapılmadı")
@@ -89,15 +275,24 @@ def get_stats(symbol: str):
 
 
 @app.get("/prices/range/{symbol}")
-def get_price_range(symbol: str, start_date: str, end_date: str):
+@cached
+async def get_price_range(symbol: str, start_date: str, end_date: str, interval: str = BASE_INTERVAL, fmt: str = Query("json", alias="format")):
+    check_format(fmt)
+    # sətir kimi ötürülsə SQLite tarixləri mətn kimi müqayisə edir ("2020-09-16" < "2020-09-16 00:00:00")
+    try:
+        start, end = pd.Timestamp(start_date).to_pydatetime(), pd.Timestamp(end_date).to_pydatetime()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start_date/end_date düzgün tarix deyil")
+
+    coin_id = await resolve_coin(symbol)
     query = """
-        SELECT ph.OpenTime, ph.OpenPrice, ph.HighPrice, ph.LowPrice, ph.ClosePrice, ph.Volume FROM PriceHistory ph JOIN Coins c ON ph.CoinID = c.CoinID
-        WHERE c.Symbol = ?
+        SELECT ph.OpenTime, ph.OpenPrice, ph.HighPrice, ph.LowPrice, ph.ClosePrice, ph.Volume FROM PriceHistory ph
+        WHERE ph.CoinID = ? AND ph.Interval = ?
         AND ph.OpenTime >= ? AND ph.OpenTime <= ?
         ORDER BY ph.OpenTime ASC
     """
     
-    df = execute_query(query, params=(symbol, start_date, end_date))
+    df = await db_frame(query, RANGE_DTYPES, params=(coin_id, interval, start, end))
     
     if df is None:
         raise HTTPException(status_code=500, detail="Database xətası")
@@ -105,20 +300,21 @@ def get_price_range(symbol: str, start_date: str, end_date: str):
     if df.empty:
         raise HTTPException(status_code=404, detail="Data tapılmadı")
     
-    return {"symbol": symbol, "count": len(df), "data": df.to_dict(orient="records")}
+    return frame_response(df, fmt, symbol=symbol)
 
 
 @app.get("/latest/{symbol}")
-def get_latest(symbol: str):
+@cached
+async def get_latest(symbol: str, interval: str = BASE_INTERVAL):
+    coin_id = await resolve_coin(symbol)
     query = """
         SELECT TOP 1 ph.OpenTime, ph.OpenPrice, ph.HighPrice, ph.LowPrice, ph.ClosePrice, ph.Volume, ph.NumberOfTrades
         FROM PriceHistory ph
-        JOIN Coins c ON ph.CoinID = c.CoinID
-        WHERE c.Symbol = ?
+        WHERE ph.CoinID = ? AND ph.Interval = ?
         ORDER BY ph.OpenTime DESC
     """
     
-    df = execute_query(query, params=(symbol,))
+    df = await db_query(query, params=(coin_id, interval))
 
     if df is None or df.empty:
         raise HTTPException(status_code=404, detail=f"{symbol} üçün data tapılmadı")
@@ -126,34 +322,81 @@ def get_latest(symbol: str):
     return {"symbol": symbol, "latest": df.to_dict(orient="records")[0]}
 
 
+DAILY_PAGE_MAX = 5000
+DAILY_FIRST = datetime(1900, 1, 1)  # after verilməyəndə ilk səhifə
+
+
 @app.get("/prices/daily/{symbol}")
-def daily_return(symbol: str):
+@cached
+async def daily_return(symbol: str, after: str = None, limit: int = 1000, fmt: str = Query("json", alias="format")):
+    """PriceHistory-də hazır yazılmış PrevClose/ReturnPct-ni keyset pagination ilə qaytarır:
+    növbəti səhifə üçün cavabdakı next dəyəri after kimi göndərilir"""
+    if limit < 1 or limit > DAILY_PAGE_MAX:
+        raise HTTPException(status_code=400, detail=f"Limit 1-{DAILY_PAGE_MAX} arasında olmalıdır")
+    check_format(fmt)
+    try:
+        start = pd.Timestamp(after).to_pydatetime() if after else DAILY_FIRST
+    except ValueError:
+        raise HTTPException(status_code=400, detail="after düzgün tarix deyil")
+
+    coin_id = await resolve_coin(symbol)
     query = """
-        SELECT
-        c.Symbol,
-        ph.OpenTime,
-        ph.ClosePrice,
-        LAG(ph.ClosePrice) OVER (PARTITION BY ph.CoinID ORDER BY ph.OpenTime) AS PrevClose,
-        (ph.ClosePrice - LAG(ph.ClosePrice) OVER (PARTITION BY ph.CoinID ORDER BY ph.OpenTime)) 
-        / LAG(ph.ClosePrice) OVER (PARTITION BY ph.CoinID ORDER BY ph.OpenTime) * 100 AS DailyReturnPct
+        SELECT TOP (?) ph.OpenTime, ph.ClosePrice, ph.PrevClose, ph.ReturnPct AS DailyReturnPct
         FROM dbo.PriceHistory ph
-        JOIN dbo.Coins c ON c.CoinID = ph.CoinID
-        WHERE c.Symbol = ?
+        WHERE ph.CoinID = ? AND ph.Interval = ? AND ph.OpenTime > ?
         ORDER BY ph.OpenTime
     """
 
-    df = execute_query(query, params=(symbol,))
+    df = await db_frame(query, DAILY_DTYPES, params=(limit, coin_id, BASE_INTERVAL, start))
 
-    if df is None or df.empty:
+    if df is None:
+        raise HTTPException(status_code=500, detail="Database xətası")
+
+    if df.empty:
         raise HTTPException(status_code=404, detail=f"{symbol} üçün data tapılmadı")
 
-    return {"symbol": symbol, "count": len(df), "data": df.to_dict(orient="records")}
+    next_after = df["OpenTime"].iloc[-1].isoformat() if len(df) == limit else None
+    if fmt == "json":
+        df.insert(0, "Symbol", symbol)  # köhnə cavab formasında hər sətirdə Symbol var idi
+    return frame_response(df, fmt, symbol=symbol, next=next_after)
+
+
+@app.get("/ticker/{symbol}")
+async def ticker_history(symbol: str, start_date: str, end_date: str, dataset: str = "ticker", step_minutes: int = None):
+    """24 saatlıq ticker / order book tarixçəsi: aralığı təmin edən ən qaba tier-dən (raw, 1h, 1d) oxunur"""
+    if dataset not in retention.DATASETS:
+        raise HTTPException(status_code=400, detail=f"dataset {list(retention.DATASETS)} arasında olmalıdır")
+    try:
+        start, end = pd.Timestamp(start_date).to_pydatetime(), pd.Timestamp(end_date).to_pydatetime()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start_date/end_date düzgün tarix deyil")
+    coin_id = await resolve_coin(symbol)
+    step = timedelta(minutes=step_minutes) if step_minutes else None
+    tier, query, dtypes, params = retention.read_query(dataset, coin_id, start, end, step)
+    df = await db_frame(query, dtypes, params=params)
+
+    if df is None:
+        raise HTTPException(status_code=500, detail="Database xətası")
+
+    if df.empty:
+        raise HTTPException(status_code=404, detail="Data tapılmadı")
+
+    return {"symbol": symbol, "tier": tier, "count": len(df), "data": df.to_dict(orient="records")}
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return result_cache.stats()
 
 
 @app.get("/alert")
-def alert():
+@cached
+async def alert():
+    df = await db_query(CURRENT_QUERY, (BASE_INTERVAL,))
+    if df is None:
+        raise HTTPException(status_code=500, detail="Database xətası")
     try:
-        alerts = check_all_coins()
+        alerts = alert_rows(df)
         formatted_alerts = []
         for alert in alerts:
             formatted_alerts.append({
@@ -177,34 +420,24 @@ def alert():
         raise HTTPException(status_code=500, detail=str(e))
 
 
-MODEL_FOLDER = "models"
-@app.get("/predict/{symbol}")
-def predict(symbol: str):
-
-    model_path = f"{MODEL_FOLDER}/lstm_{symbol}.keras"
-    scaler_path = f"{MODEL_FOLDER}/lstm_{symbol}_scaler.pkl"
-    if not os.path.exists(model_path):
+def run_prediction(symbol):
+    """Inference CPU işidir, event loop-dan kənarda icra olunur; model registry-dən götürülür"""
+    pair = models.get(symbol)
+    if pair is None:
         raise HTTPException(404, "Model yoxdur")
-
-    model = load_model(model_path)
-    scaler = pickle.load(open(scaler_path, "rb"))
-    df = execute_query("""
-        SELECT TOP (5000)
-            ph.OpenTime, ph.HighPrice, ph.LowPrice,
-            ph.Volume, ph.ClosePrice, ph.OpenPrice
-        FROM dbo.PriceHistory ph
-        JOIN dbo.Coins c ON ph.CoinID = c.CoinID
-        WHERE c.Symbol = ?
-        ORDER BY ph.OpenTime
-    """, params=(symbol,))
+    model, scaler = pair
+    df = load_price_data(symbol, limit=5000)
 
     if df is None or df.empty:
         raise HTTPException(404, "Data yoxdur")
 
-    df["OpenTime"] = pd.to_datetime(df["OpenTime"])
-    df.set_index("OpenTime", inplace=True)
-    preds = predict_next_3_days(model, scaler, df)
-    current = df["ClosePrice"].iloc[-1]
+    return predict_next_3_days(model, scaler, df), df["ClosePrice"].iloc[-1]
+
+
+@app.get("/predict/{symbol}")
+async def predict(symbol: str):
+    await resolve_coin(symbol)
+    preds, current = await asyncio.to_thread(run_prediction, symbol)
     return {
         "symbol": symbol,
         "current_price": round(float(current), 4),
@@ -213,5 +446,47 @@ def predict(symbol: str):
         "day_3": round(float(preds[2]), 4)}
 
 
+PREDICT_MAX_SYMBOLS = 100
+
+
+@app.get("/predict")
+async def predict_many(symbols: str = None):
+    """forecast.py-ın hazırladığı son proqnozlar, bir sorğu ilə; symbols verilməzsə bütün coin-lər"""
+    names = [s.strip() for s in symbols.split(",") if s.strip()] if symbols else registry.symbols()
+    if not names or len(names) > PREDICT_MAX_SYMBOLS:
+        raise HTTPException(status_code=400, detail=f"1-{PREDICT_MAX_SYMBOLS} simvol göstərilməlidir")
+    ids = {registry.by_symbol[name]: name for name in names if name in registry.by_symbol}
+    if not ids:
+        raise HTTPException(status_code=404, detail="Coin tapılmadı")
+
+    query = f"""
+        WITH latest AS (
+            SELECT p.CoinID, p.BaseTime, p.CurrentPrice, p.Day1, p.Day2, p.Day3,
+                   ROW_NUMBER() OVER (PARTITION BY p.CoinID ORDER BY p.BaseTime DESC) AS rn
+            FROM dbo.Predictions p
+            WHERE p.CoinID IN ({", ".join("?" * len(ids))})
+        )
+        SELECT CoinID, BaseTime, CurrentPrice, Day1, Day2, Day3 FROM latest WHERE rn = 1
+    """
+    df = await db_query(query, params=tuple(ids))
+    if df is None:
+        raise HTTPException(status_code=500, detail="Database xətası")
+
+    predictions = [{
+        "symbol": ids[int(row.CoinID)],
+        "base_time": str(row.BaseTime),
+        "current_price": round(float(row.CurrentPrice), 4),
+        "day_1": round(float(row.Day1), 4),
+        "day_2": round(float(row.Day2), 4),
+        "day_3": round(float(row.Day3), 4)} for row in df.itertuples(index=False)]
+    found = {p["symbol"] for p in predictions}
+    return {"count": len(predictions), "predictions": predictions, "missing": [name for name in names if name not in found]}
+
+
+@app.get("/models/stats")
+async def model_stats():
+    return models.stats()
+
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
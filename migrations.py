@@ -0,0 +1,195 @@
+import schema
+
+# Versiyalı sxem miqrasiyaları. Yeni baza schema.py-dan birbaşa son versiyada yaradılır;
+# SchemaVersions cədvəli olmayan köhnə baza (ilkin database.sql) versiya 0 sayılır və miqrasiyalar ardıcıl icra olunur.
+# Hər miqrasiya: (versiya, təsvir, {dialekt: [SQL, ...]}). Dialekt üçün siyahı yoxdursa, miqrasiya yalnız qeyd olunur.
+
+
+def _drop_primary_key(table):
+    """İlkin sxemdə PK adsız idi, ona görə ad sys.key_constraints-dən tapılır"""
+    return f"""
+        DECLARE @pk sysname = (SELECT name FROM sys.key_constraints WHERE parent_object_id = OBJECT_ID('dbo.{table}') AND type = 'PK');
+        IF @pk IS NOT NULL EXEC('ALTER TABLE dbo.{table} DROP CONSTRAINT ' + @pk);
+    """
+
+
+def _create_table(name, dialect):
+    return schema.create_table(*next(t for t in schema.TABLES if t[0] == name), dialect)
+
+
+def _partition_snapshots(table, key):
+    """Snapshot cədvəlinin bütün indekslərini aylıq partition scheme-ə köçürür (TRUNCATE ... PARTITIONS üçün lazımdır)"""
+    return [
+        f"ALTER TABLE dbo.{table} DROP CONSTRAINT PK_{table}",
+        f"CREATE CLUSTERED INDEX CX_{table}_CoinID_SnapshotTime ON dbo.{table} (CoinID, SnapshotTime) "
+        f"WITH (DROP_EXISTING = ON) ON {schema.PARTITION_SCHEME}",
+        f"ALTER TABLE dbo.{table} ADD CONSTRAINT PK_{table} PRIMARY KEY NONCLUSTERED ({key}, SnapshotTime) ON {schema.PARTITION_SCHEME}",
+        f"CREATE INDEX IX_{table}_SnapshotTime ON dbo.{table} (SnapshotTime) WITH (DROP_EXISTING = ON) ON {schema.PARTITION_SCHEME}",
+    ]
+
+
+# Mövcud bar-lar üçün PrevClose/ReturnPct bir dəfə LAG ilə hesablanır, sonrakılar pipeline-da yazılır
+_BACKFILL_RETURNS = """
+    UPDATE PriceHistory SET PrevClose = r.Prev, ReturnPct = (PriceHistory.ClosePrice - r.Prev) / NULLIF(r.Prev, 0) * 100
+    FROM (SELECT PriceID, LAG(ClosePrice) OVER (PARTITION BY CoinID, Interval ORDER BY OpenTime) AS Prev FROM PriceHistory) r
+    WHERE PriceHistory.PriceID = r.PriceID
+"""
+
+
+MIGRATIONS = [
+    (1, "PriceHistory: Interval column, clustered (CoinID, Interval, OpenTime)", {
+        "mssql": [
+            "IF COL_LENGTH('dbo.PriceHistory', 'Interval') IS NULL "
+            "ALTER TABLE dbo.PriceHistory ADD Interval VARCHAR(4) NOT NULL DEFAULT '1d'",
+            "IF OBJECT_ID('dbo.UQ_Coin_OpenTime') IS NOT NULL ALTER TABLE dbo.PriceHistory DROP CONSTRAINT UQ_Coin_OpenTime",
+            "DROP INDEX IF EXISTS IX_PriceHistory_CoinID ON dbo.PriceHistory",
+            _drop_primary_key("PriceHistory"),
+            "ALTER TABLE dbo.PriceHistory ADD CONSTRAINT UQ_Coin_Interval_OpenTime UNIQUE CLUSTERED (CoinID, Interval, OpenTime)",
+            "ALTER TABLE dbo.PriceHistory ADD CONSTRAINT PK_PriceHistory PRIMARY KEY NONCLUSTERED (PriceID)",
+        ],
+    }),
+    (2, "IngestionWatermarks table, seeded from PriceHistory", {
+        "mssql": [
+            """
+            IF OBJECT_ID('dbo.IngestionWatermarks') IS NULL
+            CREATE TABLE dbo.IngestionWatermarks (
+                CoinID INT NOT NULL,
+                Interval VARCHAR(4) NOT NULL,
+                LastOpenTime DATETIME2 NOT NULL,
+                LastCloseTime DATETIME2 NOT NULL,
+                UpdatedDate DATETIME2 NOT NULL DEFAULT SYSDATETIME(),
+                CONSTRAINT PK_IngestionWatermarks PRIMARY KEY (CoinID, Interval),
+                CONSTRAINT FK_IngestionWatermarks_Coins FOREIGN KEY (CoinID) REFERENCES dbo.Coins(CoinID)
+            )
+            """,
+            """
+            INSERT INTO dbo.IngestionWatermarks (CoinID, Interval, LastOpenTime, LastCloseTime)
+            SELECT ph.CoinID, ph.Interval, MAX(ph.OpenTime), MAX(ph.CloseTime)
+            FROM dbo.PriceHistory ph
+            WHERE NOT EXISTS (SELECT 1 FROM dbo.IngestionWatermarks w WHERE w.CoinID = ph.CoinID AND w.Interval = ph.Interval)
+            GROUP BY ph.CoinID, ph.Interval
+            """,
+        ],
+    }),
+    (3, "Ticker24hStats/OrderBookSnapshot clustered on (CoinID, SnapshotTime)", {
+        "mssql": [
+            _drop_primary_key("Ticker24hStats"),
+            "DROP INDEX IF EXISTS IX_Ticker24hStats_CoinID ON dbo.Ticker24hStats",
+            "CREATE CLUSTERED INDEX CX_Ticker24hStats_CoinID_SnapshotTime ON dbo.Ticker24hStats (CoinID, SnapshotTime)",
+            "ALTER TABLE dbo.Ticker24hStats ADD CONSTRAINT PK_Ticker24hStats PRIMARY KEY NONCLUSTERED (StatID)",
+            _drop_primary_key("OrderBookSnapshot"),
+            "DROP INDEX IF EXISTS IX_OrderBookSnapshot_CoinID ON dbo.OrderBookSnapshot",
+            "CREATE CLUSTERED INDEX CX_OrderBookSnapshot_CoinID_SnapshotTime ON dbo.OrderBookSnapshot (CoinID, SnapshotTime)",
+            "ALTER TABLE dbo.OrderBookSnapshot ADD CONSTRAINT PK_OrderBookSnapshot PRIMARY KEY NONCLUSTERED (SnapshotID)",
+        ],
+        "sqlite": [
+            "DROP INDEX IF EXISTS IX_Ticker24hStats_CoinID",
+            "CREATE INDEX IF NOT EXISTS CX_Ticker24hStats_CoinID_SnapshotTime ON Ticker24hStats (CoinID, SnapshotTime)",
+            "DROP INDEX IF EXISTS IX_OrderBookSnapshot_CoinID",
+            "CREATE INDEX IF NOT EXISTS CX_OrderBookSnapshot_CoinID_SnapshotTime ON OrderBookSnapshot (CoinID, SnapshotTime)",
+        ],
+        "duckdb": [
+            "DROP INDEX IF EXISTS IX_Ticker24hStats_CoinID",
+            "CREATE INDEX IF NOT EXISTS CX_Ticker24hStats_CoinID_SnapshotTime ON Ticker24hStats (CoinID, SnapshotTime)",
+            "DROP INDEX IF EXISTS IX_OrderBookSnapshot_CoinID",
+            "CREATE INDEX IF NOT EXISTS CX_OrderBookSnapshot_CoinID_SnapshotTime ON OrderBookSnapshot (CoinID, SnapshotTime)",
+        ],
+    }),
+    (4, "PriceHistory: columnstore index replaces IX_PriceHistory_OpenTime", {
+        "mssql": [
+            "DROP INDEX IF EXISTS IX_PriceHistory_OpenTime ON dbo.PriceHistory",
+            "IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'NCCI_PriceHistory') "
+            "CREATE NONCLUSTERED COLUMNSTORE INDEX NCCI_PriceHistory ON dbo.PriceHistory "
+            "(CoinID, Interval, OpenTime, OpenPrice, HighPrice, LowPrice, ClosePrice, Volume, NumberOfTrades)",
+        ],
+        "sqlite": ["DROP INDEX IF EXISTS IX_PriceHistory_OpenTime"],
+        "duckdb": ["DROP INDEX IF EXISTS IX_PriceHistory_OpenTime"],
+    }),
+    (5, "Monthly snapshot partitions, Ticker24hStatsRollup/OrderBookRollup", {
+        "mssql": schema.PARTITIONING
+                 + _partition_snapshots("Ticker24hStats", "StatID")
+                 + _partition_snapshots("OrderBookSnapshot", "SnapshotID")
+                 + [_create_table("Ticker24hStatsRollup", "mssql"), _create_table("OrderBookRollup", "mssql")],
+        "sqlite": [_create_table("Ticker24hStatsRollup", "sqlite"), _create_table("OrderBookRollup", "sqlite")],
+        "duckdb": [_create_table("Ticker24hStatsRollup", "duckdb"), _create_table("OrderBookRollup", "duckdb")],
+    }),
+    (6, "PriceHistory: materialized PrevClose/ReturnPct", {
+        "mssql": [
+            "IF COL_LENGTH('dbo.PriceHistory', 'PrevClose') IS NULL ALTER TABLE dbo.PriceHistory ADD PrevClose DECIMAL(18,8) NULL, ReturnPct FLOAT NULL",
+            """
+            WITH r AS (
+                SELECT PrevClose, ReturnPct, ClosePrice,
+                       LAG(ClosePrice) OVER (PARTITION BY CoinID, Interval ORDER BY OpenTime) AS Prev
+                FROM dbo.PriceHistory
+            )
+            UPDATE r SET PrevClose = Prev, ReturnPct = (ClosePrice - Prev) / NULLIF(Prev, 0) * 100
+            """,
+        ],
+        "sqlite": ["ALTER TABLE PriceHistory ADD COLUMN PrevClose REAL", "ALTER TABLE PriceHistory ADD COLUMN ReturnPct REAL", _BACKFILL_RETURNS],
+        "duckdb": ["ALTER TABLE PriceHistory ADD COLUMN PrevClose DOUBLE", "ALTER TABLE PriceHistory ADD COLUMN ReturnPct DOUBLE", _BACKFILL_RETURNS],
+    }),
+    (7, "AnomalyState table", {
+        # vəziyyət ilk ingestion-da PriceHistory-dən qurulur, burada doldurulmur
+        dialect: [_create_table("AnomalyState", dialect)] for dialect in schema.DIALECTS
+    }),
+    (8, "Predictions table", {dialect: [_create_table("Predictions", dialect)] for dialect in schema.DIALECTS}),
+]
+
+assert MIGRATIONS[-1][0] == schema.SCHEMA_VERSION, "schema.SCHEMA_VERSION son miqrasiya ilə eyni olmalıdır"
+
+_TABLE_EXISTS = {
+    "mssql": "SELECT 1 FROM sys.tables WHERE name = ?",
+    "sqlite": "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+    "duckdb": "SELECT 1 FROM information_schema.tables WHERE table_name = ?",
+}
+
+
+def _table_exists(conn, dialect, table):
+    return conn.execute(_TABLE_EXISTS[dialect], (table,)).fetchone() is not None
+
+
+def current_version(conn, dialect):
+    """Bazanın sxem versiyası: boş baza üçün None, SchemaVersions olmayan köhnə baza üçün 0"""
+    if _table_exists(conn, dialect, "SchemaVersions"):
+        row = conn.execute("SELECT MAX(Version) FROM " + ("dbo." if dialect == "mssql" else "") + "SchemaVersions").fetchone()
+        if row and row[0] is not None:
+            return int(row[0])
+    return 0 if _table_exists(conn, dialect, "Coins") else None
+
+
+def _stamp(conn, dialect, version, description):
+    table = ("dbo." if dialect == "mssql" else "") + "SchemaVersions"
+    conn.execute(f"INSERT INTO {table} (Version, Description) VALUES (?, ?)", (version, description))
+
+
+def upgrade(conn, dialect):
+    """Bazanı son versiyaya qədər yeniləyir; hər miqrasiya ayrıca commit olunur. İcra olunan miqrasiyaların sayını qaytarır"""
+    version = current_version(conn, dialect)
+    if version is None:
+        for statement in schema.statements(dialect):
+            conn.execute(statement)
+        _stamp(conn, dialect, schema.SCHEMA_VERSION, "initial schema")
+        conn.commit()
+        return 0
+
+    if not _table_exists(conn, dialect, "SchemaVersions"):
+        conn.execute(schema.create_table(*schema.TABLES[0], dialect))
+    applied = 0
+    for number, description, steps in MIGRATIONS:
+        if number <= version:
+            continue
+        for statement in steps.get(dialect, []):
+            conn.execute(statement)
+        _stamp(conn, dialect, number, description)
+        conn.commit()
+        applied += 1
+    return applied
+
+
+if __name__ == "__main__":
+    # py migrations.py  → .env-dəki bazanı (DB_BACKEND) son versiyaya yeniləyir
+    # (sqlite/duckdb bazaları ilk qoşulmada avtomatik yenilənir)
+    import database
+    with database.connection() as conn:
+        applied = upgrade(conn, database.backend.name)
+        print(f"Schema version {current_version(conn, database.backend.name)} ({applied} migrations applied)")
@@ -1,14 +1,25 @@
 import os
+import sys
+import json
 import pickle
+import hashlib
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+import tensorflow as tf
 from sklearn.preprocessing import MinMaxScaler
-from sklearn.metrics import mean_squared_error, mean_absolute_error, mean_absolute_percentage_error
-from tensorflow.keras.models import Sequential
+from sklearn.metrics import mean_squared_error, mean_absolute_error
+from tensorflow.keras.models import Sequential, load_model
 from tensorflow.keras.layers import LSTM, Dense, Dropout, Bidirectional
 from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau
-from datetime import datetime
-from database import execute_query
+from tensorflow.keras.utils import Sequence
+from datetime import datetime, timedelta
+from database import fetch_frame
+from coins import registry, BASE_INTERVAL
+import price_cache
 
 
 MODEL_FOLDER = "models"
@@ -17,6 +28,16 @@ HORIZON = 3
 EPOCHS = 100
 BATCH_SIZE = 32
 
+TRAIN_WORKERS = int(os.getenv("TRAIN_WORKERS", str(os.cpu_count() or 1)))  # paralel öyrədilən coin sayı
+MANIFEST_PATH = f"{MODEL_FOLDER}/manifest.json"
+
+# Gündəlik rejim: mövcud model son pəncərələrdə bir neçə epoch davam etdirilir, tam retrain periodikdir
+FINETUNE_EPOCHS = int(os.getenv("FINETUNE_EPOCHS", "3"))
+FINETUNE_WINDOWS = int(os.getenv("FINETUNE_WINDOWS", "500"))    # fine-tune üçün son pəncərə sayı
+FINETUNE_TEST_WINDOWS = 30                                       # MAPE-nin hesablandığı son out-of-sample pəncərələr
+FULL_RETRAIN_DAYS = int(os.getenv("FULL_RETRAIN_DAYS", "7"))
+DRIFT_TOLERANCE = float(os.getenv("DRIFT_TOLERANCE", "0.1"))    # tam retrain-dəki drift-ə əlavə icazə verilən pay
+
 ALERT_THRESHOLD_PERCENT = 5.0
 ALERT_MAPE_THRESHOLD = 15.0
 
@@ -24,11 +45,18 @@ os.makedirs(MODEL_FOLDER, exist_ok=True)
 
 
 def get_all_coins():
-    df = execute_query("SELECT Symbol FROM dbo.Coins")
-    return df["Symbol"].tolist()
+    return registry.symbols()
+
 
+PRICE_COLUMNS = ["HighPrice", "LowPrice", "Volume", "ClosePrice", "OpenPrice"]
+PRICE_DTYPES = {"OpenTime": "datetime64[ns]", **{c: "float64" for c in PRICE_COLUMNS}}
+
+
+def load_price_data(symbol, limit=5000, interval=BASE_INTERVAL):
+    df = price_cache.load(symbol, interval, columns=PRICE_COLUMNS, limit=limit)
+    if df is not None and not df.empty:
+        return df
 
-def load_price_data(symbol, limit=5000):
     query = """
         SELECT TOP (?)
             ph.OpenTime,
@@ -38,13 +66,12 @@ def load_price_data(symbol, limit=5000):
             ph.ClosePrice,
             ph.OpenPrice
         FROM dbo.PriceHistory ph
-        INNER JOIN dbo.Coins c ON ph.CoinID = c.CoinID
-        WHERE c.Symbol = ?
+        WHERE ph.CoinID = ? AND ph.Interval = ?
         ORDER BY ph.OpenTime ASC
     """
-    df = execute_query(query, params=(limit, symbol))
-    df["OpenTime"] = pd.to_datetime(df["OpenTime"])
-    df.set_index("OpenTime", inplace=True)
+    df = fetch_frame(query, PRICE_DTYPES, params=(limit, registry.id_for_symbol(symbol), interval), index="OpenTime")
+    if df is None:
+        df = pd.DataFrame({c: np.empty(0, dtype=t) for c, t in PRICE_DTYPES.items()}).set_index("OpenTime")
     return df
 
 
@@ -73,12 +100,38 @@ def add_features(df):
     return df[features]
 
 
-def create_sequences(data, lookback, horizon):
-    X, y = [], []
-    for i in range(lookback, len(data) - horizon + 1):
-        X.append(data[i - lookback:i])
-        y.append(data[i:i + horizon, 0])
-    return np.array(X), np.array(y)
+def window_view(data, lookback, horizon):
+    """Bütün pəncərələr data üzərində strided view kimi (kopya yoxdur): X[w] = data[w:w+lookback],
+    y[w] = data[w+lookback:w+lookback+horizon, 0]. Split-lər bu view-da indeks aralıqlarıdır"""
+    count = max(len(data) - lookback - horizon + 1, 0)
+    X = sliding_window_view(data, lookback, axis=0)[:count].transpose(0, 2, 1)
+    y = sliding_window_view(data[lookback:, 0], horizon)[:count]
+    return X, y
+
+
+class WindowSequence(Sequence):
+    """Pəncərə view-undan batch-lər verir; yalnız cari batch materiallaşdırılır"""
+
+    def __init__(self, X, y, indices, batch_size=BATCH_SIZE, shuffle=False, **kwargs):
+        super().__init__(**kwargs)
+        self.X = X
+        self.y = y
+        self.indices = np.asarray(indices)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(0)
+        self.on_epoch_end()
+
+    def __len__(self):
+        return math.ceil(len(self.indices) / self.batch_size)
+
+    def __getitem__(self, i):
+        batch = self.indices[i * self.batch_size:(i + 1) * self.batch_size]
+        return self.X[batch].astype(np.float32), self.y[batch].astype(np.float32)
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.rng.shuffle(self.indices)
 
 
 def build_lstm(input_shape):
@@ -138,8 +191,9 @@ def check_evaluation_alerts(symbol, mape_values):
         send_alert(symbol, "LOW ACCURACY", alert_msg)
 
 
-def train_lstm(symbol):
-    df = load_price_data(symbol)
+def train_lstm(symbol, df=None):
+    if df is None:
+        df = load_price_data(symbol)
     if df.empty or len(df) < LOOKBACK + HORIZON + 100:
         return None, None, None
 
@@ -148,28 +202,25 @@ def train_lstm(symbol):
         return None, None, None
     
     split_idx = int(len(features) * 0.8)
-    train_features = features.iloc[:split_idx]
-    test_features = features.iloc[split_idx:]
-    
+
     scaler = MinMaxScaler()
-    scaler.fit(train_features.values)
+    scaler.fit(features.values[:split_idx])
+    scaled = scaler.transform(features.values)
 
-    train_scaled = scaler.transform(train_features.values)
-    test_scaled = scaler.transform(test_features.values)
-    
-    X_train, y_train = create_sequences(train_scaled, LOOKBACK, HORIZON)
-    X_test, y_test = create_sequences(test_scaled, LOOKBACK, HORIZON)
-    
-    if len(X_train) < 100 or len(X_test) < 20:
+    # train pəncərələri tam olaraq ilk 80%-də, test pəncərələri qalan hissədə yerləşir
+    X, y = window_view(scaled, LOOKBACK, HORIZON)
+    train_count = max(split_idx - LOOKBACK - HORIZON + 1, 0)
+    test_idx = np.arange(split_idx, len(X))
+
+    if train_count < 100 or len(test_idx) < 20:
         return None, None, None
-    
-    val_size = int(len(X_train) * 0.15)
-    X_val = X_train[-val_size:]
-    y_val = y_train[-val_size:]
-    X_train = X_train[:-val_size]
-    y_train = y_train[:-val_size]
 
-    model = build_lstm((LOOKBACK, X_train.shape[2]))
+    val_size = int(train_count * 0.15)
+    train = WindowSequence(X, y, np.arange(train_count - val_size), shuffle=True)
+    val = WindowSequence(X, y, np.arange(train_count - val_size, train_count))
+    test = WindowSequence(X, y, test_idx)
+
+    model = build_lstm((LOOKBACK, X.shape[2]))
 
     early_stop = EarlyStopping(
         monitor="val_loss",
@@ -185,20 +236,19 @@ def train_lstm(symbol):
         verbose=0)
 
     model.fit(
-        X_train,
-        y_train,
-        validation_data=(X_val, y_val),
+        train,
+        validation_data=val,
         epochs=EPOCHS,
-        batch_size=BATCH_SIZE,
         callbacks=[early_stop, reduce_lr],
         verbose=1)
 
-    return model, scaler, (X_test, y_test, features.shape[1])
+    return model, scaler, (test, y[test_idx], features.shape[1])
 
 
-def evaluate_model(symbol, model, scaler, test_data):
-    X_test, y_test, feature_count = test_data
-    preds = model.predict(X_test, verbose=0)
+def horizon_errors(model, scaler, test_data):
+    """Hər test pəncərəsi və horizon üçün mütləq faiz xətası (%), forma (pəncərə, HORIZON)"""
+    test, y_test, feature_count = test_data
+    preds = model.predict(test, verbose=0)
 
     y_true, y_pred = [], []
 
@@ -212,13 +262,63 @@ def evaluate_model(symbol, model, scaler, test_data):
 
     y_true = np.array(y_true)
     y_pred = np.array(y_pred)
-    mape_values = []
-    
-    for h in range(HORIZON):
-        mape = mean_absolute_percentage_error(y_true[:, h], y_pred[:, h]) * 100
-        mape_values.append(mape)
-    
+    return np.abs(y_true - y_pred) / np.maximum(np.abs(y_true), np.finfo(np.float64).eps) * 100
+
+
+def evaluate_model(symbol, model, scaler, test_data):
+    """Horizon üzrə MAPE və pəncərə xətalarını qaytarır"""
+    errors = horizon_errors(model, scaler, test_data)
+    mape_values = errors.mean(axis=0).tolist()
     check_evaluation_alerts(symbol, mape_values)
+    return mape_values, errors
+
+
+def scaler_drift(scaler, values):
+    """Datanın scaler-in öyrəndiyi [min, max] aralığından ən çox nə qədər kənara çıxdığı (aralığın payı ilə)"""
+    span = np.where(scaler.data_range_ > 0, scaler.data_range_, 1.0)
+    over = np.maximum(values.max(axis=0) - scaler.data_max_, 0)
+    under = np.maximum(scaler.data_min_ - values.min(axis=0), 0)
+    return float(((over + under) / span).max())
+
+
+def recent_features(df):
+    """Fine-tune pəncərələri üçün lazım olan son sətirlər (OpenTime index)"""
+    return add_features(df).iloc[-(FINETUNE_WINDOWS + LOOKBACK + HORIZON - 1):]
+
+
+def finetune_lstm(symbol, df, model, scaler, previous):
+    """Mövcud modeli son FINETUNE_WINDOWS pəncərədə FINETUNE_EPOCHS epoch öyrədir, scaler dəyişmir.
+    Fit-dən əvvəl son hədəf bar-ı previous["seenUntil"]-dən yeni olan pəncərələr (model onları nə öyrənib, nə
+    yoxlayıb) qiymətləndirilir və xətaları son FINETUNE_TEST_WINDOWS pəncərənin sürüşən siyahısına
+    (previous["errors"]) əlavə olunur, ona görə MAPE həmişə out-of-sample-dır.
+    Scaler yalnız train hissəsinə fit olunduğu üçün son data tam retrain-dən dərhal sonra da aralıqdan
+    bir qədər çıxır (previous["drift"]); drift bundan DRIFT_TOLERANCE çox artıbsa və ya MAPE threshold-u
+    keçibsə None qaytarır: tam retrain lazımdır. Əks halda (MAPE, errors, seenUntil)"""
+    recent = recent_features(df)
+    if len(recent) < LOOKBACK + HORIZON:
+        return None
+
+    baseline_drift = previous.get("drift") or 0.0
+    drift = scaler_drift(scaler, recent.values)
+    if drift > baseline_drift + DRIFT_TOLERANCE:
+        print(f"{symbol}: scaler drift {drift:.1%} (baseline {baseline_drift:.1%}), tam retrain")
+        return None
+
+    X, y = window_view(scaler.transform(recent.values), LOOKBACK, HORIZON)
+    target_end = recent.index[LOOKBACK + HORIZON - 1:]  # hər pəncərənin son hədəf bar-ı
+    new_idx = np.flatnonzero(target_end > pd.Timestamp(previous["seenUntil"]))
+    errors = previous["errors"]
+    if len(new_idx):
+        test_data = (WindowSequence(X, y, new_idx), y[new_idx], recent.shape[1])
+        errors = errors + horizon_errors(model, scaler, test_data).round(4).tolist()
+    errors = errors[-FINETUNE_TEST_WINDOWS:]
+    mape_values = np.mean(errors, axis=0).tolist()
+    if np.mean(mape_values) > ALERT_MAPE_THRESHOLD:
+        print(f"{symbol}: MAPE {np.mean(mape_values):.2f}%, tam retrain")
+        return None
+
+    model.fit(WindowSequence(X, y, np.arange(len(X)), shuffle=True), epochs=FINETUNE_EPOCHS, verbose=1)
+    return mape_values, errors, recent.index[-1]
 
 
 def predict_next_3_days(model, scaler, df):
@@ -230,43 +330,150 @@ def predict_next_3_days(model, scaler, df):
     last_window = features.values[-LOOKBACK:]
     scaled = scaler.transform(last_window)
     X_input = np.expand_dims(scaled, axis=0)
-    pred_scaled = model.predict(X_input, verbose=0)[0]
+    # tək pəncərə üçün birbaşa çağırış model.predict-in hər dəfə qurduğu data pipeline-ından xeyli sürətlidir
+    pred_scaled = np.asarray(model(X_input, training=False))[0]
     dummy = np.zeros((HORIZON, features.shape[1]))
     dummy[:, 0] = pred_scaled
 
     return scaler.inverse_transform(dummy)[:, 0]
 
 
-def run_all():
+def save_artifacts(symbol, model, scaler):
+    """Fayllar müvəqqəti addan os.replace ilə yazılır: API yarımçıq faylı oxumur.
+    Model sonuncu yazılır, onun mtime-ı model_registry üçün versiyadır"""
+    path = f"{MODEL_FOLDER}/lstm_{symbol}"
+    with open(f"{path}_scaler.pkl.tmp", "wb") as f:
+        pickle.dump(scaler, f)
+    os.replace(f"{path}_scaler.pkl.tmp", f"{path}_scaler.pkl")
+    model.save(f"{path}.tmp.keras")
+    os.replace(f"{path}.tmp.keras", f"{path}.keras")
+
+
+def data_fingerprint(df):
+    """Model girişinin (OpenTime + qiymət sütunları) və hiperparametrlərin SHA-1-i"""
+    digest = hashlib.sha1(f"{LOOKBACK}:{HORIZON}:{EPOCHS}".encode())
+    digest.update(df.index.values.astype("datetime64[ns]").tobytes())  # keş və DB yolu eyni hash versin
+    digest.update(np.ascontiguousarray(df[PRICE_COLUMNS].to_numpy(dtype=np.float64)).tobytes())
+    return digest.hexdigest()
+
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(manifest):
+    with open(f"{MANIFEST_PATH}.tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{MANIFEST_PATH}.tmp", MANIFEST_PATH)
+
+
+def init_worker(threads):
+    """Worker prosesi CPU-dan yalnız öz payını istifadə edir; TF runtime başlamazdan əvvəl çağırılmalıdır"""
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def train_coin(symbol, df, full, previous):
+    """Worker prosesində bir coin-i öyrədib artefaktları yazır; manifest sahələrini qaytarır, data azdırsa None.
+    full=False olanda mövcud model fine-tune edilir (previous: coin-in manifest sətri), alınmasa tam retrain-ə keçilir"""
+    result = None
+    if not full:
+        path = f"{MODEL_FOLDER}/lstm_{symbol}"
+        with open(f"{path}_scaler.pkl", "rb") as f:
+            scaler = pickle.load(f)
+        model = load_model(f"{path}.keras")
+        result = finetune_lstm(symbol, df, model, scaler, previous)
+        if result is not None:
+            mape_values, errors, seen_until = result
+            save_artifacts(symbol, model, scaler)
+            check_evaluation_alerts(symbol, mape_values)
+
+    mode = "finetune"
+    if result is None:
+        mode = "full"
+        model, scaler, test_data = train_lstm(symbol, df)
+        if model is None:
+            return None
+        save_artifacts(symbol, model, scaler)
+        mape_values, errors = evaluate_model(symbol, model, scaler, test_data)
+        # test hissəsi öyrədilməyib: onun son pəncərələri sürüşən xəta siyahısının başlanğıcıdır
+        errors = errors[-FINETUNE_TEST_WINDOWS:].round(4).tolist()
+        seen_until = add_features(df).index[-1]
+
+    preds = predict_next_3_days(model, scaler, df)
+    if preds is not None:
+        check_prediction_alerts(symbol, df["ClosePrice"].iloc[-1], preds)
+    return {"mode": mode, "mape": [round(float(m), 4) for m in mape_values], "errors": errors,
+            "seenUntil": pd.Timestamp(seen_until).isoformat(), "drift": round(scaler_drift(scaler, recent_features(df).values), 4)}
+
+
+def needs_full_retrain(symbol, entry, now):
+    """Model yoxdursa, manifest-də fine-tune üçün xəta tarixçəsi yoxdursa və ya son tam retrain-dən
+    FULL_RETRAIN_DAYS keçibsə True"""
+    if not entry or not entry["trained"] or not os.path.exists(f"{MODEL_FOLDER}/lstm_{symbol}.keras"):
+        return True
+    if "errors" not in entry or "seenUntil" not in entry:
+        return True
+    last_full = entry.get("lastFull")
+    return last_full is None or now - datetime.fromisoformat(last_full) >= timedelta(days=FULL_RETRAIN_DAYS)
+
+
+def run_all(workers=TRAIN_WORKERS, full=False):
+    """Coin-ləri proses pool-unda paralel öyrədir. Hər bitən coin manifest-ə yazılır; datası son
+    öyrədilmədən bəri dəyişməyən coin-lər keçilir, ona görə yarımçıq qalan işi yenidən başlatmaq olar.
+    Default olaraq mövcud modellər fine-tune edilir; full=True hamısını sıfırdan öyrədir"""
     log_file = f"{MODEL_FOLDER}/alerts.log"
     with open(log_file, "w", encoding="utf-8") as f:
         f.write(f"=== Alert Log - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ===\n\n")
-    
-    coins = get_all_coins()
-    
-    for coin in coins:
-        print(f"\nProcessing {coin}...")
 
-        model, scaler, test_data = train_lstm(coin)
-        
-        if model is None:
+    manifest = load_manifest()
+    now = datetime.now()
+    tasks = []
+    for coin in get_all_coins():
+        df = load_price_data(coin)
+        fingerprint = data_fingerprint(df)
+        entry = manifest.get(coin)
+        if entry and entry["fingerprint"] == fingerprint and (not entry["trained"] or os.path.exists(f"{MODEL_FOLDER}/lstm_{coin}.keras")):
+            print(f"{coin}: data dəyişməyib, keçilir")
             continue
-
-        model.save(f"{MODEL_FOLDER}/lstm_{coin}.keras")
-        with open(f"{MODEL_FOLDER}/lstm_{coin}_scaler.pkl", "wb") as f:
-            pickle.dump(scaler, f)
-
-        evaluate_model(coin, model, scaler, test_data)
-
-        df_latest = load_price_data(coin)
-        preds = predict_next_3_days(model, scaler, df_latest)
-
-        if preds is not None:
-            current = df_latest["ClosePrice"].iloc[-1]
-            check_prediction_alerts(coin, current, preds)
-        
-        print(f"{coin} completed")
+        tasks.append((coin, df, fingerprint, full or needs_full_retrain(coin, entry, now), entry or {}))
+    if not tasks:
+        return
+
+    workers = max(1, min(workers, len(tasks)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    full_count = sum(task[3] for task in tasks)
+    print(f"\nTraining {len(tasks)} coins ({full_count} full, {len(tasks) - full_count} fine-tune): "
+          f"{workers} workers x {threads} threads")
+    # fork TensorFlow ilə təhlükəlidir, worker-lər spawn ilə yaradılır
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker, initargs=(threads,)) as pool:
+        futures = {pool.submit(train_coin, coin, df, full_retrain, previous): (coin, len(df), fingerprint)
+                   for coin, df, fingerprint, full_retrain, previous in tasks}
+        for future in as_completed(futures):
+            coin, rows, fingerprint = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"X {coin}: Training Error: {e}")
+                continue
+            completed = datetime.now().isoformat(timespec="seconds")
+            previous = manifest.get(coin, {})
+            entry = {"fingerprint": fingerprint, "rows": rows, "trained": result is not None, "completed": completed,
+                     **(result or {"mode": None})}
+            # lastFull və drift baseline-ı yalnız tam retrain yeniləyir
+            if entry["mode"] == "full":
+                entry["lastFull"] = completed
+            else:
+                entry["lastFull"], entry["drift"] = previous.get("lastFull"), previous.get("drift")
+            manifest[coin] = entry
+            save_manifest(manifest)
+            print(f"{coin} completed ({entry['mode']})")
 
 
 if __name__ == "__main__":
-    run_all()
\ No newline at end of file
+    run_all(full="--full" in sys.argv[1:])
\ No newline at end of file
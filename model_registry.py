@@ -0,0 +1,116 @@
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from tensorflow.keras.models import load_model
+from model import MODEL_FOLDER
+
+MODEL_CACHE_SIZE = int(os.getenv("MODEL_CACHE_SIZE", "8"))  # yaddaşda saxlanan model sayı
+MODEL_PRELOAD = [s.strip() for s in os.getenv("MODEL_PRELOAD", "BTC,ETH,BNB,SOL,XRP").split(",") if s.strip()]
+
+
+def artifact_paths(symbol):
+    return f"{MODEL_FOLDER}/lstm_{symbol}.keras", f"{MODEL_FOLDER}/lstm_{symbol}_scaler.pkl"
+
+
+def artifact_version(symbol):
+    """Model faylının mtime-ı; model.run_all scaler-i əvvəl, modeli sonra os.replace ilə yazır,
+    ona görə model faylının dəyişməsi cütün tam yeniləndiyini göstərir. Fayl yoxdursa None"""
+    model_path, scaler_path = artifact_paths(symbol)
+    try:
+        os.stat(scaler_path)
+        return os.stat(model_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class ModelRegistry:
+    """Yüklənmiş (model, scaler) cütlərinin ölçü limitli LRU-su. Hər sorğuda artefaktın versiyası yoxlanır;
+    dəyişibsə yeni versiya yüklənir və köhnəsinin yerinə bir əməliyyatla qoyulur, yükləmə zamanı köhnəsi xidmət edir"""
+
+    def __init__(self, size=MODEL_CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # symbol -> (versiya, model, scaler)
+        self.loading = {}              # symbol -> Lock (eyni model paralel iki dəfə yüklənməsin)
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+        self.errors = 0
+        self.loads = 0
+        self.load_seconds = 0.0
+        self.max_load_seconds = 0.0
+
+    def _cached(self, symbol, version):
+        entry = self.entries.get(symbol)
+        if entry is not None and entry[0] == version:
+            self.entries.move_to_end(symbol)
+            return entry[1], entry[2]
+        return None
+
+    def get(self, symbol):
+        """(model, scaler) qaytarır; artefakt yoxdursa None. Yükləmə xətasında köhnə versiya (varsa) qaytarılır"""
+        version = artifact_version(symbol)
+        if version is None:
+            return None
+        with self.lock:
+            pair = self._cached(symbol, version)
+            if pair is not None:
+                self.hits += 1
+                return pair
+            self.misses += 1
+            symbol_lock = self.loading.setdefault(symbol, threading.Lock())
+
+        with symbol_lock:
+            with self.lock:
+                pair = self._cached(symbol, version)  # başqa thread artıq yükləyib
+                if pair is not None:
+                    return pair
+            return self._load(symbol, version)
+
+    def _load(self, symbol, version):
+        model_path, scaler_path = artifact_paths(symbol)
+        started = time.perf_counter()
+        try:
+            with open(scaler_path, "rb") as f:
+                scaler = pickle.load(f)
+            model = load_model(model_path)
+        except Exception as e:
+            print(f"❌ {symbol} modeli yüklənmədi: {e}")
+            with self.lock:
+                self.errors += 1
+                entry = self.entries.get(symbol)
+            return (entry[1], entry[2]) if entry is not None else None
+        elapsed = time.perf_counter() - started
+
+        with self.lock:
+            self.loads += 1
+            self.load_seconds += elapsed
+            self.max_load_seconds = max(self.max_load_seconds, elapsed)
+            if symbol in self.entries:
+                self.reloads += 1
+            self.entries[symbol] = (version, model, scaler)
+            self.entries.move_to_end(symbol)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        print(f" {symbol} modeli yükləndi ({elapsed:.2f}s)")
+        return model, scaler
+
+    def preload(self, symbols=MODEL_PRELOAD):
+        """Populyar simvolların modellərini əvvəlcədən yükləyir (ən çox cache ölçüsü qədər)"""
+        for symbol in symbols[:self.size]:
+            self.get(symbol)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": list(self.entries), "size": len(self.entries), "maxSize": self.size,
+                    "hits": self.hits, "misses": self.misses, "reloads": self.reloads, "evictions": self.evictions,
+                    "errors": self.errors, "loads": self.loads,
+                    "avgLoadSeconds": round(self.load_seconds / self.loads, 4) if self.loads else None,
+                    "maxLoadSeconds": round(self.max_load_seconds, 4)}
+
+
+models = ModelRegistry()
@@ -1,11 +1,21 @@
 from binance.spot import Spot
 import pandas as pd
+import numpy as np
 import time
 import os
+import threading
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from binance.error import ClientError
 from dotenv import load_dotenv
 from datetime import datetime
-from database import execute_non_query, execute_query
-from coins import COINS
+from database import execute_non_query, execute_query, transaction, merge_rows
+from coins import COINS, INTERVALS, BASE_INTERVAL, registry, base_symbol
+import alert
+import price_cache
+import retention
+import forecast
+from watermarks import load_watermarks, update_watermark
 
 load_dotenv()
 
@@ -13,119 +23,329 @@ API_KEY = os.getenv("API_KEY")
 API_SECRET = os.getenv("API_SECRET")
 
 client = Spot(api_key=API_KEY, api_secret=API_SECRET)
-INTERVAL = "1d"
 DEFAULT_START = datetime(2017, 8, 17)
+# Kiçik intervallar üçün geriyə yükləmə limiti, məs: "1m:30,15m:365" (gün)
+BACKFILL_DAYS = {k.strip(): int(v) for k, v in (item.split(":") for item in os.getenv("INTERVAL_BACKFILL_DAYS", "").split(",") if ":" in item)}
 
-def get_or_create_coin(pair_symbol: str) -> str:
-    symbol = pair_symbol.replace("USDT", "")
-    df = execute_query("select CoinID from dbo.Coins where PairSymbol = ?", (pair_symbol,))
+MAX_WORKERS = int(os.getenv("PIPELINE_WORKERS", "8"))
+WEIGHT_LIMIT = int(os.getenv("BINANCE_WEIGHT_LIMIT", "1200"))  # request weight / dəqiqə
+MAX_RETRIES = 5
+PAGE_LIMIT = 1000
+PAGES_PER_COMMIT = int(os.getenv("PAGES_PER_COMMIT", "5"))
+KLINES_WEIGHT = 2
+TICKER_ALL_WEIGHT = 80
+BOOK_TICKER_ALL_WEIGHT = 4
 
-    if df is not None and not df.empty:
-        return int(df.iloc[0]["CoinID"])
-    
-    execute_non_query("Insert into dbo.Coins (Symbol, PairSymbol) Values (?, ?)", [(symbol, pair_symbol)])
-    df = execute_query("select CoinID from dbo.Coins where PairSymbol = ?", (pair_symbol,))
-    return int(df.iloc[0]["CoinID"])
 
+class TokenBucket:
+    """Bütün thread-lər üçün ortaq Binance request-weight limiti"""
 
-def get_last_opentime(coin_id: int):
-    df = execute_query("select max(OpenTime) as last_open_time from dbo.PriceHistory where CoinID = ?", (coin_id,))
-    return df.iloc[0]["last_open_time"] if df is not None and df.iloc[0]["last_open_time"] is not None else None
+    def __init__(self, capacity, period=60.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
 
+    def acquire(self, weight=1):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.blocked_until and self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                wait = max(self.blocked_until - now, (weight - self.tokens) / self.rate)
+            time.sleep(wait)
 
-def save_price_history(coin_id: int, df: pd.DataFrame) -> int:
-    sql = """
-        INSERT INTO dbo.PriceHistory (CoinID, OpenTime, CloseTime, OpenPrice, HighPrice, LowPrice, ClosePrice, Volume, QuoteAssetVolume, NumberOfTrades, TakerBuyBaseVolume, TakerBuyQuoteVolume) 
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
+    def block(self, seconds):
+        """429/418 cavabından sonra bütün sorğuları dayandırır"""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0.0
 
-    rows = [(coin_id, r.open_time, r.close_time, float(r.open), float(r.high), float(r.low), float(r.close), float(r.volume), float(r.quote_asset_volume), int(r.number_of_trades), float(r.taker_buy_base_asset_volume), float(r.taker_buy_quote_asset_volume))
-        for _, r in df.iterrows()]
 
-    inserted = 0
-    for i in range(0, len(rows), 500):
+rate_limiter = TokenBucket(WEIGHT_LIMIT)
+
+
+def call_api(weight, func, *args, **kwargs):
+    for attempt in range(MAX_RETRIES):
+        rate_limiter.acquire(weight)
         try:
-            execute_non_query(sql, rows[i:i+500])
-            inserted += len(rows[i:i+500])
-        except Exception as e:
-            print(f" X Insert Error: {e}")
+            return func(*args, **kwargs)
+        except ClientError as e:
+            if e.status_code not in (429, 418) or attempt == MAX_RETRIES - 1:
+                raise
+            retry_after = (e.header or {}).get("Retry-After")
+            delay = float(retry_after) if retry_after else 2 ** attempt
+            print(f" Rate limit ({e.status_code}), waiting {delay:.0f}s")
+            rate_limiter.block(delay)
+
+
+_write_locks = {}
+_write_locks_guard = threading.Lock()
+
+
+@contextmanager
+def write_lock(keys):
+    """(CoinID, Interval) cütləri üzrə PriceHistory/AnomalyState yazılarını bu prosesdə ardıcıllaşdırır
+    (stream flush və gap backfill eyni prosesdədir). Kilidlər transaction bitənə qədər, sıra ilə tutulur"""
+    with _write_locks_guard:
+        locks = [_write_locks.setdefault(key, threading.Lock()) for key in sorted(set(keys))]
+    with ExitStack() as stack:
+        for lock in locks:
+            stack.enter_context(lock)
+        yield
+
+
+def get_or_create_coin(pair_symbol: str) -> int:
+    return registry.coin_id(pair_symbol)
+
+
+def get_last_opentime(coin_id: int, interval: str, watermarks=None):
+    """Watermark cədvəlindən oxuyur; sətir yoxdursa (köhnə data) bir dəfəlik MAX(OpenTime) edir"""
+    if watermarks is not None and (coin_id, interval) in watermarks:
+        return watermarks[(coin_id, interval)][0]
+    df = execute_query("select max(OpenTime) as last_open_time from dbo.PriceHistory where CoinID = ? and Interval = ?", (coin_id, interval))
+    if df is None or df.empty:
+        return None
+    value = df.iloc[0]["last_open_time"]
+    # boş cədvəldə DuckDB NaT, SQL Server/SQLite None qaytarır
+    return None if pd.isna(value) else pd.Timestamp(value)
+
+
+PRICE_COLUMNS = ["CoinID", "Interval", "OpenTime", "CloseTime", "OpenPrice", "HighPrice", "LowPrice", "ClosePrice", "Volume", "QuoteAssetVolume", "NumberOfTrades", "TakerBuyBaseVolume", "TakerBuyQuoteVolume"]
+RETURN_COLUMNS = ["PrevClose", "ReturnPct"]
+
+
+def price_rows(coin_id: int, interval: str, df: pd.DataFrame) -> list:
+    """DataFrame-i sütun-sütun NumPy massivlərinə çevirib pyodbc üçün tuple siyahısı qurur"""
+    n = len(df)
+    prices = df[["open", "high", "low", "close", "volume", "quote_asset_volume"]].to_numpy(dtype=np.float64).T.tolist()
+    taker = df[["taker_buy_base_asset_volume", "taker_buy_quote_asset_volume"]].to_numpy(dtype=np.float64).T.tolist()
+    trades = df["number_of_trades"].to_numpy(dtype=np.int64).tolist()
+    open_times = pd.DatetimeIndex(df["open_time"]).to_pydatetime().tolist()
+    close_times = pd.DatetimeIndex(df["close_time"]).to_pydatetime().tolist()
+    return list(zip([coin_id] * n, [interval] * n, open_times, close_times, *prices, trades, *taker))
+
+
+def return_columns(close: np.ndarray, prev_close=None) -> list:
+    """Hər bar üçün PrevClose və ReturnPct (%) sütunları; ilk bar-ın PrevClose-u prev_close-dur (yoxdursa NULL)"""
+    prev = np.empty(len(close))
+    prev[:1] = np.nan if prev_close is None else prev_close
+    prev[1:] = close[:-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct = (close - prev) / prev * 100
+    return [pd.Series(values, dtype=object).where(np.isfinite(values), None).tolist() for values in (prev, pct)]
+
+
+def previous_close(conn, coin_id: int, interval: str, before: datetime):
+    """before-dan əvvəlki son bar-ın ClosePrice-ı (clustered açar üzrə bir seek)"""
+    df = execute_query("""
+        SELECT TOP 1 ph.ClosePrice FROM dbo.PriceHistory ph
+        WHERE ph.CoinID = ? AND ph.Interval = ? AND ph.OpenTime < ?
+        ORDER BY ph.OpenTime DESC
+    """, (coin_id, interval, before), conn=conn)
+    return float(df.iloc[0, 0]) if not df.empty else None
+
+
+def relink_next_return(conn, coin_id: int, interval: str, last_open_time: datetime, last_close: float):
+    """Batch-dən sonra artıq yazılmış bar varsa (stream yeni bar-ı gap backfill-dən əvvəl commit edə bilər),
+    onun PrevClose/ReturnPct-ni batch-in son close-u ilə yenidən hesablayır"""
+    df = execute_query("""
+        SELECT TOP 1 ph.OpenTime, ph.ClosePrice FROM dbo.PriceHistory ph
+        WHERE ph.CoinID = ? AND ph.Interval = ? AND ph.OpenTime > ?
+        ORDER BY ph.OpenTime ASC
+    """, (coin_id, interval, last_open_time), conn=conn)
+    if df.empty:
+        return 0
+    prev, pct = return_columns(np.array([float(df.iloc[0, 1])]), last_close)
+    return execute_non_query(
+        "UPDATE dbo.PriceHistory SET PrevClose = ?, ReturnPct = ? WHERE CoinID = ? AND Interval = ? AND OpenTime = ?",
+        (prev[0], pct[0], coin_id, interval, pd.Timestamp(df.iloc[0, 0]).to_pydatetime()), conn=conn)
+
+
+def save_price_history(coin_id: int, interval: str, df: pd.DataFrame, conn) -> int:
+    """UQ_Coin_Interval_OpenTime üzrə idempotent bulk upsert və watermark yeniləməsi.
+    PrevClose/ReturnPct burada bir dəfə hesablanır ki, /prices/daily window function icra etməsin
+    (batch köhnə boşluğu doldurursa növbəti bar-ınkı da düzəldilir);
+    BASE_INTERVAL bar-ları AnomalyState-i yeniləyir və lazım olsa alert yazır"""
+    if df.empty:
+        return 0
+    prev_close = previous_close(conn, coin_id, interval, df["open_time"].iloc[0].to_pydatetime())
+    returns = return_columns(df["close"].to_numpy(dtype=np.float64), prev_close)
+    rows = [row + extra for row, extra in zip(price_rows(coin_id, interval, df), zip(*returns))]
+    inserted = merge_rows(conn, "dbo.PriceHistory", PRICE_COLUMNS + RETURN_COLUMNS, ["CoinID", "Interval", "OpenTime"], rows)
+    relink_next_return(conn, coin_id, interval, df["open_time"].iloc[-1].to_pydatetime(), float(df["close"].iloc[-1]))
+    if interval == BASE_INTERVAL:
+        alert.update_state(conn, coin_id, interval, df)  # anomaly yoxlaması bar yazılan kimi, eyni commit-də
+    update_watermark(conn, coin_id, interval, df["open_time"].max().to_pydatetime(), df["close_time"].max().to_pydatetime())
+    return inserted
+
+
+KLINE_COLUMNS = ["open_time", "open", "high", "low", "close", "volume", "close_time", "quote_asset_volume", "number_of_trades", "taker_buy_base_asset_volume", "taker_buy_quote_asset_volume", "ignore"]
+
+
+def klines_frame(klines: list) -> pd.DataFrame:
+    df = pd.DataFrame(klines, columns=KLINE_COLUMNS)
+    df["open_time"] = pd.to_datetime(df["open_time"], unit="ms")
+    df["close_time"] = pd.to_datetime(df["close_time"], unit="ms")
+    return df
+
+
+def fetch_klines(pair_symbol: str, interval: str, start_ts: int) -> list:
+    return call_api(KLINES_WEIGHT, client.klines, symbol=pair_symbol, interval=interval, startTime=start_ts, limit=PAGE_LIMIT)
+
+
+def save_batch(pair_symbol: str, coin_id: int, interval: str, klines: list) -> int:
+    df = klines_frame(klines)
+    with write_lock([(coin_id, interval)]), transaction() as conn:
+        inserted = save_price_history(coin_id, interval, df, conn)
+    update_cache(pair_symbol, interval, df)
     return inserted
 
 
-def process_price_history(pair_symbol: str):
-    print(f" {pair_symbol}")
+def update_cache(pair_symbol: str, interval: str, df: pd.DataFrame):
+    """Commit-dən sonra lokal Arrow keşini yeniləyir; keş xətası ingestion-u dayandırmır"""
+    try:
+        price_cache.append(base_symbol(pair_symbol), interval, df)
+    except Exception as e:
+        print(f" X {pair_symbol} {interval}: Cache Error: {e}")
+
+
+def backfill_start(interval: str) -> datetime:
+    if interval in BACKFILL_DAYS:
+        return max(DEFAULT_START, datetime.utcnow() - pd.Timedelta(days=BACKFILL_DAYS[interval]))
+    return DEFAULT_START
+
+
+def process_price_history(pair_symbol: str, interval: str, watermarks=None):
+    """Kline səhifələrini axınla yükləyir: hər PAGES_PER_COMMIT səhifə ayrıca commit olunur və
+    növbəti səhifə yazılma zamanı arxa fonda gətirilir. Batch ilə birlikdə commit olunan
+    watermark növbəti işə salınmada davam nöqtəsidir."""
     coin_id = get_or_create_coin(pair_symbol)
-    last_time = get_last_opentime(coin_id)
-    start_time = last_time + pd.Timedelta(milliseconds=1) if last_time else DEFAULT_START
+    label = f"{pair_symbol} {interval}"
+    last_time = get_last_opentime(coin_id, interval, watermarks)
+    start_time = last_time + pd.Timedelta(milliseconds=1) if last_time else backfill_start(interval)
     start_ts = int(start_time.timestamp() * 1000)
     end_ts = int(datetime.utcnow().timestamp() * 1000)
 
     if start_ts > end_ts:
-        print(" No New Data ")
-        return 0
-    
-    klines = []
-    while start_ts < end_ts:
-        data = client.klines(symbol=pair_symbol, interval=INTERVAL, startTime=start_ts, limit=1000)
-
-        if not data:
-            break
-        klines.extend(data)
-        start_ts = data[-1][0] + 1
-        time.sleep(0.3)
-
-    if not klines:
-        print(" No New Data ")
+        print(f" {label}: No New Data ")
         return 0
-    
-    df = pd.DataFrame(klines, columns=["open_time", "open", "high", "low", "close", "volume", "close_time", "quote_asset_volume", "number_of_trades", "taker_buy_base_asset_volume", "taker_buy_quote_asset_volume", "ignore"])
-    df["open_time"] = pd.to_datetime(df["open_time"], unit="ms")
-    df["close_time"] = pd.to_datetime(df["close_time"], unit="ms")
 
-    inserted = save_price_history(coin_id, df)
-    print(f" {inserted} row inserted")
+    inserted = 0
+    fetched = 0
+    batch = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        future = prefetcher.submit(fetch_klines, pair_symbol, interval, start_ts)
+        while future is not None:
+            data = future.result()
+            future = None
+            if data:
+                start_ts = data[-1][0] + 1
+                if start_ts < end_ts and len(data) == PAGE_LIMIT:
+                    future = prefetcher.submit(fetch_klines, pair_symbol, interval, start_ts)
+                # hələ bağlanmamış son kline yazılmır: insert-only MERGE onun bağlanmış versiyasını sonra rədd edərdi
+                closed_before = int(time.time() * 1000)
+                batch.extend(k for k in data if k[6] < closed_before)
+
+            if batch and (future is None or len(batch) >= PAGES_PER_COMMIT * PAGE_LIMIT):
+                try:
+                    inserted += save_batch(pair_symbol, coin_id, interval, batch)
+                except Exception as e:
+                    print(f" X {label}: Insert Error: {e}")
+                    if future is not None:
+                        future.cancel()
+                    break
+                fetched += len(batch)
+                batch = []
+
+    if not fetched:
+        print(f" {label}: No New Data ")
+        return inserted
+
+    elapsed = time.perf_counter() - started
+    print(f" {label}: {inserted} row inserted ({fetched / max(elapsed, 1e-9):,.0f} rows/s)")
     return inserted
-    
 
-def save_ticker24h(pair_symbol: str):
-    coin_id = get_or_create_coin(pair_symbol)
-    stats = client.ticker_24hr(pair_symbol)
-    sql = """
-        insert into dbo.Ticker24hStats (CoinID, SnapshotTime, OpenPrice, HighPrice, LowPrice, ClosePrice, Volume, QuoteAssetVolume, PriceChange, PriceChangePercent, NumberOfTrades)
-        values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
-    
-    row = (coin_id, datetime.utcnow(), float(stats['openPrice']), float(stats['highPrice']), float(stats['lowPrice']), float(stats['lastPrice']), float(stats['volume']), float(stats['quoteVolume']), float(stats['priceChange']), float(stats['priceChangePercent']), int(stats['count']))
-        
-    execute_non_query(sql, [row])
-    print(" Ticker24h saved ")
-
-
-def save_order_book(pair_symbol: str):
-    coin_id = get_or_create_coin(pair_symbol)
-    order_book = client.book_ticker(pair_symbol)
-    sql = """
-        insert into dbo.OrderBookSnapshot (CoinID, SnapshotTime, BidPrice, BidQty, AskPrice, AskQty)
-        values (?, ?, ?, ?, ?, ?)
-        """
-    
-    row = (coin_id, datetime.utcnow(), float(order_book["bidPrice"]), float(order_book["bidQty"]), float(order_book["askPrice"]), float(order_book["askQty"]))
 
-    execute_non_query(sql, [row])
-    print(" OrderBook saved")
+TICKER_SQL = """
+    insert into dbo.Ticker24hStats (CoinID, SnapshotTime, OpenPrice, HighPrice, LowPrice, ClosePrice, Volume, QuoteAssetVolume, PriceChange, PriceChangePercent, NumberOfTrades)
+    values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+
+ORDER_BOOK_SQL = """
+    insert into dbo.OrderBookSnapshot (CoinID, SnapshotTime, BidPrice, BidQty, AskPrice, AskQty)
+    values (?, ?, ?, ?, ?, ?)
+    """
+
+
+def ticker_row(coin_id: int, snapshot_time: datetime, stats: dict) -> tuple:
+    return (coin_id, snapshot_time, float(stats['openPrice']), float(stats['highPrice']), float(stats['lowPrice']), float(stats['lastPrice']), float(stats['volume']), float(stats['quoteVolume']), float(stats['priceChange']), float(stats['priceChangePercent']), int(stats['count']))
+
+
+def order_book_row(coin_id: int, snapshot_time: datetime, order_book: dict) -> tuple:
+    return (coin_id, snapshot_time, float(order_book["bidPrice"]), float(order_book["bidQty"]), float(order_book["askPrice"]), float(order_book["askQty"]))
+
+
+def save_snapshots(pair_symbols) -> int:
+    """Bütün simvollar üçün 24h ticker və book ticker-i bir sorğu ilə alır, hər cədvələ bir batch yazır"""
+    tracked = set(pair_symbols)
+    snapshot_time = datetime.utcnow()
+    all_stats = call_api(TICKER_ALL_WEIGHT, client.ticker_24hr)
+    all_books = call_api(BOOK_TICKER_ALL_WEIGHT, client.book_ticker)
+
+    ticker_rows = [ticker_row(get_or_create_coin(s["symbol"]), snapshot_time, s) for s in all_stats if s["symbol"] in tracked]
+    book_rows = [order_book_row(get_or_create_coin(b["symbol"]), snapshot_time, b) for b in all_books if b["symbol"] in tracked]
+
+    with transaction() as conn:
+        if ticker_rows:
+            execute_non_query(TICKER_SQL, ticker_rows, conn=conn)
+        if book_rows:
+            execute_non_query(ORDER_BOOK_SQL, book_rows, conn=conn)
+    print(f" Snapshots saved: {len(ticker_rows)} ticker, {len(book_rows)} order book")
+    return len(ticker_rows)
 
 
 def main():
     print("\n===== Binance ETL =====\n")
-    
+
+    started = time.monotonic()
     total = 0
-    for i, coin in enumerate(COINS, 1):
-        print(f"[{i}/{len(COINS)}] ", end="")
-        total += process_price_history(coin)
-        save_ticker24h(coin)
-        save_order_book(coin)
-        time.sleep(1)
-    print(f"\nTotal: {total} rows\n")
+    registry.ensure(COINS)
+
+    try:
+        save_snapshots(COINS)
+    except Exception as e:
+        print(f" Snapshot Error: {e}")
+
+    try:
+        written, purged = retention.run()
+        print(f" Retention: {sum(written.values())} rollup rows, {purged} purged")
+    except Exception as e:
+        print(f" Retention Error: {e}")
+
+    watermarks = load_watermarks()
+    tasks = [(coin, interval) for interval in INTERVALS for coin in COINS]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(process_price_history, coin, interval, watermarks): (coin, interval) for coin, interval in tasks}
+        for i, future in enumerate(as_completed(futures), 1):
+            coin, interval = futures[future]
+            try:
+                total += future.result()
+                print(f"[{i}/{len(tasks)}] {coin} {interval} done")
+            except Exception as e:
+                print(f"[{i}/{len(tasks)}] {coin} {interval} Error: {e}")
+
+    try:
+        forecast.run()
+    except Exception as e:
+        print(f" Forecast Error: {e}")
+    print(f"\nTotal: {total} rows ({time.monotonic() - started:.1f}s)\n")
 
 
 if __name__ == "__main__":
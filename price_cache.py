@@ -0,0 +1,185 @@
+import os
+import glob
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+from dotenv import load_dotenv
+from database import fetch_frame
+from coins import registry, BASE_INTERVAL, INTERVALS
+
+load_dotenv()
+
+CACHE_FOLDER = os.getenv("PRICE_CACHE_FOLDER", "cache")
+COMPACT_AFTER = 32  # bu qədər hissədən sonra dataset bir fayla birləşdirilir
+
+PRICE_FIELDS = ["OpenPrice", "HighPrice", "LowPrice", "ClosePrice", "Volume", "QuoteAssetVolume", "TakerBuyBaseVolume", "TakerBuyQuoteVolume"]
+SCHEMA = pa.schema(
+    [("OpenTime", pa.timestamp("ms")), ("CloseTime", pa.timestamp("ms"))]
+    + [(name, pa.float64()) for name in PRICE_FIELDS]
+    + [("NumberOfTrades", pa.int64())])
+
+DB_DTYPES = {"OpenTime": "datetime64[ns]", "CloseTime": "datetime64[ns]", **{name: "float64" for name in PRICE_FIELDS}, "NumberOfTrades": "int64"}
+
+KLINE_FIELDS = {
+    "OpenTime": "open_time", "CloseTime": "close_time", "OpenPrice": "open", "HighPrice": "high", "LowPrice": "low",
+    "ClosePrice": "close", "Volume": "volume", "QuoteAssetVolume": "quote_asset_volume", "NumberOfTrades": "number_of_trades",
+    "TakerBuyBaseVolume": "taker_buy_base_asset_volume", "TakerBuyQuoteVolume": "taker_buy_quote_asset_volume"}
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _lock(symbol, interval):
+    with _locks_guard:
+        return _locks.setdefault((symbol, interval), threading.RLock())
+
+
+def dataset_dir(symbol, interval=BASE_INTERVAL):
+    return os.path.join(CACHE_FOLDER, interval, symbol)
+
+
+def _parts(symbol, interval):
+    return sorted(glob.glob(os.path.join(dataset_dir(symbol, interval), "*.arrow")))
+
+
+def _to_table(df):
+    """DB sütun adları ilə DataFrame-i sabit sxemli Arrow cədvəlinə çevirir"""
+    arrays = [pa.array(pd.to_datetime(df["OpenTime"]).to_numpy(dtype="datetime64[ms]")),
+              pa.array(pd.to_datetime(df["CloseTime"]).to_numpy(dtype="datetime64[ms]"))]
+    arrays += [pa.array(df[name].to_numpy(dtype="float64")) for name in PRICE_FIELDS]
+    arrays += [pa.array(df["NumberOfTrades"].to_numpy(dtype="int64"))]
+    return pa.Table.from_arrays(arrays, schema=SCHEMA)
+
+
+def _write(path, table):
+    tmp = path + ".tmp"
+    with pa.OSFile(tmp, "wb") as sink:
+        with ipc.new_file(sink, SCHEMA) as writer:
+            writer.write_table(table)
+    os.replace(tmp, path)
+
+
+def _part_path(symbol, interval, table):
+    first = table.column("OpenTime")[0].value
+    return os.path.join(dataset_dir(symbol, interval), f"{first:016d}.arrow")
+
+
+def read_table(symbol, interval=BASE_INTERVAL):
+    """Bütün hissələri memory-map edir; nəticə diskə istinad edir, kopyalanmır"""
+    parts = _parts(symbol, interval)
+    if not parts:
+        return None
+    tables = [ipc.open_file(pa.memory_map(path, "r")).read_all() for path in parts]
+    return pa.concat_tables(tables)
+
+
+def last_open_time(symbol, interval=BASE_INTERVAL):
+    parts = _parts(symbol, interval)
+    if not parts:
+        return None
+    column = ipc.open_file(pa.memory_map(parts[-1], "r")).read_all().column("OpenTime")
+    return pd.Timestamp(column[len(column) - 1].as_py())
+
+
+def load(symbol, interval=BASE_INTERVAL, columns=None, limit=None):
+    """Keşdən pandas DataFrame qaytarır (OpenTime index); keş yoxdursa None.
+    _lock yalnız bu prosesdə qoruyur: pipeline/stream prosesi həmin an compact/rebuild edərsə hissə faylı
+    silinmiş və ya birləşmiş fayl köhnə hissələrlə üst-üstə düşmüş ola bilər. Bu halda, eləcə də bar-lar
+    arasında interval-dan böyük boşluq olanda None qaytarılır və çağıran DB-dən oxuyur"""
+    try:
+        table = read_table(symbol, interval)
+    except (OSError, pa.ArrowInvalid) as e:
+        print(f" {symbol} {interval}: keş oxunmadı ({e}), DB istifadə olunur")
+        return None
+    if table is None:
+        return None
+    if limit is not None:
+        table = table.slice(0, limit)
+    if columns is not None:
+        table = table.select(["OpenTime"] + [c for c in columns if c != "OpenTime"])
+    df = table.to_pandas(split_blocks=True, self_destruct=False).set_index("OpenTime")
+    df.index = df.index.astype("datetime64[ns]")  # DB yolu ilə eyni dtype (Arrow sxemi ms saxlayır)
+    if not (df.index.is_monotonic_increasing and df.index.is_unique):
+        return None
+    step = interval_delta(interval)
+    if step is not None and len(df) > 1 and (np.diff(df.index.values) > step.to_timedelta64()).any():
+        return None
+    return df
+
+
+def compact(symbol, interval=BASE_INTERVAL):
+    with _lock(symbol, interval):
+        parts = _parts(symbol, interval)
+        if len(parts) <= 1:
+            return
+        table = read_table(symbol, interval).combine_chunks()
+        _write(parts[0], table)
+        for path in parts[1:]:
+            os.remove(path)
+
+
+def rebuild(symbol, interval=BASE_INTERVAL):
+    """Dataset-i DB-dən sıfırdan qurur"""
+    coin_id = registry.id_for_symbol(symbol)
+    if coin_id is None:
+        return 0
+    df = fetch_frame(f"""
+        SELECT {", ".join(DB_DTYPES)}
+        FROM dbo.PriceHistory
+        WHERE CoinID = ? AND Interval = ?
+        ORDER BY OpenTime
+    """, DB_DTYPES, params=(coin_id, interval))
+    if df is None or df.empty:
+        return 0
+
+    with _lock(symbol, interval):
+        os.makedirs(dataset_dir(symbol, interval), exist_ok=True)
+        for path in _parts(symbol, interval):
+            os.remove(path)
+        table = _to_table(df)
+        _write(_part_path(symbol, interval, table), table)
+    return len(df)
+
+
+def append(symbol, interval, klines_df):
+    """Commit olunmuş kline batch-ini (pipeline.klines_frame formatı) keşə əlavə edir"""
+    df = klines_df.rename(columns={v: k for k, v in KLINE_FIELDS.items()}).sort_values("OpenTime")
+    with _lock(symbol, interval):
+        last = last_open_time(symbol, interval)
+        if last is None:
+            return rebuild(symbol, interval)
+
+        older = df["OpenTime"][df["OpenTime"] <= last]
+        if not older.empty:
+            cached = read_table(symbol, interval).column("OpenTime").to_numpy().astype("datetime64[ns]")
+            if not np.isin(older.to_numpy(dtype="datetime64[ns]"), cached).all():
+                # Stream yeni bar-ı gap backfill-dən əvvəl commit edib: arxadakı boşluq DB-dən doldurulur
+                return rebuild(symbol, interval)
+
+        df = df[df["OpenTime"] > last]
+        if df.empty:
+            return 0
+        step = interval_delta(interval)
+        if step is not None and df["OpenTime"].iloc[0] - last > step:
+            # Keş əvvəlki batch-i qaçırıb, boşluq qalmasın deyə DB-dən yenidən qurulur
+            return rebuild(symbol, interval)
+
+        table = _to_table(df)
+        _write(_part_path(symbol, interval, table), table)
+        if len(_parts(symbol, interval)) > COMPACT_AFTER:
+            compact(symbol, interval)
+    return len(df)
+
+
+def interval_delta(interval):
+    units = {"m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+    unit = units.get(interval[-1])
+    return pd.Timedelta(**{unit: int(interval[:-1])}) if unit else None
+
+
+if __name__ == "__main__":
+    for interval in INTERVALS:
+        for symbol in registry.symbols():
+            print(f" {symbol} {interval}: {rebuild(symbol, interval)} rows cached")
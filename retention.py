@@ -0,0 +1,254 @@
+import os
+from datetime import datetime, timedelta
+import pandas as pd
+from dotenv import load_dotenv
+import database
+from database import execute_query, execute_non_query, transaction, merge_rows, fetch_frame
+
+load_dotenv()
+
+# Retention siyasəti: xam snapshot-lar RAW_DAYS, saatlıq rollup HOURLY_DAYS gün saxlanılır, günlük rollup həmişəlik
+RAW_DAYS = int(os.getenv("RETENTION_RAW_DAYS", "7"))
+HOURLY_DAYS = int(os.getenv("RETENTION_HOURLY_DAYS", "365"))
+ROLLUP_CHUNK = timedelta(days=7)    # ilk işə salınmada xam data bu ölçülü pəncərələrlə oxunur
+MAX_POINTS = 1000                   # tier seçimində hədəf nöqtə sayı
+PARTITIONS_AHEAD = 2                # SQL Server-də irəlidə hazır saxlanılan boş aylıq partition-lar
+
+GRANULARITY = {"1h": "h", "1d": "D"}
+TIERS = [  # (tier, addım) incədən qabağa
+    ("raw", timedelta(0)),
+    ("1h", timedelta(hours=1)),
+    ("1d", timedelta(days=1)),
+]
+
+TICKER = {
+    "source": "dbo.Ticker24hStats",
+    "rollup": "dbo.Ticker24hStatsRollup",
+    "raw_dtypes": {"CoinID": "int64", "SnapshotTime": "datetime64[ns]", "ClosePrice": "float64", "Volume": "float64", "QuoteAssetVolume": "float64"},
+    "columns": ["OpenPrice", "HighPrice", "LowPrice", "ClosePrice", "Volume", "QuoteAssetVolume", "Samples"],
+}
+ORDER_BOOK = {
+    "source": "dbo.OrderBookSnapshot",
+    "rollup": "dbo.OrderBookRollup",
+    "raw_dtypes": {"CoinID": "int64", "SnapshotTime": "datetime64[ns]", "BidPrice": "float64", "BidQty": "float64", "AskPrice": "float64", "AskQty": "float64"},
+    "columns": ["BidPrice", "BidQty", "AskPrice", "AskQty", "MaxSpread", "Samples"],
+}
+DATASETS = {"ticker": TICKER, "orderbook": ORDER_BOOK}
+
+
+def _rollup_dtypes(dataset):
+    return {"CoinID": "int64", "BucketTime": "datetime64[ns]", **{c: "int64" if c == "Samples" else "float64" for c in dataset["columns"]}}
+
+
+def aggregate_ticker(df, key):
+    """Ticker snapshot-larını (və ya incə rollup-ı) bucket üzrə OHLC-yə yığır"""
+    raw = "Samples" not in df
+    grouped = df.sort_values(key).groupby(["CoinID", "BucketTime"], sort=False)
+    return pd.DataFrame({
+        "OpenPrice": grouped["ClosePrice" if raw else "OpenPrice"].first(),
+        "HighPrice": grouped["ClosePrice" if raw else "HighPrice"].max(),
+        "LowPrice": grouped["ClosePrice" if raw else "LowPrice"].min(),
+        "ClosePrice": grouped["ClosePrice"].last(),
+        "Volume": grouped["Volume"].last(),
+        "QuoteAssetVolume": grouped["QuoteAssetVolume"].last(),
+        "Samples": grouped.size() if raw else grouped["Samples"].sum(),
+    }).reset_index()
+
+
+def aggregate_order_book(df, key):
+    """Order book snapshot-larını bucket üzrə ortalayır (rollup-dan yığılanda Samples ilə çəkili)"""
+    df = df.copy()
+    if "Samples" not in df:
+        df["Samples"] = 1
+        df["MaxSpread"] = df["AskPrice"] - df["BidPrice"]
+    for column in ("BidPrice", "BidQty", "AskPrice", "AskQty"):
+        df[column] = df[column] * df["Samples"]
+    grouped = df.groupby(["CoinID", "BucketTime"], sort=False)
+    result = grouped[["BidPrice", "BidQty", "AskPrice", "AskQty", "Samples"]].sum()
+    for column in ("BidPrice", "BidQty", "AskPrice", "AskQty"):
+        result[column] = result[column] / result["Samples"]
+    result["MaxSpread"] = grouped["MaxSpread"].max()
+    return result.reset_index()
+
+
+AGGREGATE = {"ticker": aggregate_ticker, "orderbook": aggregate_order_book}
+
+
+def _last_bucket(dataset, granularity):
+    df = execute_query(f"SELECT MAX(BucketTime) AS LastBucket FROM {dataset['rollup']} WHERE Granularity = ?", params=(granularity,))
+    if df is None or df.empty or pd.isna(df["LastBucket"].iloc[0]):
+        return None
+    return pd.Timestamp(df["LastBucket"].iloc[0])
+
+
+def _read_source(dataset, granularity, start, end):
+    """'1h' xam snapshot-lardan, '1d' isə saatlıq rollup-dan qurulur"""
+    if granularity == "1h":
+        dtypes = dataset["raw_dtypes"]
+        query = f"""
+            SELECT {", ".join(dtypes)} FROM {dataset['source']}
+            WHERE SnapshotTime >= ? AND SnapshotTime < ?
+        """
+        key = "SnapshotTime"
+    else:
+        dtypes = _rollup_dtypes(dataset)
+        query = f"""
+            SELECT {", ".join(dtypes)} FROM {dataset['rollup']}
+            WHERE Granularity = '1h' AND BucketTime >= ? AND BucketTime < ?
+        """
+        key = "BucketTime"
+    return fetch_frame(query, dtypes, params=(start.to_pydatetime(), end.to_pydatetime())), key
+
+
+def _first_source_time(dataset, granularity):
+    if granularity == "1h":
+        df = execute_query(f"SELECT MIN(SnapshotTime) AS First FROM {dataset['source']}")
+    else:
+        df = execute_query(f"SELECT MIN(BucketTime) AS First FROM {dataset['rollup']} WHERE Granularity = '1h'")
+    if df is None or df.empty or pd.isna(df["First"].iloc[0]):
+        return None
+    return pd.Timestamp(df["First"].iloc[0])
+
+
+def rollup(name, granularity, now=None):
+    """Son bucket-dan (natamam ola bilər) başlayaraq rollup-ı inkremental yeniləyir; yazılan sətir sayını qaytarır"""
+    dataset = DATASETS[name]
+    now = pd.Timestamp(now or datetime.now())
+    start = _last_bucket(dataset, granularity) or _first_source_time(dataset, granularity)
+    if start is None:
+        return 0
+    start = start.floor(GRANULARITY[granularity])
+
+    written = 0
+    columns = ["CoinID", "Granularity", "BucketTime"] + dataset["columns"]
+    while start <= now:
+        end = start + ROLLUP_CHUNK
+        df, key = _read_source(dataset, granularity, start, end)
+        if df is None:
+            raise RuntimeError(f"{dataset['source']} oxuna bilmədi")
+        if not df.empty:
+            df["BucketTime"] = df[key].dt.floor(GRANULARITY[granularity])
+            result = AGGREGATE[name](df, key)
+            result["Granularity"] = granularity
+            rows = list(zip(*(result[c].tolist() for c in columns)))
+            with transaction() as conn:
+                merge_rows(conn, dataset["rollup"], columns, ["CoinID", "Granularity", "BucketTime"], rows, update_columns=dataset["columns"])
+            written += len(rows)
+        start = end
+    return written
+
+
+def _month_start(value, months=0):
+    month = value.year * 12 + value.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+def _boundaries(conn):
+    df = execute_query("""
+        SELECT CAST(v.value AS DATETIME2) AS Boundary
+        FROM sys.partition_range_values v
+        JOIN sys.partition_functions f ON f.function_id = v.function_id
+        WHERE f.name = 'PF_SnapshotMonth'
+        ORDER BY v.boundary_id
+    """, conn=conn)
+    return [pd.Timestamp(b).to_pydatetime() for b in df["Boundary"]]
+
+
+def ensure_partitions(now=None):
+    """SQL Server: cari və irəlidəki aylar üçün boş partition-lar yaradır (boş partition-u bölmək data köçürmür)"""
+    now = now or datetime.now()
+    with transaction() as conn:
+        existing = _boundaries(conn)
+        for months in range(PARTITIONS_AHEAD + 1):
+            boundary = _month_start(now, months)
+            if existing and boundary <= existing[-1]:
+                continue
+            execute_non_query("ALTER PARTITION SCHEME PS_SnapshotMonth NEXT USED [PRIMARY]", conn=conn)
+            execute_non_query("ALTER PARTITION FUNCTION PF_SnapshotMonth() SPLIT RANGE (?)", (boundary,), conn=conn)
+
+
+def purge_raw(cutoff):
+    """cutoff-dan köhnə xam snapshot-ları silir. SQL Server-də yalnız tam köhnə aylar partition TRUNCATE ilə
+    (böyük DELETE olmadan) atılır; SQLite/DuckDB-də sadə DELETE"""
+    if database.backend.name != "mssql":
+        return sum(execute_non_query(f"DELETE FROM {d['source']} WHERE SnapshotTime < ?", (cutoff,)) for d in DATASETS.values())
+
+    dropped = 0
+    with transaction() as conn:
+        for boundary in _boundaries(conn):
+            if boundary > cutoff:
+                break
+            # RANGE RIGHT: 1-ci partition bütünlüklə boundary-dən əvvəldir
+            for dataset in DATASETS.values():
+                execute_non_query(f"TRUNCATE TABLE {dataset['source']} WITH (PARTITIONS (1))", conn=conn)
+            execute_non_query("ALTER PARTITION FUNCTION PF_SnapshotMonth() MERGE RANGE (?)", (boundary,), conn=conn)
+            dropped += 1
+    return dropped
+
+
+def purge_hourly(cutoff):
+    return sum(execute_non_query(f"DELETE FROM {d['rollup']} WHERE Granularity = '1h' AND BucketTime < ?", (cutoff,)) for d in DATASETS.values())
+
+
+def run(now=None):
+    """Rollup-ları yeniləyir, sonra retention siyasətini tətbiq edir. Data rollup olunmamış qalmasın deyə
+    silmə sərhədi həm də son rollup bucket-ı ilə məhdudlaşdırılır"""
+    now = now or datetime.now()
+    if database.backend.name == "mssql":
+        ensure_partitions(now)
+
+    written = {}
+    for name in DATASETS:
+        written[name] = rollup(name, "1h", now) + rollup(name, "1d", now)
+
+    hourly_done = min((_last_bucket(d, "1h") for d in DATASETS.values()), key=lambda t: t or pd.Timestamp.min)
+    daily_done = min((_last_bucket(d, "1d") for d in DATASETS.values()), key=lambda t: t or pd.Timestamp.min)
+    purged = 0
+    if hourly_done is not None:
+        purged += purge_raw(min(now - timedelta(days=RAW_DAYS), hourly_done.to_pydatetime()))
+    if daily_done is not None:
+        purged += purge_hourly(min(now - timedelta(days=HOURLY_DAYS), daily_done.to_pydatetime()))
+    return written, purged
+
+
+def choose_tier(start, end, step=None, now=None):
+    """Aralığı təmin edən ən qaba tier: addımı step-dən böyük olmayan və retention-ı start-ı əhatə edən"""
+    now = now or datetime.now()
+    step = step if step is not None else (end - start) / MAX_POINTS
+    available = {"raw": now - timedelta(days=RAW_DAYS), "1h": now - timedelta(days=HOURLY_DAYS), "1d": datetime.min}
+    candidates = [tier for tier, size in TIERS if available[tier] <= start]
+    fitting = [tier for tier in candidates if dict(TIERS)[tier] <= step]
+    return fitting[-1] if fitting else candidates[0]
+
+
+def read_query(name, coin_id, start, end, step=None):
+    """Tiered oxuma sorğusu: (tier, sorğu, dtypes, parametrlər); zaman sütunu həmişə BucketTime adlanır.
+    API sorğunu öz async executor-unda (timeout ilə) icra edir"""
+    dataset = DATASETS[name]
+    tier = choose_tier(start, end, step)
+    if tier == "raw":
+        dtypes = {("BucketTime" if c == "SnapshotTime" else c): t for c, t in dataset["raw_dtypes"].items()}
+        columns = ", ".join("SnapshotTime AS BucketTime" if c == "SnapshotTime" else c for c in dataset["raw_dtypes"])
+        return tier, f"""
+            SELECT {columns} FROM {dataset['source']}
+            WHERE CoinID = ? AND SnapshotTime >= ? AND SnapshotTime <= ?
+            ORDER BY SnapshotTime
+        """, dtypes, (coin_id, start, end)
+
+    dtypes = _rollup_dtypes(dataset)
+    return tier, f"""
+        SELECT {", ".join(dtypes)} FROM {dataset['rollup']}
+        WHERE CoinID = ? AND Granularity = ? AND BucketTime >= ? AND BucketTime <= ?
+        ORDER BY BucketTime
+    """, dtypes, (coin_id, tier, start, end)
+
+
+def read(name, coin_id, start, end, step=None):
+    """Tiered oxuma: (tier, DataFrame) qaytarır; DataFrame-də zaman sütunu həmişə BucketTime adlanır"""
+    tier, query, dtypes, params = read_query(name, coin_id, start, end, step)
+    return tier, fetch_frame(query, dtypes, params=params)
+
+
+if __name__ == "__main__":
+    written, purged = run()
+    print(f"Rollup rows: {written}, purged: {purged}")
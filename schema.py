@@ -0,0 +1,280 @@
+import re
+import sys
+
+# Cədvəllər T-SQL formasında bir dəfə təsvir olunur, digər dialektlər üçün SQL buradan yaradılır.
+# database.sql faylı: py schema.py mssql > database.sql
+# Mövcud bazalardakı dəyişikliklər migrations.py-dakı miqrasiyalarla edilir; hər dəyişiklikdə SCHEMA_VERSION artırılır.
+
+SCHEMA_VERSION = 8
+
+# Snapshot cədvəlləri SQL Server-də aylıq partition-lara bölünür (retention.py köhnə ayları TRUNCATE edir)
+PARTITION_SCHEME = "PS_SnapshotMonth(SnapshotTime)"
+PARTITIONING = [
+    "CREATE PARTITION FUNCTION PF_SnapshotMonth (DATETIME2) AS RANGE RIGHT FOR VALUES ()",
+    "CREATE PARTITION SCHEME PS_SnapshotMonth AS PARTITION PF_SnapshotMonth ALL TO ([PRIMARY])",
+]
+
+DIALECTS = ("mssql", "sqlite", "duckdb")
+
+TABLES = [
+    ("SchemaVersions", [
+        ("Version", "INT", "NOT NULL PRIMARY KEY"),
+        ("Description", "NVARCHAR(200)", "NOT NULL"),
+        ("AppliedDate", "DATETIME2", "NOT NULL DEFAULT SYSDATETIME()"),
+    ], []),
+
+    ("Coins", [
+        ("CoinID", "INT", "IDENTITY(1,1) PRIMARY KEY"),
+        ("Symbol", "NVARCHAR(10)", "NOT NULL UNIQUE"),
+        ("PairSymbol", "NVARCHAR(20)", "NOT NULL UNIQUE"),
+        ("Name", "NVARCHAR(50)", ""),
+        ("CreatedDate", "DATETIME2", "DEFAULT SYSDATETIME()"),
+    ], []),
+
+    ("PriceHistory", [
+        ("PriceID", "BIGINT", "IDENTITY(1,1) NOT NULL"),
+        ("CoinID", "INT", "NOT NULL"),
+        ("Interval", "VARCHAR(4)", "NOT NULL DEFAULT '1d'", "1m, 15m, 1h, 1d ..."),
+        ("OpenTime", "DATETIME2", "NOT NULL"),
+        ("CloseTime", "DATETIME2", "NOT NULL"),
+        ("OpenPrice", "DECIMAL(18,8)", "NOT NULL"),
+        ("HighPrice", "DECIMAL(18,8)", "NOT NULL"),
+        ("LowPrice", "DECIMAL(18,8)", "NOT NULL"),
+        ("ClosePrice", "DECIMAL(18,8)", "NOT NULL"),
+        ("Volume", "DECIMAL(30,8)", "NOT NULL"),
+        ("QuoteAssetVolume", "DECIMAL(30,8)", "NOT NULL"),
+        ("NumberOfTrades", "INT", "NOT NULL"),
+        ("TakerBuyBaseVolume", "DECIMAL(30,8)", "NOT NULL"),
+        ("TakerBuyQuoteVolume", "DECIMAL(30,8)", "NOT NULL"),
+        ("InsertedDate", "DATETIME2", "DEFAULT SYSDATETIME()"),
+        ("PrevClose", "DECIMAL(18,8)", "NULL", "əvvəlki bar-ın ClosePrice-ı, ingestion zamanı yazılır"),
+        ("ReturnPct", "FLOAT", "NULL", "(ClosePrice - PrevClose) / PrevClose * 100"),
+    ], [
+        "CONSTRAINT PK_PriceHistory PRIMARY KEY NONCLUSTERED (PriceID)",
+        "CONSTRAINT FK_PriceHistory_Coins FOREIGN KEY (CoinID) REFERENCES dbo.Coins(CoinID)",
+        "CONSTRAINT UQ_Coin_Interval_OpenTime UNIQUE CLUSTERED (CoinID, Interval, OpenTime)",
+    ]),
+
+    ("IngestionWatermarks", [
+        ("CoinID", "INT", "NOT NULL"),
+        ("Interval", "VARCHAR(4)", "NOT NULL"),
+        ("LastOpenTime", "DATETIME2", "NOT NULL"),
+        ("LastCloseTime", "DATETIME2", "NOT NULL"),
+        ("UpdatedDate", "DATETIME2", "NOT NULL DEFAULT SYSDATETIME()"),
+    ], [
+        "CONSTRAINT PK_IngestionWatermarks PRIMARY KEY (CoinID, Interval)",
+        "CONSTRAINT FK_IngestionWatermarks_Coins FOREIGN KEY (CoinID) REFERENCES dbo.Coins(CoinID)",
+    ]),
+
+    ("Ticker24hStats", [
+        ("StatID", "BIGINT", "IDENTITY(1,1) NOT NULL"),
+        ("CoinID", "INT", "NOT NULL"),
+        ("SnapshotTime", "DATETIME2", "NOT NULL", "snapshot zamanı"),
+        ("OpenPrice", "DECIMAL(18,8)", "NOT NULL"),
+        ("HighPrice", "DECIMAL(18,8)", "NOT NULL"),
+        ("LowPrice", "DECIMAL(18,8)", "NOT NULL"),
+        ("ClosePrice", "DECIMAL(18,8)", "NOT NULL"),
+        ("Volume", "DECIMAL(30,8)", "NOT NULL"),
+        ("QuoteAssetVolume", "DECIMAL(30,8)", "NOT NULL"),
+        ("PriceChange", "DECIMAL(18,8)", "NULL"),
+        ("PriceChangePercent", "DECIMAL(8,2)", "NULL"),
+        ("NumberOfTrades", "INT", "NULL"),
+        ("InsertedDate", "DATETIME2", "DEFAULT SYSDATETIME()"),
+    ], [
+        f"CONSTRAINT PK_Ticker24hStats PRIMARY KEY NONCLUSTERED (StatID, SnapshotTime) ON {PARTITION_SCHEME}",
+        "CONSTRAINT FK_Ticker24hStats_Coins FOREIGN KEY (CoinID) REFERENCES dbo.Coins(CoinID)",
+    ]),
+
+    ("OrderBookSnapshot", [
+        ("SnapshotID", "BIGINT", "IDENTITY(1,1) NOT NULL"),
+        ("CoinID", "INT", "NOT NULL"),
+        ("SnapshotTime", "DATETIME2", "NOT NULL"),
+        ("BidPrice", "DECIMAL(18,8)", "NOT NULL"),
+        ("BidQty", "DECIMAL(30,8)", "NOT NULL"),
+        ("AskPrice", "DECIMAL(18,8)", "NOT NULL"),
+        ("AskQty", "DECIMAL(30,8)", "NOT NULL"),
+        ("InsertedDate", "DATETIME2", "DEFAULT SYSDATETIME()"),
+    ], [
+        f"CONSTRAINT PK_OrderBookSnapshot PRIMARY KEY NONCLUSTERED (SnapshotID, SnapshotTime) ON {PARTITION_SCHEME}",
+        "CONSTRAINT FK_OrderBook_Coins FOREIGN KEY (CoinID) REFERENCES dbo.Coins(CoinID)",
+    ]),
+
+    # Retention rollup-ları: Granularity '1h' (RETENTION_HOURLY_DAYS qədər) və '1d' (həmişəlik)
+    ("Ticker24hStatsRollup", [
+        ("CoinID", "INT", "NOT NULL"),
+        ("Granularity", "VARCHAR(4)", "NOT NULL", "1h, 1d"),
+        ("BucketTime", "DATETIME2", "NOT NULL"),
+        ("OpenPrice", "DECIMAL(18,8)", "NOT NULL", "bucket-dakı ilk son qiymət"),
+        ("HighPrice", "DECIMAL(18,8)", "NOT NULL"),
+        ("LowPrice", "DECIMAL(18,8)", "NOT NULL"),
+        ("ClosePrice", "DECIMAL(18,8)", "NOT NULL"),
+        ("Volume", "DECIMAL(30,8)", "NOT NULL", "bucket sonundakı 24 saatlıq həcm"),
+        ("QuoteAssetVolume", "DECIMAL(30,8)", "NOT NULL"),
+        ("Samples", "INT", "NOT NULL"),
+    ], [
+        "CONSTRAINT PK_Ticker24hStatsRollup PRIMARY KEY (CoinID, Granularity, BucketTime)",
+        "CONSTRAINT FK_Ticker24hStatsRollup_Coins FOREIGN KEY (CoinID) REFERENCES dbo.Coins(CoinID)",
+    ]),
+
+    ("OrderBookRollup", [
+        ("CoinID", "INT", "NOT NULL"),
+        ("Granularity", "VARCHAR(4)", "NOT NULL"),
+        ("BucketTime", "DATETIME2", "NOT NULL"),
+        ("BidPrice", "DECIMAL(18,8)", "NOT NULL", "orta"),
+        ("BidQty", "DECIMAL(30,8)", "NOT NULL"),
+        ("AskPrice", "DECIMAL(18,8)", "NOT NULL"),
+        ("AskQty", "DECIMAL(30,8)", "NOT NULL"),
+        ("MaxSpread", "DECIMAL(18,8)", "NOT NULL"),
+        ("Samples", "INT", "NOT NULL"),
+    ], [
+        "CONSTRAINT PK_OrderBookRollup PRIMARY KEY (CoinID, Granularity, BucketTime)",
+        "CONSTRAINT FK_OrderBookRollup_Coins FOREIGN KEY (CoinID) REFERENCES dbo.Coins(CoinID)",
+    ]),
+
+    ("AnomalyAlerts", [
+        ("AlertID", "INT", "IDENTITY(1,1) PRIMARY KEY"),
+        ("CoinID", "INT", "NOT NULL"),
+        ("AlertTime", "DATETIME2", "NOT NULL DEFAULT SYSDATETIME()"),
+        ("AlertDate", "DATE", "NOT NULL"),
+        ("CurrentPrice", "DECIMAL(18,8)", "NOT NULL"),
+        ("ReferencePrice", "DECIMAL(18,8)", "NOT NULL"),
+        ("ChangePercent", "DECIMAL(10,4)", "NOT NULL"),
+        ("AlertType", "NVARCHAR(30)", "NOT NULL"),
+    ], [
+        "CONSTRAINT FK_AnomalyAlerts_Coins FOREIGN KEY (CoinID) REFERENCES dbo.Coins(CoinID)",
+    ]),
+
+    # Pipeline-ın hər yeni bar-da O(1) yenilədiyi rolling anomaly vəziyyəti (alert.py, AnomalyState)
+    ("AnomalyState", [
+        ("CoinID", "INT", "NOT NULL"),
+        ("Interval", "VARCHAR(4)", "NOT NULL"),
+        ("LastOpenTime", "DATETIME2", "NOT NULL"),
+        ("LastClose", "FLOAT", "NOT NULL"),
+        ("Bars", "INT", "NOT NULL", "pəncərədəki close sayı (≤ 100)"),
+        ("Changes", "VARBINARY(800)", "NOT NULL", "son |dəyişiklik| %-lərinin ring buffer-i (float64)"),
+        ("Position", "INT", "NOT NULL", "ring buffer-də növbəti yazılacaq yer"),
+        ("SumAbs", "FLOAT", "NOT NULL", "ring buffer-in cəmi"),
+        ("UpdatedDate", "DATETIME2", "NOT NULL DEFAULT SYSDATETIME()"),
+    ], [
+        "CONSTRAINT PK_AnomalyState PRIMARY KEY (CoinID, Interval)",
+        "CONSTRAINT FK_AnomalyState_Coins FOREIGN KEY (CoinID) REFERENCES dbo.Coins(CoinID)",
+    ]),
+
+    # forecast.py-ın hər pipeline dövründən sonra yazdığı 3 günlük proqnozlar
+    ("Predictions", [
+        ("CoinID", "INT", "NOT NULL"),
+        ("BaseTime", "DATETIME2", "NOT NULL", "proqnozun əsaslandığı son bar (BASE_INTERVAL watermark-ı)"),
+        ("CurrentPrice", "DECIMAL(18,8)", "NOT NULL"),
+        ("Day1", "DECIMAL(18,8)", "NOT NULL"),
+        ("Day2", "DECIMAL(18,8)", "NOT NULL"),
+        ("Day3", "DECIMAL(18,8)", "NOT NULL"),
+        ("ModelVersion", "BIGINT", "NOT NULL", "model faylının mtime-ı (ns)"),
+        ("CreatedDate", "DATETIME2", "NOT NULL DEFAULT SYSDATETIME()"),
+    ], [
+        "CONSTRAINT PK_Predictions PRIMARY KEY (CoinID, BaseTime)",
+        "CONSTRAINT FK_Predictions_Coins FOREIGN KEY (CoinID) REFERENCES dbo.Coins(CoinID)",
+    ]),
+]
+
+INDEXES = [
+    # Analitik scan-lər (stats) üçün; yalnız SQL Server-də yaradılır
+    "CREATE NONCLUSTERED COLUMNSTORE INDEX NCCI_PriceHistory ON dbo.PriceHistory "
+    "(CoinID, Interval, OpenTime, OpenPrice, HighPrice, LowPrice, ClosePrice, Volume, NumberOfTrades)",
+    f"CREATE CLUSTERED INDEX CX_Ticker24hStats_CoinID_SnapshotTime ON dbo.Ticker24hStats (CoinID, SnapshotTime) ON {PARTITION_SCHEME}",
+    f"CREATE INDEX IX_Ticker24hStats_SnapshotTime ON dbo.Ticker24hStats (SnapshotTime) ON {PARTITION_SCHEME}",
+    f"CREATE CLUSTERED INDEX CX_OrderBookSnapshot_CoinID_SnapshotTime ON dbo.OrderBookSnapshot (CoinID, SnapshotTime) ON {PARTITION_SCHEME}",
+    f"CREATE INDEX IX_OrderBookSnapshot_SnapshotTime ON dbo.OrderBookSnapshot (SnapshotTime) ON {PARTITION_SCHEME}",
+    "CREATE UNIQUE INDEX UQ_AnomalyAlerts_CoinID_AlertDate ON dbo.AnomalyAlerts (CoinID, AlertDate)",
+]
+
+_TYPES = {
+    "sqlite": [(r"^(BIG)?INT$", "INTEGER"), (r"^N?VARCHAR\(.*\)$", "TEXT"), (r"^DATETIME2$", "TIMESTAMP"),
+               (r"^DECIMAL\(.*\)$", "REAL"), (r"^FLOAT$", "REAL"), (r"^VARBINARY\(.*\)$", "BLOB")],
+    "duckdb": [(r"^N?VARCHAR\(.*\)$", "VARCHAR"), (r"^DATETIME2$", "TIMESTAMP"),
+               (r"^DECIMAL\(.*\)$", "DOUBLE"), (r"^FLOAT$", "DOUBLE"), (r"^VARBINARY\(.*\)$", "BLOB")],
+}
+
+
+def column_type(sql_type, dialect):
+    for pattern, replacement in _TYPES.get(dialect, []):
+        if re.match(pattern, sql_type):
+            return replacement
+    return sql_type
+
+
+def _portable(sql):
+    """T-SQL-ə xas hissələri (dbo., CLUSTERED, partition scheme, constraint adları, SYSDATETIME) təmizləyir"""
+    sql = sql.replace("dbo.", "").replace(f" ON {PARTITION_SCHEME}", "")
+    sql = re.sub(r"\b(NON)?CLUSTERED\s+", "", sql)
+    sql = re.sub(r"^CONSTRAINT\s+\w+\s+", "", sql)
+    return sql.replace("SYSDATETIME()", "CURRENT_TIMESTAMP")
+
+
+def _column(table, column, dialect):
+    """(sətir, şərh) cütü qaytarır"""
+    name, sql_type, options = column[:3]
+    comment = column[3] if len(column) > 3 and dialect == "mssql" else None
+    if dialect == "mssql":
+        return " ".join(part for part in (name, sql_type, options) if part), comment
+
+    if "IDENTITY" in options:
+        if dialect == "sqlite":
+            return f"{name} INTEGER PRIMARY KEY AUTOINCREMENT", None
+        suffix = "PRIMARY KEY" if "PRIMARY KEY" in options else "NOT NULL"
+        return f"{name} {column_type(sql_type, dialect)} DEFAULT nextval('seq_{table}_{name}') {suffix}", None
+    return " ".join(part for part in (name, column_type(sql_type, dialect), _portable(options)) if part), None
+
+
+def create_table(table, columns, constraints, dialect):
+    identity = any("IDENTITY" in c[2] for c in columns)
+    if dialect == "sqlite" and identity:
+        # SQLite-da autoincrement yalnız inline INTEGER PRIMARY KEY ilə mümkündür
+        constraints = [c for c in constraints if "PRIMARY KEY" not in c]
+    if dialect != "mssql":
+        constraints = [_portable(c) for c in constraints]
+
+    lines = [_column(table, c, dialect) for c in columns] + [(c, None) for c in constraints]
+    body = []
+    for i, (text, comment) in enumerate(lines):
+        text += "," if i < len(lines) - 1 else ""
+        body.append(f"    {text}  -- {comment}" if comment else f"    {text}")
+    prefix = "dbo." if dialect == "mssql" else ""
+    exists = "" if dialect == "mssql" else "IF NOT EXISTS "
+    return f"CREATE TABLE {exists}{prefix}{table} (\n" + "\n".join(body) + "\n)"
+
+
+def create_index(index, dialect):
+    if dialect == "mssql":
+        return index
+    if "COLUMNSTORE" in index:
+        return None
+    return re.sub(r"^CREATE (UNIQUE )?INDEX ", r"CREATE \1INDEX IF NOT EXISTS ", _portable(index))
+
+
+def statements(dialect):
+    """Dialekt üçün CREATE əmrlərinin siyahısı (ardıcıl icra olunur)"""
+    result = list(PARTITIONING) if dialect == "mssql" else []
+    for table, columns, constraints in TABLES:
+        if dialect == "duckdb":
+            result += [f"CREATE SEQUENCE IF NOT EXISTS seq_{table}_{c[0]}" for c in columns if "IDENTITY" in c[2]]
+        result.append(create_table(table, columns, constraints, dialect))
+    result += [sql for sql in (create_index(index, dialect) for index in INDEXES) if sql]
+    return result
+
+
+def render(dialect):
+    if dialect != "mssql":
+        return ";\n\n".join(statements(dialect)) + ";\n"
+
+    parts = ["CREATE DATABASE BinanceDB;\nGO", "USE BinanceDB;\nGO", ";\n".join(PARTITIONING) + ";\nGO"]
+    parts += [create_table(*table, dialect) + ";\nGO" for table in TABLES]
+    parts.append(";\n".join(INDEXES) + ";\nGO")
+    parts.append(f"INSERT INTO dbo.SchemaVersions (Version, Description) VALUES ({SCHEMA_VERSION}, 'database.sql');\nGO")
+    return "\n\n".join(parts)
+
+
+if __name__ == "__main__":
+    dialect = sys.argv[1] if len(sys.argv) > 1 else "mssql"
+    if dialect not in DIALECTS:
+        sys.exit(f"Dialekt {DIALECTS} arasında olmalıdır")
+    sys.stdout.write(render(dialect))
@@ -0,0 +1,188 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import websocket
+from dotenv import load_dotenv
+from database import execute_non_query, transaction
+from coins import COINS, INTERVALS, registry
+from watermarks import load_watermarks
+from pipeline import TICKER_SQL, ORDER_BOOK_SQL, MAX_WORKERS, klines_frame, save_price_history, process_price_history, update_cache, write_lock
+
+load_dotenv()
+
+STREAM_URL = os.getenv("BINANCE_STREAM_URL", "wss://stream.binance.com:9443")
+FLUSH_SECONDS = float(os.getenv("STREAM_FLUSH_SECONDS", "1"))
+FLUSH_SIZE = int(os.getenv("STREAM_FLUSH_SIZE", "500"))
+RECV_TIMEOUT = 30
+MAX_RECONNECT_DELAY = 60
+
+
+def stream_url(pair_symbols, intervals) -> str:
+    streams = []
+    for pair in pair_symbols:
+        name = pair.lower()
+        streams += [f"{name}@kline_{interval}" for interval in intervals]
+        streams += [f"{name}@bookTicker", f"{name}@miniTicker"]
+    return f"{STREAM_URL}/stream?streams=" + "/".join(streams)
+
+
+class MicroBatcher:
+    """Stream mesajlarını yığır: bağlanmış kline-lar tam saxlanılır, ticker və book ticker hər simvol üçün sonuncuya qədər sıxılır"""
+
+    def __init__(self, flush_size=FLUSH_SIZE, flush_seconds=FLUSH_SECONDS):
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        self.klines = {}
+        self.tickers = {}
+        self.books = {}
+        self.size = 0
+        self.last_flush = time.monotonic()
+
+    def add_kline(self, pair_symbol, interval, kline):
+        with self.lock:
+            self.klines.setdefault((pair_symbol, interval), []).append(kline)
+            self.size += 1
+
+    def add_ticker(self, pair_symbol, row):
+        with self.lock:
+            self.tickers[pair_symbol] = row
+            self.size += 1
+
+    def add_book(self, pair_symbol, row):
+        with self.lock:
+            self.books[pair_symbol] = row
+            self.size += 1
+
+    def due(self):
+        with self.lock:
+            return self.size > 0 and (self.size >= self.flush_size or time.monotonic() - self.last_flush >= self.flush_seconds)
+
+    def drain(self):
+        with self.lock:
+            batch = (self.klines, self.tickers, self.books)
+            self.klines, self.tickers, self.books = {}, {}, {}
+            self.size = 0
+            self.last_flush = time.monotonic()
+        return batch
+
+    def restore(self, batch):
+        """Yazıla bilməyən batch-i geri qaytarır: kline-lar yenilərin qabağına qoyulur, ticker/book yalnız yenisi gəlməyibsə"""
+        klines, tickers, books = batch
+        with self.lock:
+            for key, rows in klines.items():
+                self.klines[key] = rows + self.klines.get(key, [])
+                self.size += len(rows)
+            for target, latest in ((self.tickers, tickers), (self.books, books)):
+                for pair_symbol, row in latest.items():
+                    if pair_symbol not in target:
+                        target[pair_symbol] = row
+                        self.size += 1
+
+
+def handle_message(batcher, message):
+    data = message.get("data", message)
+    event = data.get("e")
+    pair_symbol = data.get("s")
+
+    if event == "kline":
+        k = data["k"]
+        if k["x"]:
+            kline = [k["t"], k["o"], k["h"], k["l"], k["c"], k["v"], k["T"], k["q"], k["n"], k["V"], k["Q"], "0"]
+            batcher.add_kline(pair_symbol, k["i"], kline)
+    elif event == "24hrMiniTicker":
+        open_price, close_price = float(data["o"]), float(data["c"])
+        change = close_price - open_price
+        row = [datetime.utcfromtimestamp(data["E"] / 1000), open_price, float(data["h"]), float(data["l"]), close_price, float(data["v"]), float(data["q"]), change, change / open_price * 100 if open_price else None, None]
+        batcher.add_ticker(pair_symbol, row)
+    elif "b" in data and "a" in data:
+        row = [datetime.utcnow(), float(data["b"]), float(data["B"]), float(data["a"]), float(data["A"])]
+        batcher.add_book(pair_symbol, row)
+
+
+def flush(batcher):
+    """Batch-i bir transaction-da yazır; xəta olarsa batch batcher-ə qaytarılır ki, bağlanmış kline-lar itməsin
+    (əks halda növbəti flush watermark-ı onlardan irəli aparar və REST backfill onları bir daha gətirməz)"""
+    batch = batcher.drain()
+    klines, tickers, books = batch
+    try:
+        ids = registry.ensure(set(tickers) | set(books) | {pair for pair, _ in klines})
+        frames = {key: klines_frame(rows) for key, rows in klines.items()}
+        inserted = 0
+        with write_lock([(ids[p], i) for p, i in frames]), transaction() as conn:
+            for (pair_symbol, interval), df in frames.items():
+                inserted += save_price_history(ids[pair_symbol], interval, df, conn)
+            if tickers:
+                execute_non_query(TICKER_SQL, [(ids[p], *row) for p, row in tickers.items()], conn=conn)
+            if books:
+                execute_non_query(ORDER_BOOK_SQL, [(ids[p], *row) for p, row in books.items()], conn=conn)
+    except Exception:
+        batcher.restore(batch)
+        raise
+    for (pair_symbol, interval), df in frames.items():
+        update_cache(pair_symbol, interval, df)
+    if inserted:
+        print(f" Stream: {inserted} kline inserted")
+
+
+def flush_loop(batcher, stop):
+    while not stop.is_set():
+        if batcher.due():
+            try:
+                flush(batcher)
+            except Exception as e:
+                print(f" X Stream flush error: {e}")
+        stop.wait(0.05)
+    if batcher.size:
+        flush(batcher)
+
+
+def backfill_gaps(pair_symbols, intervals):
+    """Yenidən qoşulduqdan sonra itirilmiş kline-ları REST ilə tamamlayır"""
+    watermarks = load_watermarks()
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for pair_symbol in pair_symbols:
+            for interval in intervals:
+                executor.submit(process_price_history, pair_symbol, interval, watermarks)
+
+
+def run(pair_symbols=COINS, intervals=INTERVALS):
+    print("\n===== Binance Stream =====\n")
+    registry.ensure(pair_symbols)
+    batcher = MicroBatcher()
+    stop = threading.Event()
+    writer = threading.Thread(target=flush_loop, args=(batcher, stop), daemon=True)
+    writer.start()
+
+    url = stream_url(pair_symbols, intervals)
+    delay = 1
+    try:
+        while True:
+            ws = None
+            try:
+                ws = websocket.create_connection(url, timeout=RECV_TIMEOUT)
+                print(f" Connected: {len(pair_symbols)} symbols, intervals {', '.join(intervals)}")
+                # Stream artıq açıqdır, ona görə REST backfill ilə stream arasında boşluq qalmır
+                threading.Thread(target=backfill_gaps, args=(pair_symbols, intervals), daemon=True).start()
+                delay = 1
+                while True:
+                    handle_message(batcher, json.loads(ws.recv()))
+            except (websocket.WebSocketException, OSError, ValueError) as e:
+                print(f" Stream disconnected ({e}), reconnecting in {delay}s")
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+            finally:
+                if ws is not None:
+                    ws.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        writer.join()
+
+
+if __name__ == "__main__":
+    run()
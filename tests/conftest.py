@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# Testlər müvəqqəti SQLite bazası və Arrow keşi ilə işləyir; database modulu import zamanı env-i oxuyur
+TEST_FOLDER = tempfile.mkdtemp(prefix="binance-tests-")
+os.environ["DB_BACKEND"] = "sqlite"
+os.environ["DB_PATH"] = os.path.join(TEST_FOLDER, "test.db")
+os.environ["PRICE_CACHE_FOLDER"] = os.path.join(TEST_FOLDER, "cache")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
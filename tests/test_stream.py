@@ -0,0 +1,146 @@
+import base64
+import hashlib
+import json
+import socket
+import struct
+import threading
+import time
+
+import pytest
+import websocket
+
+import stream
+from coins import registry
+from database import execute_query
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+DAY_MS = 86_400_000
+START_MS = 1_600_000_000_000 // DAY_MS * DAY_MS
+
+
+def kline_message(pair_symbol, day, closed=True, close=100.0):
+    open_time = START_MS + day * DAY_MS
+    k = {"t": open_time, "T": open_time + DAY_MS - 1, "s": pair_symbol, "i": "1d", "o": str(close), "c": str(close),
+         "h": str(close * 1.01), "l": str(close * 0.99), "v": "10", "n": 5, "x": closed, "q": "1000", "V": "4", "Q": "400"}
+    return {"stream": f"{pair_symbol.lower()}@kline_1d", "data": {"e": "kline", "E": open_time, "s": pair_symbol, "k": k}}
+
+
+def ticker_message(pair_symbol, close):
+    return {"stream": f"{pair_symbol.lower()}@miniTicker",
+            "data": {"e": "24hrMiniTicker", "E": START_MS, "s": pair_symbol, "c": str(close), "o": "100", "h": "110", "l": "90", "v": "1", "q": "100"}}
+
+
+def book_message(pair_symbol, bid):
+    return {"stream": f"{pair_symbol.lower()}@bookTicker", "data": {"u": 1, "s": pair_symbol, "b": str(bid), "B": "1", "a": str(bid + 1), "A": "2"}}
+
+
+def ws_frame(payload):
+    header = bytes([0x81])
+    if len(payload) < 126:
+        return header + bytes([len(payload)]) + payload
+    return header + bytes([126]) + struct.pack("!H", len(payload)) + payload
+
+
+class StandInServer:
+    """Binance combined stream-in lokal əvəzi: hər qoşulmada növbəti mesaj dəstini göndərib bağlantını qırır"""
+
+    def __init__(self, sessions):
+        self.sessions = list(sessions)
+        self.connections = 0
+        self.sock = socket.create_server(("127.0.0.1", 0))
+        self.url = f"ws://127.0.0.1:{self.sock.getsockname()[1]}"
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            conn, _ = self.sock.accept()
+            with conn:
+                request = b""
+                while b"\r\n\r\n" not in request:
+                    request += conn.recv(4096)
+                headers = dict(line.split(": ", 1) for line in request.decode().split("\r\n")[1:] if ": " in line)
+                accept = base64.b64encode(hashlib.sha1((headers["Sec-WebSocket-Key"] + WS_GUID).encode()).digest()).decode()
+                conn.sendall(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                              f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+                messages = self.sessions[self.connections] if self.connections < len(self.sessions) else []
+                self.connections += 1
+                for message in messages:
+                    conn.sendall(ws_frame(json.dumps(message).encode()))
+
+
+def stored_closes(pair_symbol):
+    df = execute_query("SELECT ph.OpenTime, ph.ClosePrice FROM dbo.PriceHistory ph WHERE ph.CoinID = ? ORDER BY ph.OpenTime",
+                       (registry.coin_id(pair_symbol),))
+    return [float(c) for c in df["ClosePrice"]]
+
+
+def test_handle_message_batches_closed_klines_and_latest_tickers():
+    batcher = stream.MicroBatcher(flush_size=4, flush_seconds=3600)
+    stream.handle_message(batcher, kline_message("BTCUSDT", 0, closed=False))
+    stream.handle_message(batcher, kline_message("BTCUSDT", 0))
+    stream.handle_message(batcher, ticker_message("BTCUSDT", 101))
+    assert not batcher.due()
+    stream.handle_message(batcher, ticker_message("BTCUSDT", 102))
+    stream.handle_message(batcher, book_message("BTCUSDT", 50))
+    assert batcher.due()
+
+    klines, tickers, books = batcher.drain()
+    assert [k[0] for k in klines[("BTCUSDT", "1d")]] == [START_MS]
+    assert tickers["BTCUSDT"][4] == 102.0
+    assert books["BTCUSDT"][1] == 50.0
+    assert batcher.size == 0 and not batcher.due()
+
+
+def test_flush_restores_batch_when_write_fails(monkeypatch):
+    batcher = stream.MicroBatcher(flush_size=100, flush_seconds=3600)
+    stream.handle_message(batcher, kline_message("ETHUSDT", 0, close=10))
+    stream.handle_message(batcher, ticker_message("ETHUSDT", 10))
+
+    def failing_save(*args):
+        raise RuntimeError("db down")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(stream, "save_price_history", failing_save)
+        with pytest.raises(RuntimeError):
+            stream.flush(batcher)
+    assert stored_closes("ETHUSDT") == []
+
+    stream.handle_message(batcher, kline_message("ETHUSDT", 1, close=11))
+    stream.flush(batcher)
+    assert stored_closes("ETHUSDT") == [10.0, 11.0]
+    assert batcher.size == 0
+
+
+def test_run_reconnects_and_backfills(monkeypatch):
+    server = StandInServer([
+        [kline_message("BNBUSDT", 0, close=1), kline_message("BNBUSDT", 1, closed=False), ticker_message("BNBUSDT", 1), book_message("BNBUSDT", 1)],
+        [kline_message("BNBUSDT", 1, close=2), kline_message("BNBUSDT", 2, close=3)],
+    ])
+    monkeypatch.setattr(stream, "STREAM_URL", server.url)
+
+    backfills = []
+    monkeypatch.setattr(stream, "backfill_gaps", lambda pairs, intervals: backfills.append(tuple(pairs)))
+
+    connect = websocket.create_connection
+
+    def create_connection(url, **kwargs):
+        if server.connections >= 2:
+            raise KeyboardInterrupt
+        return connect(url, **kwargs)
+
+    monkeypatch.setattr(stream.websocket, "create_connection", create_connection)
+    monkeypatch.setattr(stream.time, "sleep", lambda seconds: None)
+
+    stream.run(["BNBUSDT"], ["1d"])
+    monkeypatch.undo()
+
+    assert server.connections == 2
+    for _ in range(50):  # backfill ayrı thread-də başlayır
+        if len(backfills) == 2:
+            break
+        time.sleep(0.01)
+    assert backfills == [("BNBUSDT",), ("BNBUSDT",)]
+    assert stored_closes("BNBUSDT") == [1.0, 2.0, 3.0]
+    coin_id = registry.coin_id("BNBUSDT")
+    assert len(execute_query("SELECT * FROM dbo.Ticker24hStats WHERE CoinID = ?", (coin_id,))) == 1
+    assert len(execute_query("SELECT * FROM dbo.OrderBookSnapshot WHERE CoinID = ?", (coin_id,))) == 1
@@ -0,0 +1,31 @@
+import pandas as pd
+from datetime import datetime
+from database import execute_query, execute_non_query, merge_rows
+
+WATERMARK_COLUMNS = ["CoinID", "Interval", "LastOpenTime", "LastCloseTime", "UpdatedDate"]
+
+
+def load_watermarks(conn=None):
+    """Bütün (CoinID, Interval) cütləri üçün son yüklənmiş OpenTime/CloseTime-ı bir sorğu ilə qaytarır"""
+    df = execute_query("SELECT CoinID, Interval, LastOpenTime, LastCloseTime FROM dbo.IngestionWatermarks", conn=conn)
+    if df is None:
+        return None
+    return {(int(r.CoinID), r.Interval): (pd.Timestamp(r.LastOpenTime), pd.Timestamp(r.LastCloseTime)) for r in df.itertuples(index=False)}
+
+
+def update_watermark(conn, coin_id, interval, last_open_time, last_close_time):
+    """Watermark-ı insert batch-i ilə eyni transaction-da irəli çəkir (geri getmir)"""
+    merge_rows(conn, "dbo.IngestionWatermarks", WATERMARK_COLUMNS, ["CoinID", "Interval"],
+               [(coin_id, interval, last_open_time, last_close_time, datetime.now())],
+               update_columns=WATERMARK_COLUMNS[2:], only_if_greater="LastOpenTime")
+    touch_watermarks(conn, [coin_id], interval)
+
+
+def touch_watermarks(conn, coin_ids, interval):
+    """LastOpenTime irəli getməsə də (gap fill, PrevClose düzəlişi, alert) UpdatedDate-i yeniləyir:
+    API nəticə keşi MAX(UpdatedDate)-i generation kimi oxuyur"""
+    if not coin_ids:
+        return
+    now = datetime.now()
+    execute_non_query("UPDATE dbo.IngestionWatermarks SET UpdatedDate = ? WHERE CoinID = ? AND Interval = ?",
+                      [(now, coin_id, interval) for coin_id in coin_ids], conn=conn)